@@ -1,6 +1,13 @@
+import os
+import hashlib
+from typing import List
 from app.core.config import settings
 from fastapi import APIRouter, File, UploadFile, HTTPException
-from app.tasks.cad_tasks import (process_dwg_file, process_dxf_file, process_pdf_file, process_image_file)
+from app.tasks.cad_tasks import (process_dwg_file, process_dxf_file, process_pdf_file, process_image_file,
+                                 process_batch_files)
+from app.services.cad_service import rebind_result_filename
+from app.utils.file_utils import save_upload_file, remove_temp_file
+from app.database.redis import cache_get, cache_set
 router = APIRouter()
 
 # 支持的文件类型和对应的处理任务
@@ -13,23 +20,38 @@ SUPPORTED_FILE_TYPES = {
     ".jpeg": process_image_file
 }
 
+# 不支持格式的错误提示模板（支持列表只拼一次，出错时才format）
+_UNSUPPORTED = "不支持的文件格式：{ext}。目前仅支持 " + ", ".join(SUPPORTED_FILE_TYPES) + " 格式。"
+
 @router.post("/upload_and_process")
 async def upload_and_process_file(file: UploadFile = File(...)):
     try:
-        # 获取文件后缀
-        file_ext = file.filename.lower().split('.')[-1]
-        file_ext = f".{file_ext}"
-        # 检查文件类型是否支持
-        if file_ext not in SUPPORTED_FILE_TYPES:
+        # 获取文件后缀并查找对应任务（一次dict查找完成校验+分发）
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        task_func = SUPPORTED_FILE_TYPES.get(file_ext)
+        if task_func is None:
             raise HTTPException (
                 status_code=400,
-                detail=f"不支持的文件格式：{file_ext}。目前仅支持 {', '.join (SUPPORTED_FILE_TYPES.keys ())} 格式。"
+                detail=_UNSUPPORTED.format(ext=file_ext)
             )
-        # 读取文件内容
-        file_content = await file.read()
-        # 根据文件类型分发到对应的任务
-        task_func = SUPPORTED_FILE_TYPES[file_ext]
-        task = task_func.delay(file_content, file.filename)
+        # 流式落盘，只把文件路径交给任务（避免整个文件进内存、进Redis）
+        hasher = hashlib.sha256()
+        file_path = await save_upload_file(file, hasher)
+        # 相同内容+相同类型的文件已处理成功过，直接复用原任务结果（文件名换成本次上传的）
+        cache_key = f"cad:{hasher.hexdigest()}:{file_ext}:{settings.OCR_VERSION}"
+        cached_task_id = cache_get(cache_key)
+        if cached_task_id is not None:
+            from celery.result import AsyncResult
+            cached_task = AsyncResult(cached_task_id)
+            if cached_task.successful() and cached_task.result.get("status") == "success":
+                remove_temp_file(file_path)
+                return {
+                    "task_id": cached_task_id,
+                    "status": "completed",
+                    "result": rebind_result_filename(cached_task.result, file.filename)
+                }
+        task = task_func.delay(file_path, file.filename)
+        cache_set(cache_key, task.id)
         # 返回任务ID以供查询
         return {
             "task_id": task.id, 
@@ -41,6 +63,35 @@ async def upload_and_process_file(file: UploadFile = File(...)):
         import traceback
         raise HTTPException (status_code=500, detail=f"文件转换失败: {str (e)}")
 
+# 批量处理只支持图片/PDF（先OCR，再整体提交DashScope批处理审查）
+BATCH_FILE_TYPES = {".pdf", ".png", ".jpg", ".jpeg"}
+
+@router.post("/upload_and_process_batch")
+async def upload_and_process_batch(files: List[UploadFile] = File(...)):
+    # 先统一校验类型，避免落盘到一半才发现不支持的文件
+    for file in files:
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        if file_ext not in BATCH_FILE_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"批量处理不支持的文件格式：{file_ext}。目前仅支持 {', '.join(sorted(BATCH_FILE_TYPES))} 格式。"
+            )
+    file_paths = []
+    try:
+        for file in files:
+            file_paths.append(await save_upload_file(file))
+        task = process_batch_files.delay(file_paths, [file.filename for file in files])
+    except Exception as e:
+        for file_path in file_paths:
+            remove_temp_file(file_path)
+        raise HTTPException(status_code=500, detail=f"提交批量处理任务失败: {str(e)}")
+    # 结果（与files顺序一致的列表）通过/task/{task_id}查询
+    return {
+        "task_id": task.id,
+        "status": "processing",
+        "message": f"{len(files)}个文件的批量处理任务已提交"
+    }
+
 @router.get("/task/{task_id}")
 
 async def get_task_status(task_id: str):
@@ -60,8 +111,12 @@ async def get_task_status(task_id: str):
                 "error": str (task.result)
             }
     else:
-        return {
+        response = {
             "task_id": task_id,
             "status": "processing",
             "message": "文件正在处理中，请稍后查询"
         }
+        # PDF任务会逐页上报OCR进度
+        if task.state == "PROGRESS":
+            response["progress"] = task.info
+        return response
@@ -1,27 +1,32 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException
-import tempfile
 import os
-from app.services.ocr_service import perform_ocr_service, extract_text_from_file
+import anyio
+from app.services.ocr_service import perform_ocr_service, extract_text_from_file, ocr_batcher
 # 修正：从已有的CAD tasks导入异步任务（不是cad_service）
 from app.tasks.cad_tasks import async_render_cad_to_image
+from app.utils.file_utils import save_upload_file
 # 新增：导入你已有的celery_app（用于查询任务状态）
 from app.core.celery_config import celery_app
+from app.core.config import settings
+from app.database.redis import wait_task_done
 from celery.result import AsyncResult
 
 # 步骤1：先定义router变量
 router = APIRouter()
 
+# 需要特殊处理的后缀 -> 文件类型，其余按普通图片同步OCR
+FILE_TYPE_MAP = {".pdf": "pdf", ".dxf": "dxf", ".dwg": "dwg"}
+
 # 新增：查询异步任务结果的接口
 @router.get("/task/{task_id}")
 async def get_ocr_task_result(task_id: str):
     try:
-        # 用msgpack反序列化
         task = AsyncResult(task_id, app=celery_app)
         
         if task.state == 'PENDING':
             return {"status": "processing", "message": "CAD文件正在处理中"}
         elif task.state == 'SUCCESS':
-            img_bytes = task.result  # msgpack会自动反序列化字节
+            img_bytes = task.result  # msgpack结果直接就是PNG字节，无需再解码
             file_type = "dwg" if "dwg" in task_id else "dxf"
             ocr_result = perform_ocr_service(img_bytes, file_type)
             return {"status": "success", "task_id": task_id, "ocr_result": ocr_result}
@@ -30,16 +35,21 @@ async def get_ocr_task_result(task_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
+# 阻塞等待任务完成后再返回结果（Redis BLPOP完成通知，客户端不用反复轮询）
+@router.get("/task/{task_id}/wait")
+async def wait_ocr_task_result(task_id: str):
+    if not AsyncResult(task_id, app=celery_app).ready():
+        await wait_task_done(task_id, settings.TASK_WAIT_TIMEOUT)
+    return await get_ocr_task_result(task_id)
+
 # 步骤2：OCR识别主接口
 @router.post("/recognize")
 async def ocr_recognize(file: UploadFile = File(...)):
     try:
-        filename = file.filename.lower()
-        if filename.endswith('.pdf'):
-            # PDF同步处理（不变）
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                tmp.write(await file.read())
-                tmp_path = tmp.name
+        file_type = FILE_TYPE_MAP.get(os.path.splitext(file.filename)[1].lower(), "image")
+        if file_type == "pdf":
+            # PDF同步处理：流式落盘，不再整体读入内存
+            tmp_path = await save_upload_file(file)
             
             class TempUploadFile:
                 def __init__(self, path, name):
@@ -50,8 +60,11 @@ async def ocr_recognize(file: UploadFile = File(...)):
                         return f.read()
             
             temp_file = TempUploadFile(tmp_path, file.filename)
-            text = extract_text_from_file(temp_file)
-            os.remove(tmp_path)
+            try:
+                # 读盘+识别都是阻塞操作，放到线程池执行，不占用事件循环
+                text = await anyio.to_thread.run_sync(extract_text_from_file, temp_file)
+            finally:
+                await anyio.Path(tmp_path).unlink(missing_ok=True)
             
             return {
                 "status": "success" if "[提取失败]" not in text else "failed",
@@ -62,12 +75,12 @@ async def ocr_recognize(file: UploadFile = File(...)):
                 }
             }
         else:
-            file_content = await file.read()
-            if filename.endswith(('.dwg', '.dxf')):
+            if file_type in ("dwg", "dxf"):
                 # DWG/DXF异步处理（调用已有的Celery任务）
-                file_type = "dwg" if filename.endswith('.dwg') else "dxf"
+                # 流式落盘后只传路径，Worker端mmap读取
+                file_path = await save_upload_file(file)
                 # 触发异步任务
-                task = async_render_cad_to_image.delay(file_content, file_type)
+                task = async_render_cad_to_image.delay(file_path, file_type)
                 # 返回任务ID
                 return {
                     "status": "processing",
@@ -76,9 +89,9 @@ async def ocr_recognize(file: UploadFile = File(...)):
                     "message": "CAD文件已提交异步处理，请调用 /task/{task_id} 查询结果"
                 }
             else:
-                # 普通图片同步处理
-                file_type = "image"
-                result = perform_ocr_service(file_content, file_type)
+                # 普通图片同步处理（本进程OCR，需要完整字节；经批处理器合并后在线程池识别）
+                file_content = await file.read()
+                result = await ocr_batcher.submit(file_content, file_type)
                 return result
 
     except Exception as e:
@@ -1,11 +1,16 @@
+import os
 import logging
-import io
 import asyncio
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+from celery import chain, group
+from celery.result import GroupResult
 from app.core.config import settings
-from app.services.ocr_strategy_service import ocr_strategy_service  # 你的OCR模块
+from app.tasks.cad_tasks import render_task  # CAD/PDF渲染异步任务
+from app.tasks.ocr_tasks import ocr_task  # OCR异步任务
 from app.tasks.review_tasks import async_ai_review  # AI审查异步任务
+from app.utils.file_utils import save_upload_file, remove_temp_file
+from app.database.redis import wait_task_done
 
 # ========== 修复1：正确导入Celery实例 ==========
 from app.core.celery_config import celery_app  
@@ -14,14 +19,26 @@ from app.core.celery_config import celery_app
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# ========== 新增：PDF转图片的依赖（先安装：pip install pdf2image pillow） ==========
-try:
-    from pdf2image import convert_from_bytes
-    from PIL import Image
-except ImportError:
-    logger.warning("未安装pdf2image/pillow，PDF文件处理功能不可用！请执行：pip install pdf2image pillow")
-    convert_from_bytes = None
-    Image = None
+# 支持的上传文件类型
+SUPPORTED_REVIEW_TYPES = ["dwg", "dxf", "pdf"]
+# 后缀（带点）-> 任务链使用的文件类型
+FILE_TYPE_MAP = {f".{t}": t for t in SUPPORTED_REVIEW_TYPES}
+_UNSUPPORTED = f"不支持的文件类型！仅支持：{SUPPORTED_REVIEW_TYPES}"
+
+def _get_file_suffix(file: UploadFile) -> str:
+    """获取文件后缀（小写），不支持的类型直接抛400"""
+    file_suffix = FILE_TYPE_MAP.get(os.path.splitext(file.filename)[1].lower())
+    if file_suffix is None:
+        raise HTTPException(status_code=400, detail=_UNSUPPORTED)
+    return file_suffix
+
+def _build_review_chain(file_path: str, file_suffix: str, drawing_name: str, model_name: str, generate_pdf: bool):
+    """渲染→OCR→AI审查 三段任务串成chain，中间的PNG字节只在Worker之间流转"""
+    return chain(
+        render_task.s(file_path, file_suffix),
+        ocr_task.s(),
+        async_ai_review.s(drawing_name, model_name, generate_pdf)
+    )
 
 # 纯异步接口：串联CAD/PDF→OCR→AI审查（支持多文件类型）
 @router.post("/analyze")
@@ -31,103 +48,92 @@ async def review_analyze(
     model_name: Optional[str] = Form("ernie"),
     generate_pdf: Optional[bool] = Form(True)
 ) -> Dict[str, Any]:
-    # ========== 第一步：识别文件类型，分流处理 ==========
-    # 获取文件后缀（小写）
-    file_suffix = file.filename.split(".")[-1].lower() if "." in file.filename else ""
-    supported_types = ["dwg", "dxf", "pdf"]
-    if file_suffix not in supported_types:
-        raise HTTPException(status_code=400, detail=f"不支持的文件类型！仅支持：{supported_types}")
-    
-    # 读取文件二进制内容
-    file_content = await file.read()
-    png_bytes = None
-    
-    # 分支1：处理CAD文件（DWG/DXF）
-    if file_suffix in ["dwg", "dxf"]:
-        try:
-            from app.services.cad_service import render_cad_to_image, CADRenderError
-            # 用asyncio.to_thread包装同步函数，不阻塞事件循环
-            png_bytes = await asyncio.to_thread(
-                render_cad_to_image,
-                file_content=file_content,
-                file_type=file_suffix
-            )
-            logger.info(f"✅ CAD模块处理完成：{file.filename} 转PNG成功（PNG大小：{len(png_bytes)}字节）")
-        except CADRenderError as e:
-            logger.error(f"❌ CAD模块处理失败：{str(e)}", exc_info=True)
-            raise HTTPException(status_code=400, detail=f"CAD模块处理失败：{str(e)}")
-        except Exception as e:
-            logger.error(f"❌ CAD模块未知异常：{str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"CAD模块内部错误：{str(e)}")
-    
-    # 分支2：处理PDF文件
-    elif file_suffix == "pdf":
-        if not convert_from_bytes or not Image:
-            raise HTTPException(status_code=500, detail="缺少PDF处理依赖！请执行：pip install pdf2image pillow")
-        try:
-            # PDF转图片（取第一页，如需多页可循环处理）
-            logger.info(f"开始处理PDF文件：{file.filename}，转换第一页为PNG")
-            # 转换PDF字节为PIL图片（Windows需安装poppler，见下方说明）
-            images = await asyncio.to_thread(
-                convert_from_bytes,
-                file_content,
-                dpi=300,  # 高清转换，提升OCR准确率
-                first_page=1,
-                last_page=1
-            )
-            if not images:
-                raise Exception("PDF文件无有效页面")
-            
-            # PIL图片转二进制字节
-            img_byte_arr = io.BytesIO()
-            images[0].save(img_byte_arr, format='PNG', dpi=(300, 300))
-            png_bytes = img_byte_arr.getvalue()
-            logger.info(f"✅ PDF模块处理完成：{file.filename} 转PNG成功（PNG大小：{len(png_bytes)}字节）")
-        except Exception as e:
-            logger.error(f"❌ PDF模块处理失败：{str(e)}", exc_info=True)
-            raise HTTPException(status_code=400, detail=f"PDF模块处理失败：{str(e)}")
-    
-    # ========== 第二步：调用OCR模块，PNG转文本 ==========
-    try:
-        # 把PNG二进制包装成UploadFile对象，传给OCR模块
-        png_file = UploadFile(
-            filename=f"{file.filename}.png",
-            file=io.BytesIO(png_bytes)
-        )
-        # 调用你已有的OCR服务处理PNG
-        ocr_result = await ocr_strategy_service.process_file(png_file)
-        
-        # 校验OCR结果（放宽长度限制，避免小文件报错）
-        if ocr_result["status"] != "success":
-            raise Exception(ocr_result.get("error_message", "OCR识别失败"))
-        # 修复2：放宽文本长度限制（CAD/PDF转PNG后OCR文本可能短）
-        if not ocr_result["content"] or len(ocr_result["content"].strip()) < 1:
-            raise Exception("OCR识别结果为空")
-        
-        logger.info(f"OCR模块处理完成：提取文本长度 {len(ocr_result['content'])}")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"OCR模块处理失败：{str(e)}")
+    # ========== 第一步：识别文件类型，流式落盘 ==========
+    file_suffix = _get_file_suffix(file)
+    file_path = await save_upload_file(file)
 
-    # ========== 第三步：提交Celery异步任务，AI审查 ==========
+    # ========== 第二步：提交渲染→OCR→AI审查任务链（文件由渲染任务负责清理） ==========
     try:
-        # 关键：delay()是异步提交的核心，必须保留
-        task = async_ai_review.delay(
-            ocr_content=ocr_result["content"],
-            drawing_name=drawing_name or file.filename,
-            model_name=model_name,
-            generate_pdf=generate_pdf
-        )
-        logger.info(f"AI审查任务提交成功，task_id：{task.id}")  # 新增日志，确认提交
+        task = _build_review_chain(
+            file_path, file_suffix, drawing_name or file.filename, model_name, generate_pdf
+        ).apply_async()
+        logger.info(f"AI审查任务链提交成功，task_id：{task.id}")  # 新增日志，确认提交
     except Exception as e:
+        remove_temp_file(file_path)
         logger.error(f"提交AI审查任务失败：{str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"提交AI审查任务失败：{str(e)}")
 
-    # 返回任务ID，接口无阻塞
+    # 返回任务链最后一个任务的ID，接口无阻塞
     return {
         "status": "task_submitted",
         "task_id": task.id,
-        "message": f"{file_suffix.upper()}→OCR处理完成，AI审查任务已提交（异步执行）",
-        "ocr_confidence": ocr_result.get("confidence", "N/A")
+        "message": f"{file_suffix.upper()}→OCR→AI审查任务已提交（异步执行）"
+    }
+
+# 批量接口：每个文件一条任务链，一次性group提交（一次broker往返）
+@router.post("/analyze/batch")
+async def review_batch_analyze(
+    files: List[UploadFile] = File(...),
+    model_name: Optional[str] = Form("ernie"),
+    generate_pdf: Optional[bool] = Form(True)
+) -> Dict[str, Any]:
+    # 先统一校验类型，避免处理到一半才发现不支持的文件
+    file_suffixes = [_get_file_suffix(file) for file in files]
+
+    file_paths = []
+    sigs = []
+    for file, file_suffix in zip(files, file_suffixes):
+        file_path = await save_upload_file(file)
+        file_paths.append(file_path)
+        sigs.append(_build_review_chain(file_path, file_suffix, file.filename, model_name, generate_pdf))
+
+    try:
+        group_result = group(sigs).apply_async()
+        # 持久化GroupResult，查询接口才能restore
+        group_result.save()
+        logger.info(f"批量AI审查任务提交成功，group_id：{group_result.id}，任务数：{len(sigs)}")
+    except Exception as e:
+        for file_path in file_paths:
+            remove_temp_file(file_path)
+        logger.error(f"提交批量AI审查任务失败：{str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"提交批量AI审查任务失败：{str(e)}")
+
+    return {
+        "status": "task_submitted",
+        "group_id": group_result.id,
+        "task_ids": [result.id for result in group_result.results],
+        "message": f"{len(sigs)}个文件的OCR→AI审查任务已批量提交（异步执行）"
+    }
+
+# 批量结果查询接口：全部完成后用join_native一次性批量取回结果
+@router.get("/analyze/batch/result/{group_id}")
+async def get_batch_review_result(group_id: str):
+    group_result = GroupResult.restore(group_id, app=celery_app)
+    if group_result is None:
+        raise HTTPException(status_code=404, detail=f"批量任务不存在或已过期：{group_id}")
+
+    total = len(group_result.results)
+    if not group_result.ready():
+        return {
+            "status": "running",
+            "completed": group_result.completed_count(),
+            "total": total,
+            "message": "批量任务执行中"
+        }
+
+    # propagate=False：单个任务失败时返回异常对象而不是整体抛出
+    values = await asyncio.to_thread(group_result.join_native, timeout=10, propagate=False)
+    items = []
+    for result, value in zip(group_result.results, values):
+        if result.successful():
+            items.append({"task_id": result.id, "status": "success", "data": value})
+        else:
+            items.append({"task_id": result.id, "status": "failure", "message": f"任务执行失败：{value}"})
+    return {
+        "status": "success",
+        "total": total,
+        "data": items,
+        "message": "批量AI审查完成"
     }
 
 # 异步结果查询接口
@@ -147,4 +153,11 @@ async def get_review_result(task_id: str):
         err_msg = str(task.result) if task.result else "任务执行失败，无具体信息"
         return {"status": "failure", "message": f"任务执行失败：{err_msg}"}
     else:
-        return {"status": "running", "message": f"任务执行中，当前状态：{task.state}"}
\ No newline at end of file
+        return {"status": "running", "message": f"任务执行中，当前状态：{task.state}"}
+
+@router.get("/analyze/result/{task_id}/wait")
+async def wait_review_result(task_id: str):
+    """阻塞等待审查任务完成（Redis BLPOP完成通知），超时则返回当前状态"""
+    if not celery_app.AsyncResult(task_id).ready():
+        await wait_task_done(task_id, settings.TASK_WAIT_TIMEOUT)
+    return await get_review_result(task_id)
@@ -1,28 +1,63 @@
+import logging
+
 from celery import Celery
+from celery.signals import task_postrun
 from app.core.config import settings
 
-print("REDIS_URL:", settings.REDIS_URL)
-print("CELERY_TASK_TIME_LIMIT:", settings.CELERY_TASK_TIME_LIMIT)
+logger = logging.getLogger(__name__)
+logger.debug("REDIS_URL: %s", settings.REDIS_URL)
+logger.debug("CELERY_TASK_TIME_LIMIT: %s", settings.CELERY_TASK_TIME_LIMIT)
 
 # 初始化Celery实例
 celery_app = Celery(
     "drawing_review_tasks",
     broker=settings.REDIS_URL,
     backend=settings.REDIS_URL,
-    include=["app.tasks.cad_tasks", "app.tasks.ocr_tasks","app.tasks.review_tasks"]  # 任务所在的模块路径
+    # 任务所在的模块路径（Worker启动时才导入；可按队列只导入需要的模块，见CELERY_TASK_MODULES）
+    include=[module.strip() for module in settings.CELERY_TASK_MODULES.split(",") if module.strip()]
 )
 
 # 配置Celery
 celery_app.conf.update(
-    # 1. 支持字节数据序列化（DWG转图片返回bytes）
+    # 1. 统一msgpack序列化（DWG转图片返回bytes，不再走JSON的base64膨胀）
     task_serializer="msgpack",
     result_serializer="msgpack",
-    accept_content=["json", "msgpack"],  
+    accept_content=["msgpack"],
     result_accept_content=["msgpack"],
+    # 任务参数和结果统一zstd压缩，减小Redis占用
+    task_compression="zstd",
+    result_compression="zstd",
     # 2. 时区和UTC对齐（避免时间混乱）
     timezone='Asia/Shanghai',
     enable_utc=False,  # 和本地时区一致
     # 原有配置保留+优化
     task_time_limit=settings.CELERY_TASK_TIME_LIMIT,
-    worker_concurrency=4
-)
\ No newline at end of file
+    worker_concurrency=4,
+    # 3. CAD任务耗时长：每个进程只预取1个任务，执行完才确认，避免忙进程囤积任务
+    #    （启动Worker时建议加 -Ofair：celery -A celery_app worker -Ofair）
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # 可见性超时需大于任务最长执行时间，否则长任务会被Redis重复投递
+    broker_transport_options={"visibility_timeout": settings.CELERY_TASK_TIME_LIMIT + 60, "socket_keepalive": True},
+    # 结果后端的Redis连接保持长连接，读超时自动重试一次，长任务结束写结果时不因空闲断连失败
+    redis_socket_keepalive=True,
+    redis_retry_on_timeout=True,
+    # 4. 按任务类型分队列（CELERY_SPLIT_QUEUES开启时），慢的CAD渲染不再堵住OCR和AI审查，各队列单独起Worker：
+    #    celery -A celery_app worker -Q cad -c 4 -Ofair
+    #    celery -A celery_app worker -Q ocr -c 2
+    #    celery -A celery_app worker -Q review -P gevent -c 100   （AI审查是网络IO）
+    #    各队列的Worker可用CELERY_TASK_MODULES只导入本队列的任务模块，缩短启动时间和内存占用
+    #    未开启时所有任务走默认队列，单个 celery -A celery_app worker 就能处理全部任务
+    task_routes={
+        "app.tasks.cad_tasks.*": {"queue": "cad"},
+        "app.tasks.ocr_tasks.*": {"queue": "ocr"},
+        "app.tasks.review_tasks.*": {"queue": "review"},
+    } if settings.CELERY_SPLIT_QUEUES else None
+)
+
+@task_postrun.connect
+def _notify_task_done(task_id=None, **kwargs):
+    """任务结束（成功或失败）后推送完成通知，/wait接口据此BLPOP唤醒"""
+    from app.database.redis import notify_task_done
+    notify_task_done(task_id)
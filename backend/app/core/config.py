@@ -1,4 +1,5 @@
 import os
+from functools import cached_property
 from pathlib import Path
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
@@ -17,10 +18,23 @@ class Settings(BaseSettings):
     # ========== 临时目录配置（静态变量） ==========
     OCR_TEMP_DIR: ClassVar[str] = os.path.join(PROJECT_ROOT, "temp", "ocr")
     CAD_TEMP_DIR: ClassVar[str] = os.path.join(PROJECT_ROOT, "temp", "cad")  # 补充CAD临时目录
+    UPLOAD_TEMP_DIR: ClassVar[str] = os.path.join(PROJECT_ROOT, "temp", "upload")  # 上传文件流式落盘目录（API与Worker共享）
+    # Linux下已溢写到磁盘的上传文件用sendfile零拷贝落盘（其它平台或关闭时按块复制）
+    UPLOAD_ZERO_COPY: bool = True
+    # DXF图层提取结果的磁盘缓存（按文件内容哈希），解析逻辑变化时调大版本号使旧缓存失效
+    DXF_LAYER_CACHE_DIR: ClassVar[str] = os.path.join(PROJECT_ROOT, "temp", "dxf_cache")
+    DXF_LAYER_CACHE_VERSION: int = 1
+    # 图纸类型→审查Prompt的规则文件（默认随代码发布的app/company_rules.txt，与启动目录无关）
+    COMPANY_RULES_PATH: str = os.path.join(PROJECT_ROOT, "app", "company_rules.txt")
 
     # ========== CAD渲染配置（统一类型注解，无重复） ==========
     CAD_RENDER_FIGSIZE: Tuple[int, int] = (20, 20)  # 最终生效的配置
     CAD_RENDER_DPI: int = 300
+    # 送OCR的CAD渲染图直接按该DPI矢量渲染，不再300DPI渲染后再插值放大2倍；
+    # 矢量直接光栅化的笔画比插值放大清晰，300DPI下小号标注仍足够识别，调低前需先验证识别率
+    CAD_OCR_RENDER_DPI: int = 300
+    # 需要把Matplotlib渲染结果导出为PDF/SVG时打开：线段集合按位图嵌入，避免海量矢量图元撑大文件
+    CAD_VECTOR_OUTPUT: bool = False
 
     # ========== 数据库配置（从.env加载，必填） ==========
     POSTGRES_USER: str
@@ -34,12 +48,12 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
 
-    # ========== 数据库URL（动态属性） ==========
-    @property
+    # ========== 数据库URL（首次访问时拼接一次并缓存） ==========
+    @cached_property
     def DATABASE_URL(self) -> str:
         return f"postgresql+psycopg2://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
-    @property
+    @cached_property
     def REDIS_URL(self) -> str:
         return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_DB}"
 
@@ -53,14 +67,33 @@ class Settings(BaseSettings):
 
     # ========== Celery配置（修正：去掉Field，改用动态属性+默认值） ==========
     CELERY_TASK_TIME_LIMIT: int = 3600  # 1小时超时
+    TASK_WAIT_TIMEOUT: int = 30  # /wait接口单次最长阻塞秒数
+    # Worker启动时导入的任务模块（逗号分隔）。按队列分开部署时只导入本队列的模块，
+    # 例如审查Worker设 CELERY_TASK_MODULES=app.tasks.review_tasks，启动时不再加载ezdxf/OpenCV/Tesseract
+    CELERY_TASK_MODULES: str = "app.tasks.cad_tasks,app.tasks.ocr_tasks,app.tasks.review_tasks"
+    # 按任务类型分cad/ocr/review队列：开启后必须为三个队列分别启动Worker（-Q cad / -Q ocr / -Q review），
+    # 否则任务会一直PENDING；默认关闭，所有任务走默认队列，单个 celery -A celery_app worker 即可处理
+    CELERY_SPLIT_QUEUES: bool = False
     # 核心修正：用动态属性复用REDIS_URL，避免冗余
-    @property
+    @cached_property
     def CELERY_BROKER_URL(self) -> str:
         return self.REDIS_URL  # 复用Redis配置，无需重复定义
-    @property
+    @cached_property
     def CELERY_RESULT_BACKEND(self) -> str:
         return self.REDIS_URL  # 和broker一致
 
+    # ========== 审查链路渲染给OCR的图片配置 ==========
+    PDF_OCR_DPI: int = 200  # OCR引擎200DPI已足够，300DPI只会放大编码和传输开销
+    OCR_IMAGE_FORMAT: str = "JPEG"  # 中间图只给OCR用，JPEG编码比PNG快、体积小
+    OCR_JPEG_QUALITY: int = 92
+
+    # PDF逐页渲染引擎：pymupdf（进程内渲染）或 pdf2image（poppler子进程）
+    PDF_RENDER_ENGINE: str = "pymupdf"
+    # PDF逐页OCR的并发数（OCR是远程接口调用，线程并发即可）
+    PDF_OCR_CONCURRENCY: int = 8
+    # PDF页面自带文本层达到该字符数时直接取文本，不再渲染送OCR（0表示总是OCR）
+    PDF_NATIVE_TEXT_MIN_CHARS: int = 10
+
     # ========== PDF转图片配置（静态变量） ==========
     POPPLER_PATH: ClassVar[str] = r"D:\\Program Files\\poppler\\poppler-25.12.0\\Library\bin"
 
@@ -69,6 +102,17 @@ class Settings(BaseSettings):
     OCR_APP_ID: str
     OCR_API_KEY: str
     OCR_SECRET_KEY: str
+    # 百度OCR触发QPS限流（错误码18）时的最大重试次数，按指数退避等待
+    OCR_QPS_RETRIES: int = 3
+    # 已经清晰的黑白图（电子版PDF/CAD渲染图）跳过放大/增强/去噪/自适应二值化，只做一次全局二值化
+    OCR_ADAPTIVE_PREPROCESS: bool = True
+    # 图片OCR请求合并：窗口内到达的请求攒成一批并发识别
+    OCR_BATCH_WINDOW_MS: int = 20
+    OCR_BATCH_SIZE: int = 8
+    # 上传图片长边超过该像素数时先等比缩小再OCR（约相当于A4图纸300DPI，再大只是白白增加识别耗时）
+    OCR_MAX_IMAGE_SIDE: int = 3000
+    # 同一文档多页OCR时并发识别的页数（Tesseract每页单线程，并发数另受CPU核数限制）
+    OCR_PAGE_CONCURRENCY: int = 4
     # Tesseract OCR（静态变量）
     TESSERACT_OEM: ClassVar[int] = 3
     TESSERACT_PDF_PSM: ClassVar[int] = 4
@@ -85,6 +129,18 @@ class Settings(BaseSettings):
     DASHSCOPE_API_URL: str = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"  # 默认值
     DASHSCOPE_MODEL: str = "qwen-turbo"  # 大写开头，适配.env的DASHSCOPE_MODEL
 
+    # 大模型请求超时：单次请求超时后按1.5倍放宽重试
+    AI_REQUEST_TIMEOUT: float = 20.0
+    AI_TIMEOUT_RETRIES: int = 2
+    # OCR识别流程版本：预处理/识别逻辑变化时调大，使按文件哈希缓存的处理结果失效
+    OCR_VERSION: str = "2"
+
+    # DashScope批处理接口（OpenAI兼容模式，费用减半）：待审图纸数达到阈值才走批处理，否则并发逐个请求
+    DASHSCOPE_BATCH_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    AI_BATCH_MIN_SIZE: int = 4
+    AI_BATCH_POLL_INTERVAL: float = 5.0
+    AI_BATCH_MAX_WAIT: int = 3600  # 超过该时长未完成则取消批任务，改为逐个请求
+
     # ========== Pydantic配置 ==========
     model_config = SettingsConfigDict(
         env_file=".env",
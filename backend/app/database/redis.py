@@ -0,0 +1,74 @@
+import logging
+from typing import Any, Optional
+
+import msgpack
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.celery_config import celery_app
+
+logger = logging.getLogger(__name__)
+
+# 结果缓存默认保留1天（和Celery结果默认过期时间一致）
+CACHE_EXPIRE_SECONDS = 86400
+# 任务完成通知列表的保留时间（客户端晚于任务完成才来等待时也能立即返回）
+TASK_DONE_EXPIRE_SECONDS = 3600
+
+_async_client = None
+
+def get_redis_client():
+    """复用Celery结果后端的Redis连接池，不再单独开一个连接池"""
+    return celery_app.backend.client
+
+def cache_get(key: str) -> Optional[Any]:
+    """读取msgpack缓存，未命中或Redis异常时返回None（缓存失效不影响主流程）"""
+    try:
+        data = get_redis_client().get(key)
+    except Exception as e:
+        logger.warning("读取缓存失败：%s，错误：%s", key, e)
+        return None
+    if data is None:
+        return None
+    return msgpack.unpackb(data, raw=False)
+
+def cache_set(key: str, value: Any, expire: int = CACHE_EXPIRE_SECONDS) -> None:
+    """写入msgpack缓存，失败只记录日志"""
+    try:
+        get_redis_client().set(key, msgpack.packb(value, use_bin_type=True), ex=expire)
+    except Exception as e:
+        logger.warning("写入缓存失败：%s，错误：%s", key, e)
+
+def get_async_redis_client():
+    """API进程内共享的异步Redis客户端（懒加载，供BLPOP等待任务完成）"""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.from_url(settings.REDIS_URL)
+    return _async_client
+
+def _task_done_key(task_id: str) -> str:
+    return f"done:{task_id}"
+
+def notify_task_done(task_id: str) -> None:
+    """Worker端任务结束后推送完成通知（结果已由同一Worker写入后端）"""
+    key = _task_done_key(task_id)
+    try:
+        client = get_redis_client()
+        client.rpush(key, "1")
+        client.expire(key, TASK_DONE_EXPIRE_SECONDS)
+    except Exception as e:
+        logger.warning("推送任务完成通知失败：%s，错误：%s", task_id, e)
+
+async def wait_task_done(task_id: str, timeout: int) -> bool:
+    """
+    阻塞等待任务完成通知，替代客户端反复轮询
+    :return: 超时前收到通知返回True
+    """
+    key = _task_done_key(task_id)
+    client = get_async_redis_client()
+    item = await client.blpop([key], timeout=timeout)
+    if item is None:
+        return False
+    # 放回通知，同一任务的其它等待者也能被唤醒
+    await client.rpush(key, "1")
+    await client.expire(key, TASK_DONE_EXPIRE_SECONDS)
+    return True
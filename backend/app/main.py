@@ -1,12 +1,13 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from app.api.cad_router import router as cad_router
 from app.api.ocr_router import router as ocr_router
 from app.api.review_router import router as review_router
 from fastapi.staticfiles import StaticFiles # 导入静态文件模块
 from fastapi.middleware.cors import CORSMiddleware
 
-# 创建 FastAPI 应用实例
-app = FastAPI(title="电气图纸审查AI助手", version="1.0")
+# 创建 FastAPI 应用实例（默认用orjson序列化响应，OCR/审查结果等大文本更快）
+app = FastAPI(title="电气图纸审查AI助手", version="1.0", default_response_class=ORJSONResponse)
 
 # 挂载静态文件目录, 将 /static 路径映射到新建的 static 文件夹
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -1,18 +1,71 @@
-from typing import Optional, Dict, Any, Literal
+from typing import Optional, Dict, Any, Iterator, Literal
 import os
 import logging
+import re
 import time
+import json
+import hashlib
+import atexit
+import asyncio
+import weakref
+import httpx
+import orjson
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from app.core.config import settings
 from app.core.review_rules import ELECTRIC_REVIEW_RULES, GENERAL_REVIEW_PROMPT
-
-# 加载环境变量
-load_dotenv()
+from app.database.redis import cache_get, cache_set
 
 # 初始化日志
 logger = logging.getLogger(__name__)
 
+# 大模型结果缓存：只缓存低温度（结果基本确定）的调用，保留24小时
+LLM_CACHE_MAX_TEMPERATURE = 0.3
+LLM_CACHE_EXPIRE_SECONDS = 86400
+
+# OCR文本归一化：合并空白，同一图纸OCR结果的空白抖动不影响缓存命中
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 带5条规则的审查提示词前缀（规则是静态配置，模块加载时格式化一次）
+_RULES_PREAMBLE = GENERAL_REVIEW_PROMPT.format(
+    wire_color=ELECTRIC_REVIEW_RULES["wire_color"]["prompt"],
+    symbol_standard=ELECTRIC_REVIEW_RULES["symbol_standard"]["prompt"],
+    safety_distance=ELECTRIC_REVIEW_RULES["safety_distance"]["prompt"],
+    load_balance=ELECTRIC_REVIEW_RULES["load_balance"]["prompt"],
+    grounding_spec=ELECTRIC_REVIEW_RULES["grounding_spec"]["prompt"]
+)
+
+# 审查请求的token预算：上下文窗口（8k模型）- 输出上限 - 安全余量，规则前缀和模板另行扣除
+REVIEW_CONTEXT_TOKENS = 8192
+REVIEW_MAX_TOKENS = 2048
+REVIEW_TOKEN_SAFETY = 256
+# 审查提示词模板本身（文件名等）预留的token数
+REVIEW_TEMPLATE_TOKENS = 64
+
+@lru_cache(maxsize=1)
+def _get_token_encoder():
+    """tiktoken编码器（模块内只加载一次）；未安装或编码表加载失败时返回None，改按字符数估算"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken不可用，按字符数估算token：%s", e)
+        return None
+
+def _count_tokens(text: str) -> int:
+    encoder = _get_token_encoder()
+    # 中文基本一字一token，字符数作为估算偏保守
+    return len(encoder.encode(text)) if encoder else len(text)
+
+def _truncate_to_tokens(text: str, limit: int) -> str:
+    encoder = _get_token_encoder()
+    if encoder is None:
+        return text[:limit]
+    return encoder.decode(encoder.encode(text)[:limit])
+
 # 定义支持的模型类型（和接口参数对应）
 ModelType = Literal["ernie", "qianwen"]
 
@@ -25,14 +78,14 @@ class AIService:
             "ernie": {
                 "api_key": settings.ERNIE_API_KEY,
                 "api_url": settings.ERNIE_API_URL,
-                "timeout": 60,
+                "timeout": settings.AI_REQUEST_TIMEOUT,
                 "default_model_version": "ernie-3.5-8k",
                 "max_tokens_limit": 2048  # 新增：文心一言上限
             },
             "qianwen": {
                 "api_key": settings.DASHSCOPE_API_KEY,
                 "api_url": "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",  # 千问正确地址
-                "timeout": 60,
+                "timeout": settings.AI_REQUEST_TIMEOUT,
                 "default_model_version": "qwen-turbo",
                 "max_tokens_limit": 8192  # 千问上限
             }
@@ -47,7 +100,34 @@ class AIService:
         if not self.available_models:
             raise ValueError("没有可用的AI模型，请检查.env中的API Key和URL配置")
         
-        logger.info(f"已加载可用模型：{self.available_models}")
+        logger.info("已加载可用模型：%s", self.available_models)
+
+        # 共享HTTP会话：连接池复用到千帆/DashScope的TLS连接，避免每次审查都重新握手；
+        # 限流和网关错误在连接层自动退避重试
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=None,  # POST也重试（默认只重试幂等方法）
+                raise_on_status=False  # 重试用尽后返回最后的响应，仍由raise_for_status报HTTP错误
+            )
+        )
+        self.session.mount("https://", adapter)
+        atexit.register(self.session.close)
+
+        # 未指定模型时并发调用各模型的线程池
+        self._fallback_executor = ThreadPoolExecutor(max_workers=2 * len(self.model_configs))
+
+        # 审查规则前缀：每次请求都以完全相同的system消息开头，
+        # 便于千帆/DashScope对公共前缀做上下文缓存
+        self.review_system_prompt = _RULES_PREAMBLE
+
+        # 异步客户端按事件循环懒加载（见_get_async_client），循环回收后自动移除
+        self._async_clients = weakref.WeakKeyDictionary()  # {事件循环: httpx.AsyncClient}
 
     def call_ai(
         self, 
@@ -55,29 +135,25 @@ class AIService:
         model_name: Optional[ModelType] = None,  # 新增：指定模型名称
         temperature: float = 0.3, 
         max_tokens: int = 2048,  # 修正：默认降到2048
-        model_version: Optional[str] = None  # 新增：指定模型版本
+        model_version: Optional[str] = None,  # 新增：指定模型版本
+        system_prompt: Optional[str] = None,  # 固定不变的前缀（作为system消息放在最前）
+        request_timeout: Optional[float] = None  # 单次请求超时，None使用配置的AI_REQUEST_TIMEOUT
     ) -> Dict[str, Any]:
         """
         统一调用AI模型的接口
-        :param prompt: 提示词
-        :param model_name: 指定调用的模型（ernie/qianwen），None则自动重试所有可用模型
+        :param prompt: 提示词（每次变化的部分，作为user消息）
+        :param model_name: 指定调用的模型（ernie/qianwen），None则并发调用所有可用模型、取最先成功的
         :param temperature: 生成温度
         :param max_tokens: 最大生成token数
         :param model_version: 模型版本（如ernie-4.0、qwen-plus），None使用默认版本
+        :param system_prompt: 固定前缀，None则只发送user消息
+        :param request_timeout: 单次请求超时秒数（超时后按1.5倍放宽重试）
         :return: 包含status、content和model_used的字典
         """
-
-
-        rule_prompts = {
-            "wire_color": ELECTRIC_REVIEW_RULES["wire_color"]["prompt"],
-            "symbol_standard": ELECTRIC_REVIEW_RULES["symbol_standard"]["prompt"],
-            "safety_distance": ELECTRIC_REVIEW_RULES["safety_distance"]["prompt"],
-            "load_balance": ELECTRIC_REVIEW_RULES["load_balance"]["prompt"],
-            "grounding_spec": ELECTRIC_REVIEW_RULES["grounding_spec"]["prompt"]
-        }
-    # 生成带5条规则的完整提示词
-    final_prompt = GENERAL_REVIEW_PROMPT.format(**rule_prompts) + f"\n\n需审查的图纸相关信息：{prompt}"
-
+        cache_key = self._llm_cache_key(prompt, model_name, temperature, max_tokens, model_version, system_prompt)
+        cached = self._lookup_llm_cache(cache_key)
+        if cached is not None:
+            return cached
 
         # 确定要尝试的模型列表
         target_models = []
@@ -93,71 +169,29 @@ class AIService:
                 }
             target_models = [model_name]
         else:
-            # 2. 未指定模型：按顺序重试所有可用模型
+            # 2. 未指定模型：并发尝试所有可用模型
             target_models = self.available_models
 
-        # 依次尝试目标模型
-        for model_name in target_models:
-            start_time = time.time()
-            config = self.model_configs[model_name]
-            
-            # 新增：容错处理——max_tokens不超过模型上限
-            final_max_tokens = min(max_tokens, config["max_tokens_limit"])
-            if final_max_tokens != max_tokens:
-                logger.warning(f"模型{model_name}的max_tokens超限，自动调整为{final_max_tokens}（原{max_tokens}）")
-
-            try:
-                logger.info(
-                    f"调用模型：{model_name}，版本：{model_version or config['default_model_version']}，"
-                    f"temperature={temperature}，max_tokens={final_max_tokens}"
-                )
-                
-                # 根据模型名称调用对应的函数
-                if model_name == "ernie":
-                    result = self._call_ernie(
-                        api_key=config["api_key"],
-                        api_url=config["api_url"],
-                        prompt=prompt,
-                        temperature=temperature,
-                        max_tokens=final_max_tokens,  # 使用调整后的参数
-                        timeout=config["timeout"],
-                        model_version=model_version or config["default_model_version"]
-                    )
-                elif model_name == "qianwen":
-                    result = self._call_qianwen(
-                        api_key=config["api_key"],
-                        api_url=config["api_url"],
-                        prompt=prompt,
-                        temperature=temperature,
-                        max_tokens=final_max_tokens,  # 使用调整后的参数
-                        timeout=config["timeout"],
-                        model_version=model_version or config["default_model_version"]
-                    )
-                else:
-                    continue
-
-                # 记录耗时
-                elapsed = round(time.time() - start_time, 2)
-                logger.info(f"模型 {model_name} 调用完成，耗时{elapsed}秒，状态：{result['status']}")
-                logger.info(f"【真实调用AI】使用API Key前8位：{config['api_key'][:8]}，请求地址：{config['api_url']}")
-
-                # 如果调用成功，立即返回结果
-                if result["status"] == "success":
-                    return {
-                        "status": "success",
-                        "content": result["content"],
-                        "model_used": model_name
-                    }
-                else:
-                    logger.warning(f"模型 {model_name} 调用失败：{result['content']}")
+        call_args = (prompt, temperature, max_tokens, model_version, system_prompt, request_timeout)
+        if len(target_models) == 1:
+            ai_result = self._invoke_model(target_models[0], *call_args)
+        else:
+            # 未指定模型：所有可用模型同时发起，取最先成功的结果，
+            # 总耗时取决于最快的模型，而不是依次超时后的累加
+            futures = [self._fallback_executor.submit(self._invoke_model, name, *call_args) for name in target_models]
+            ai_result = None
+            for future in as_completed(futures):
+                ai_result = future.result()
+                if ai_result:
+                    break
+            # 尚未开始的请求直接取消，已发出的请求在后台线程自然结束
+            for future in futures:
+                future.cancel()
 
-            except Exception as e:
-                elapsed = round(time.time() - start_time, 2)
-                logger.error(
-                    f"调用模型 {model_name} 时发生异常（耗时{elapsed}秒）：{str(e)}",
-                    exc_info=True  # 记录完整堆栈信息
-                )
-                continue
+        if ai_result:
+            if cache_key:
+                cache_set(cache_key, ai_result, expire=LLM_CACHE_EXPIRE_SECONDS)
+            return ai_result
 
         # 如果所有目标模型都失败了
         return {
@@ -166,39 +200,187 @@ class AIService:
             "model_used": None
         }
 
-    # ========== 新增：ai_review_service方法（适配cad_service的调用） ==========
-    def ai_review_service(self, ocr_structured_data: list, filename: str) -> Dict[str, Any]:
+    def _invoke_model(
+        self,
+        model_name: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        model_version: Optional[str],
+        system_prompt: Optional[str],
+        request_timeout: Optional[float]
+    ) -> Optional[Dict[str, Any]]:
+        """调用单个模型，成功返回call_ai格式的结果，失败记录日志并返回None"""
+        start_time = time.time()
+        config = self.model_configs[model_name]
+
+        # 新增：容错处理——max_tokens不超过模型上限
+        final_max_tokens = min(max_tokens, config["max_tokens_limit"])
+        if final_max_tokens != max_tokens:
+            logger.warning("模型%s的max_tokens超限，自动调整为%s（原%s）", model_name, final_max_tokens, max_tokens)
+
+        try:
+            logger.info(
+                "调用模型：%s，版本：%s，temperature=%s，max_tokens=%s",
+                model_name, model_version or config['default_model_version'], temperature, final_max_tokens
+            )
+
+            # 根据模型名称调用对应的函数
+            if model_name == "ernie":
+                caller = self._call_ernie
+            elif model_name == "qianwen":
+                caller = self._call_qianwen
+            else:
+                return None
+            result = caller(
+                api_key=config["api_key"],
+                api_url=config["api_url"],
+                prompt=prompt,
+                temperature=temperature,
+                max_tokens=final_max_tokens,  # 使用调整后的参数
+                timeout=request_timeout or config["timeout"],
+                model_version=model_version or config["default_model_version"],
+                system_prompt=system_prompt
+            )
+
+            # 记录耗时
+            elapsed = round(time.time() - start_time, 2)
+            logger.info("模型 %s 调用完成，耗时%s秒，状态：%s", model_name, elapsed, result['status'])
+            logger.info("【真实调用AI】使用API Key前8位：%s，请求地址：%s", config['api_key'][:8], config['api_url'])
+
+            if result["status"] == "success":
+                return {
+                    "status": "success",
+                    "content": result["content"],
+                    "model_used": model_name
+                }
+            logger.warning("模型 %s 调用失败：%s", model_name, result['content'])
+
+        except Exception as e:
+            elapsed = round(time.time() - start_time, 2)
+            logger.error(
+                "调用模型 %s 时发生异常（耗时%s秒）：%s", model_name, elapsed, e,
+                exc_info=True  # 记录完整堆栈信息
+            )
+        return None
+
+    def stream_ai(
+        self,
+        prompt: str,
+        model_name: ModelType,
+        temperature: float = 0.3,
+        max_tokens: int = 2048,
+        model_version: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        request_timeout: Optional[float] = None
+    ) -> Iterator[str]:
         """
-        电气图纸AI审查核心方法（适配cad_service的调用参数）
-        :param ocr_structured_data: OCR识别的结构化数据列表
-        :param filename: 文件名
-        :return: 符合cad_service预期的返回格式
+        流式调用指定模型（SSE），边生成边逐段产出文本，调用方不必等完整响应
+        与call_ai共用结果缓存：命中时一次性产出缓存内容，完整生成后写入缓存
+        参数同call_ai（必须指定模型）；调用失败时抛出异常
         """
-        # 构建电气图纸审查的提示词（精简长度，避免token超限）
-        # 构建电气图纸审查的提示词（动态拼接5条规则）
-        rule_prompts = {
-            "wire_color": ELECTRIC_REVIEW_RULES["wire_color"]["prompt"],
-            "symbol_standard": ELECTRIC_REVIEW_RULES["symbol_standard"]["prompt"],
-            "safety_distance": ELECTRIC_REVIEW_RULES["safety_distance"]["prompt"],
-            "load_balance": ELECTRIC_REVIEW_RULES["load_balance"]["prompt"],
-            "grounding_spec": ELECTRIC_REVIEW_RULES["grounding_spec"]["prompt"]
-        }
-        # 生成带5条规则的完整提示词
-        final_prompt = GENERAL_REVIEW_PROMPT.format(**rule_prompts) + f"""
-        \n\n需审查的图纸相关信息：
+        if model_name not in self.available_models:
+            raise ValueError(f"指定的模型{model_name}不可用（未配置或配置错误），可用模型：{self.available_models}")
+
+        cache_key = self._llm_cache_key(prompt, model_name, temperature, max_tokens, model_version, system_prompt)
+        cached = self._lookup_llm_cache(cache_key)
+        if cached is not None:
+            yield cached["content"]
+            return
+
+        config = self.model_configs[model_name]
+        final_max_tokens = min(max_tokens, config["max_tokens_limit"])
+        version = model_version or config["default_model_version"]
+        headers = self._build_headers(config["api_key"])
+        if model_name == "ernie":
+            request_data = self._build_ernie_request(prompt, temperature, final_max_tokens, version, system_prompt)
+            request_data["stream"] = True
+            parse_delta = self._parse_ernie_stream_delta
+        else:
+            request_data = self._build_qianwen_request(prompt, temperature, final_max_tokens, version, system_prompt)
+            # 每个事件只带新增的文本，而不是截至目前的全文
+            request_data["parameters"]["incremental_output"] = True
+            headers["X-DashScope-SSE"] = "enable"
+            parse_delta = self._parse_qianwen_stream_delta
+
+        start_time = time.time()
+        parts = []
+        with self.session.post(
+            config["api_url"],
+            headers=headers,
+            data=orjson.dumps(request_data),
+            timeout=request_timeout or config["timeout"],
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                # SSE：只处理"data:"行，忽略event/id/空行
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                delta = parse_delta(orjson.loads(data))
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+        logger.info("模型 %s 流式调用完成，耗时%s秒", model_name, round(time.time() - start_time, 2))
+        if cache_key:
+            cache_set(cache_key, {"status": "success", "content": "".join(parts), "model_used": model_name},
+                      expire=LLM_CACHE_EXPIRE_SECONDS)
+
+    # ========== 新增：ai_review_service方法（适配cad_service的调用） ==========
+    @staticmethod
+    def _build_review_prompt(ocr_payload: str, filename: str) -> str:
+        """构建审查请求中每次变化的部分（规则前缀见review_system_prompt，OCR数据已按token预算截断）"""
+        return f"""需审查的图纸相关信息：
         文件名：{filename}
-        OCR结构化数据：{ocr_structured_data[:2000]}
+        OCR结构化数据：{ocr_payload}
         """
-        
-        # 调用AI模型（max_tokens降到2048，适配文心一言）
-        ai_result = self.call_ai(
-            prompt=final_prompt,  # 这里用新的final_prompt
-            model_name=None,
-            temperature=0.2,
-            max_tokens=2048
-        )
-        
-        # 转换为cad_service预期的返回格式
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _review_data_budget() -> int:
+        """OCR数据可用的token数（扣除规则前缀和提示词模板，只算一次）"""
+        overhead = _count_tokens(_RULES_PREAMBLE) + REVIEW_TEMPLATE_TOKENS
+        return REVIEW_CONTEXT_TOKENS - REVIEW_MAX_TOKENS - REVIEW_TOKEN_SAFETY - overhead
+
+    @staticmethod
+    def _review_payload(ocr_structured_data) -> str:
+        """
+        按token数（而不是列表元素个数）挑选送审的OCR数据：有文本的页优先，
+        贪心装入预算，装不下的第一条有文本的页截断后放入，最后按原页序输出
+        """
+        items = ocr_structured_data if isinstance(ocr_structured_data, list) else [ocr_structured_data]
+
+        def item_text(item) -> str:
+            if isinstance(item, dict):
+                return str(item.get("text") or "")
+            return str(item) if item else ""
+
+        ranked = sorted(range(len(items)), key=lambda i: (not item_text(items[i]).strip(), i))
+        budget = AIService._review_data_budget()
+        chosen = {}
+        for i in ranked:
+            cost = _count_tokens(str(items[i])) + 2  # 列表分隔符", "
+            if cost <= budget:
+                chosen[i] = items[i]
+                budget -= cost
+            elif budget > 0 and item_text(items[i]).strip():
+                # 整页放不下时截断文本填满剩余预算
+                overflow = cost - budget
+                text = item_text(items[i])
+                truncated = _truncate_to_tokens(text, max(_count_tokens(text) - overflow, 0))
+                chosen[i] = {**items[i], "text": truncated} if isinstance(items[i], dict) else truncated
+                break
+        if len(chosen) < len(items):
+            logger.info("OCR数据超出token预算，送审%s/%s项", len(chosen), len(items))
+        return str([chosen[i] for i in sorted(chosen)])
+
+    @staticmethod
+    def _format_review_result(ai_result: Dict[str, Any], filename: str) -> Dict[str, Any]:
+        """转换为cad_service预期的返回格式"""
         if ai_result["status"] == "success":
             return {
                 "status": "success",
@@ -214,62 +396,352 @@ class AIService:
                 "filename": filename
             }
 
-    def _call_ernie(
-        self, 
-        api_key: str, 
-        api_url: str, 
-        prompt: str, 
-        temperature: float, 
-        max_tokens: int, 
-        timeout: int,
-        model_version: str
-    ) -> Dict[str, Any]:
-        """调用百度文心一言API"""
-        request_data = {
-            "messages": [{"role": "user", "content": prompt}],
+    def ai_review_service(self, ocr_structured_data: list, filename: str) -> Dict[str, Any]:
+        """
+        电气图纸AI审查核心方法（适配cad_service的调用参数）
+        :param ocr_structured_data: OCR识别的结构化数据列表
+        :param filename: 文件名
+        :return: 符合cad_service预期的返回格式
+        """
+        ocr_payload = self._review_payload(ocr_structured_data)
+        cache_key = self._review_cache_key(ocr_payload)
+        cached = cache_get(cache_key)
+        if cached is not None:
+            logger.info("AI审查命中OCR内容缓存：%s", cache_key)
+            return {**cached, "filename": filename}
+
+        # 调用AI模型（max_tokens降到2048，适配文心一言）
+        ai_result = self.call_ai(
+            prompt=self._build_review_prompt(ocr_payload, filename),
+            model_name=None,
+            temperature=0.2,
+            max_tokens=REVIEW_MAX_TOKENS,
+            system_prompt=self.review_system_prompt
+        )
+        review_result = self._format_review_result(ai_result, filename)
+        if review_result["status"] == "success":
+            cache_set(cache_key, review_result, expire=LLM_CACHE_EXPIRE_SECONDS)
+        return review_result
+
+    async def aai_review_service(self, ocr_structured_data: list, filename: str) -> Dict[str, Any]:
+        """ai_review_service的异步版本"""
+        ocr_payload = self._review_payload(ocr_structured_data)
+        cache_key = self._review_cache_key(ocr_payload)
+        cached = await asyncio.to_thread(cache_get, cache_key)
+        if cached is not None:
+            logger.info("AI审查命中OCR内容缓存：%s", cache_key)
+            return {**cached, "filename": filename}
+
+        ai_result = await self.acall_ai(
+            prompt=self._build_review_prompt(ocr_payload, filename),
+            model_name=None,
+            temperature=0.2,
+            max_tokens=REVIEW_MAX_TOKENS,
+            system_prompt=self.review_system_prompt
+        )
+        review_result = self._format_review_result(ai_result, filename)
+        if review_result["status"] == "success":
+            await asyncio.to_thread(cache_set, cache_key, review_result, LLM_CACHE_EXPIRE_SECONDS)
+        return review_result
+
+    # ========== 多图纸批量审查（DashScope Batch API） ==========
+    def batch_review(self, items: list) -> list:
+        """
+        多张图纸一次性审查：先查审查缓存，未命中的数量达到AI_BATCH_MIN_SIZE时
+        整体提交DashScope批处理任务，否则（或批处理失败的条目）并发逐个调用ai_review_service
+        :param items: [(ocr_structured_data, filename), ...]
+        :return: 与items顺序一致的审查结果（格式同ai_review_service）
+        """
+        results = [None] * len(items)
+        pending = []  # (下标, 缓存键, 送审OCR数据)
+        for idx, (ocr_structured_data, filename) in enumerate(items):
+            ocr_payload = self._review_payload(ocr_structured_data)
+            cache_key = self._review_cache_key(ocr_payload)
+            cached = cache_get(cache_key)
+            if cached is not None:
+                logger.info("AI审查命中OCR内容缓存：%s", cache_key)
+                results[idx] = {**cached, "filename": filename}
+            else:
+                pending.append((idx, cache_key, ocr_payload))
+
+        if len(pending) >= settings.AI_BATCH_MIN_SIZE and "qianwen" in self.available_models:
+            prompts = {str(idx): self._build_review_prompt(ocr_payload, items[idx][1]) for idx, _, ocr_payload in pending}
+            try:
+                batch_results = self._run_dashscope_batch(prompts)
+            except Exception as e:
+                logger.error("DashScope批处理审查失败，改为逐个请求：%s", e, exc_info=True)
+                batch_results = {}
+            for idx, cache_key, _ in pending:
+                ai_result = batch_results.get(str(idx))
+                if ai_result is None:
+                    continue
+                review_result = self._format_review_result(ai_result, items[idx][1])
+                results[idx] = review_result
+                if review_result["status"] == "success":
+                    cache_set(cache_key, review_result, expire=LLM_CACHE_EXPIRE_SECONDS)
+
+        # 小批量或批处理未返回的条目：并发逐个请求
+        remaining = [idx for idx, _, _ in pending if results[idx] is None]
+        if remaining:
+            with ThreadPoolExecutor(max_workers=len(remaining)) as executor:
+                for idx, review_result in zip(remaining, executor.map(lambda i: self.ai_review_service(*items[i]), remaining)):
+                    results[idx] = review_result
+        return results
+
+    def _run_dashscope_batch(self, prompts: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """
+        上传JSONL → 创建批任务 → 轮询状态 → 下载结果文件
+        轮询用阻塞sleep，只应在Celery Worker里调用（见cad_tasks.process_batch_files），不要在事件循环里调用
+        :param prompts: {custom_id: 审查提示词}
+        :return: {custom_id: call_ai格式的结果}，单条失败的不在结果中
+        """
+        config = self.model_configs["qianwen"]
+        base_url = settings.DASHSCOPE_BATCH_BASE_URL
+        auth = {"Authorization": f"Bearer {config['api_key']}"}
+        timeout = config["timeout"]
+
+        jsonl = b"\n".join(
+            orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": config["default_model_version"],
+                    "messages": self._build_messages(prompt, self.review_system_prompt),
+                    "temperature": 0.2,
+                    "max_tokens": REVIEW_MAX_TOKENS
+                }
+            })
+            for custom_id, prompt in prompts.items()
+        )
+        response = self.session.post(
+            f"{base_url}/files", headers=auth, timeout=timeout,
+            files={"file": ("review_batch.jsonl", jsonl, "application/jsonl")}, data={"purpose": "batch"}
+        )
+        response.raise_for_status()
+        input_file_id = orjson.loads(response.content)["id"]
+
+        response = self.session.post(
+            f"{base_url}/batches", headers={**auth, "Content-Type": "application/json"}, timeout=timeout,
+            data=orjson.dumps({"input_file_id": input_file_id, "endpoint": "/v1/chat/completions", "completion_window": "24h"})
+        )
+        response.raise_for_status()
+        batch_id = orjson.loads(response.content)["id"]
+        logger.info("已提交DashScope批处理审查：%s，共%s条", batch_id, len(prompts))
+
+        deadline = time.time() + settings.AI_BATCH_MAX_WAIT
+        while True:
+            response = self.session.get(f"{base_url}/batches/{batch_id}", headers=auth, timeout=timeout)
+            response.raise_for_status()
+            batch = orjson.loads(response.content)
+            if batch["status"] == "completed":
+                break
+            if batch["status"] in ("failed", "expired", "cancelling", "cancelled"):
+                raise RuntimeError(f"批处理任务{batch_id}状态：{batch['status']}")
+            if time.time() > deadline:
+                self.session.post(f"{base_url}/batches/{batch_id}/cancel", headers=auth, timeout=timeout)
+                raise TimeoutError(f"批处理任务{batch_id}超过{settings.AI_BATCH_MAX_WAIT}秒未完成，已取消")
+            time.sleep(settings.AI_BATCH_POLL_INTERVAL)
+
+        results = {}
+        if not batch.get("output_file_id"):
+            return results
+        response = self.session.get(f"{base_url}/files/{batch['output_file_id']}/content", headers=auth, timeout=timeout)
+        response.raise_for_status()
+        for line in response.content.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            try:
+                content = record["response"]["body"]["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                logger.warning("批处理结果缺少内容：%.500s", record)
+                continue
+            results[record["custom_id"]] = {"status": "success", "content": content, "model_used": "qianwen"}
+        return results
+
+    # ========== 完全相同请求的结果缓存（同一图纸重复审查直接复用） ==========
+    @staticmethod
+    def _review_cache_key(ocr_payload: str) -> str:
+        """
+        图纸审查的结构缓存键：只看归一化后的OCR内容，不含文件名
+        （同一张图换了文件名或OCR空白有差异仍能命中；数值不同的图纸不会误命中）
+        """
+        normalized = _WHITESPACE_RE.sub(" ", ocr_payload).strip()
+        return "review:" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get_cached_ai_result(
+        self,
+        prompt: str,
+        model_name: Optional[ModelType] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 2048,
+        model_version: Optional[str] = None,
+        system_prompt: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """按call_ai/stream_ai同样的缓存键查结果缓存，命中返回call_ai格式的结果，未命中返回None（不发请求）"""
+        return self._lookup_llm_cache(
+            self._llm_cache_key(prompt, model_name, temperature, max_tokens, model_version, system_prompt)
+        )
+
+    @staticmethod
+    def _lookup_llm_cache(cache_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not cache_key:
+            return None
+        cached = cache_get(cache_key)
+        if cached is not None:
+            logger.info("AI审查命中缓存：%s", cache_key)
+        return cached
+
+    @staticmethod
+    def _llm_cache_key(prompt: str, model_name: Optional[str], temperature: float,
+                       max_tokens: int, model_version: Optional[str],
+                       system_prompt: Optional[str] = None) -> Optional[str]:
+        """温度过高时结果不确定，不走缓存（返回None）"""
+        if temperature > LLM_CACHE_MAX_TEMPERATURE:
+            return None
+        payload = json.dumps(
+            {"m": model_name, "v": model_version, "t": temperature, "mt": max_tokens, "s": system_prompt, "p": prompt},
+            sort_keys=True, ensure_ascii=False
+        )
+        return "llm:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ========== 请求构造/响应解析（同步和异步调用共用） ==========
+    @staticmethod
+    def _build_headers(api_key: str) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+
+    @staticmethod
+    def _build_messages(prompt: str, system_prompt: Optional[str]) -> list:
+        """固定前缀放system消息、变化内容放user消息，保证各次请求前缀逐字节一致"""
+        messages = [{"role": "user", "content": prompt}]
+        if system_prompt:
+            messages.insert(0, {"role": "system", "content": system_prompt})
+        return messages
+
+    @staticmethod
+    def _build_ernie_request(prompt: str, temperature: float, max_tokens: int, model_version: str,
+                             system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "messages": AIService._build_messages(prompt, system_prompt),
             "temperature": temperature,
             "max_tokens": max_tokens,
             "model": model_version  # 使用指定版本
         }
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+    @staticmethod
+    def _parse_ernie_response(resp_json: Any) -> Dict[str, Any]:
+        # 日志记录响应概要（避免敏感信息）
+        logger.debug("文心一言响应：%.500s", resp_json)
 
-        try:
-            response = requests.post(
-                api_url,
-                headers=headers,
-                json=request_data,
-                timeout=timeout
-            )
-            response.raise_for_status()  # 触发HTTP错误（如4xx/5xx）
-            resp_json = response.json()
-
-            # 日志记录响应概要（避免敏感信息）
-            logger.debug(f"文心一言响应：{str(resp_json)[:500]}")
-
-            if isinstance(resp_json, dict):
-                if "choices" in resp_json and len(resp_json["choices"]) > 0:
-                    return {"status": "success", "content": resp_json["choices"][0]["message"]["content"]}
-                else:
-                    err_msg = f"【返回格式异常】无'result'字段，响应：{str(resp_json)[:500]}"
-                    return {"status": "failure", "content": err_msg}
+        if isinstance(resp_json, dict):
+            if "choices" in resp_json and len(resp_json["choices"]) > 0:
+                return {"status": "success", "content": resp_json["choices"][0]["message"]["content"]}
             else:
-                err_msg = f"【返回非字典格式】响应：{str(resp_json)[:500]}"
+                err_msg = f"【返回格式异常】无'result'字段，响应：{str(resp_json)[:500]}"
                 return {"status": "failure", "content": err_msg}
-
-        except requests.exceptions.HTTPError as e:
-            err_msg = f"【HTTP错误】状态码：{e.response.status_code}，响应：{e.response.text[:500]}"
-            return {"status": "failure", "content": err_msg}
-        except requests.exceptions.Timeout:
-            err_msg = "【超时错误】请求超过60秒未响应"
+        else:
+            err_msg = f"【返回非字典格式】响应：{str(resp_json)[:500]}"
             return {"status": "failure", "content": err_msg}
-        except Exception as e:
-            err_msg = f"【调用异常】{str(e)}"
+
+    @staticmethod
+    def _parse_ernie_stream_delta(event: Any) -> str:
+        """千帆v2流式事件：choices[0].delta.content为本次新增文本"""
+        if isinstance(event, dict) and event.get("choices"):
+            return event["choices"][0].get("delta", {}).get("content") or ""
+        if isinstance(event, dict) and "error" in event:
+            raise RuntimeError(f"【流式调用异常】{str(event['error'])[:500]}")
+        return ""
+
+    @staticmethod
+    def _build_qianwen_request(prompt: str, temperature: float, max_tokens: int, model_version: str,
+                               system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "model": model_version,  # 使用指定版本
+            "input": {
+                "messages": AIService._build_messages(prompt, system_prompt)
+            },
+            "parameters": {
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            }
+        }
+
+    @staticmethod
+    def _parse_qianwen_response(resp_json: Any) -> Dict[str, Any]:
+        # 日志记录响应概要
+        logger.debug("通义千问响应：%.500s", resp_json)
+
+        if isinstance(resp_json, dict):
+            if "output" in resp_json and "text" in resp_json["output"]:
+                return {"status": "success", "content": resp_json["output"]["text"]}
+            else:
+                err_msg = f"【返回格式异常】无'output.text'字段，响应：{str(resp_json)[:500]}"
+                return {"status": "failure", "content": err_msg}
+        else:
+            err_msg = f"【返回非字典格式】响应：{str(resp_json)[:500]}"
             return {"status": "failure", "content": err_msg}
 
+    @staticmethod
+    def _parse_qianwen_stream_delta(event: Any) -> str:
+        """DashScope增量输出事件：output.text为本次新增文本，出错时事件里带code/message"""
+        if isinstance(event, dict) and "output" in event:
+            return event["output"].get("text") or ""
+        if isinstance(event, dict) and event.get("code"):
+            raise RuntimeError(f"【流式调用异常】{event.get('code')}：{str(event.get('message'))[:500]}")
+        return ""
+
+    # ========== 同步调用（requests连接池） ==========
+    def _post_json(self, api_url: str, api_key: str, request_data: Dict[str, Any], timeout: float, parse) -> Dict[str, Any]:
+        """
+        发送请求并解析响应；超时后放弃本次请求，超时时间放宽1.5倍重试
+        （大模型响应时间长尾明显，卡住的请求重发往往比干等更快）
+        请求体/响应用orjson编解码（OCR文本多为中文，标准库json处理非ASCII较慢）
+        """
+        # 请求体只序列化一次，超时重试直接复用
+        body = orjson.dumps(request_data)
+        for attempt in range(settings.AI_TIMEOUT_RETRIES + 1):
+            try:
+                response = self.session.post(
+                    api_url,
+                    headers=self._build_headers(api_key),
+                    data=body,
+                    timeout=timeout
+                )
+                response.raise_for_status()  # 触发HTTP错误（如4xx/5xx）
+                return parse(orjson.loads(response.content))
+
+            except requests.exceptions.HTTPError as e:
+                err_msg = f"【HTTP错误】状态码：{e.response.status_code}，响应：{e.response.text[:500]}"
+                return {"status": "failure", "content": err_msg}
+            except requests.exceptions.Timeout:
+                logger.warning("请求%s超时（%s秒），第%s次", api_url, timeout, attempt + 1)
+                timeout *= 1.5
+            except Exception as e:
+                err_msg = f"【调用异常】{str(e)}"
+                return {"status": "failure", "content": err_msg}
+
+        err_msg = f"【超时错误】请求{settings.AI_TIMEOUT_RETRIES + 1}次均未在时限内响应"
+        return {"status": "failure", "content": err_msg}
+
+    def _call_ernie(
+        self, 
+        api_key: str, 
+        api_url: str, 
+        prompt: str, 
+        temperature: float, 
+        max_tokens: int, 
+        timeout: float,
+        model_version: str,
+        system_prompt: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """调用百度文心一言API"""
+        request_data = self._build_ernie_request(prompt, temperature, max_tokens, model_version, system_prompt)
+        return self._post_json(api_url, api_key, request_data, timeout, self._parse_ernie_response)
+
     def _call_qianwen(
         self, 
         api_key: str, 
@@ -277,58 +749,164 @@ class AIService:
         prompt: str, 
         temperature: float, 
         max_tokens: int, 
-        timeout: int,
-        model_version: str
+        timeout: float,
+        model_version: str,
+        system_prompt: Optional[str] = None
     ) -> Dict[str, Any]:
         """调用阿里云通义千问API"""
-        request_data = {
-            "model": model_version,  # 使用指定版本
-            "input": {
-                "messages": [{"role": "user", "content": prompt}]
-            },
-            "parameters": {
-                "temperature": temperature,
-                "max_tokens": max_tokens
-            }
-        }
+        request_data = self._build_qianwen_request(prompt, temperature, max_tokens, model_version, system_prompt)
+        return self._post_json(api_url, api_key, request_data, timeout, self._parse_qianwen_response)
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-
-        try:
-            response = requests.post(
-                api_url,
-                headers=headers,
-                json=request_data,
-                timeout=timeout
+    # ========== 异步调用（httpx连接池） ==========
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        懒加载当前事件循环共享的httpx异步客户端
+        客户端的连接绑定事件循环，每个循环各用一个；Worker里每次asyncio.run都是新循环，
+        同步入口须在循环结束前调用aclose_async_client释放连接
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                timeout=settings.AI_REQUEST_TIMEOUT
             )
-            response.raise_for_status()
-            resp_json = response.json()
+            self._async_clients[loop] = client
+        return client
 
-            # 日志记录响应概要
-            logger.debug(f"通义千问响应：{str(resp_json)[:500]}")
+    async def aclose_async_client(self) -> None:
+        """关闭当前事件循环的httpx异步客户端（asyncio.run的入口协程结束时调用，连接池不留到GC）"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
 
-            if isinstance(resp_json, dict):
-                if "output" in resp_json and "text" in resp_json["output"]:
-                    return {"status": "success", "content": resp_json["output"]["text"]}
-                else:
-                    err_msg = f"【返回格式异常】无'output.text'字段，响应：{str(resp_json)[:500]}"
-                    return {"status": "failure", "content": err_msg}
-            else:
-                err_msg = f"【返回非字典格式】响应：{str(resp_json)[:500]}"
+    async def _apost_json(self, api_url: str, api_key: str, request_data: Dict[str, Any], timeout: float, parse) -> Dict[str, Any]:
+        """_post_json的异步版本（同样的超时重试策略）"""
+        body = orjson.dumps(request_data)
+        for attempt in range(settings.AI_TIMEOUT_RETRIES + 1):
+            try:
+                response = await self._get_async_client().post(
+                    api_url,
+                    headers=self._build_headers(api_key),
+                    content=body,
+                    timeout=timeout
+                )
+                response.raise_for_status()
+                return parse(orjson.loads(response.content))
+
+            except httpx.HTTPStatusError as e:
+                err_msg = f"【HTTP错误】状态码：{e.response.status_code}，响应：{e.response.text[:500]}"
+                return {"status": "failure", "content": err_msg}
+            except httpx.TimeoutException:
+                logger.warning("请求%s超时（%s秒），第%s次", api_url, timeout, attempt + 1)
+                timeout *= 1.5
+            except Exception as e:
+                err_msg = f"【调用异常】{str(e)}"
                 return {"status": "failure", "content": err_msg}
 
-        except requests.exceptions.HTTPError as e:
-            err_msg = f"【HTTP错误】状态码：{e.response.status_code}，响应：{e.response.text[:500]}"
-            return {"status": "failure", "content": err_msg}
-        except requests.exceptions.Timeout:
-            err_msg = "【超时错误】请求超过60秒未响应"
-            return {"status": "failure", "content": err_msg}
+        err_msg = f"【超时错误】请求{settings.AI_TIMEOUT_RETRIES + 1}次均未在时限内响应"
+        return {"status": "failure", "content": err_msg}
+
+    async def _acall_ernie(self, api_key: str, api_url: str, prompt: str, temperature: float,
+                           max_tokens: int, timeout: float, model_version: str,
+                           system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """异步调用百度文心一言API"""
+        request_data = self._build_ernie_request(prompt, temperature, max_tokens, model_version, system_prompt)
+        return await self._apost_json(api_url, api_key, request_data, timeout, self._parse_ernie_response)
+
+    async def _acall_qianwen(self, api_key: str, api_url: str, prompt: str, temperature: float,
+                             max_tokens: int, timeout: float, model_version: str,
+                             system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """异步调用阿里云通义千问API"""
+        request_data = self._build_qianwen_request(prompt, temperature, max_tokens, model_version, system_prompt)
+        return await self._apost_json(api_url, api_key, request_data, timeout, self._parse_qianwen_response)
+
+    async def _ainvoke_model(
+        self,
+        model_name: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        model_version: Optional[str],
+        system_prompt: Optional[str],
+        request_timeout: Optional[float]
+    ) -> Optional[Dict[str, Any]]:
+        """_invoke_model的异步版本"""
+        start_time = time.time()
+        config = self.model_configs[model_name]
+        final_max_tokens = min(max_tokens, config["max_tokens_limit"])
+        callers = {"ernie": self._acall_ernie, "qianwen": self._acall_qianwen}
+        try:
+            result = await callers[model_name](
+                api_key=config["api_key"],
+                api_url=config["api_url"],
+                prompt=prompt,
+                temperature=temperature,
+                max_tokens=final_max_tokens,
+                timeout=request_timeout or config["timeout"],
+                model_version=model_version or config["default_model_version"],
+                system_prompt=system_prompt
+            )
+            elapsed = round(time.time() - start_time, 2)
+            logger.info("模型 %s 异步调用完成，耗时%s秒，状态：%s", model_name, elapsed, result['status'])
+            if result["status"] == "success":
+                return {"status": "success", "content": result["content"], "model_used": model_name}
+            logger.warning("模型 %s 调用失败：%s", model_name, result['content'])
         except Exception as e:
-            err_msg = f"【调用异常】{str(e)}"
-            return {"status": "failure", "content": err_msg}
+            logger.error("异步调用模型 %s 时发生异常：%s", model_name, e, exc_info=True)
+        return None
+
+    async def acall_ai(
+        self,
+        prompt: str,
+        model_name: Optional[ModelType] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 2048,
+        model_version: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        request_timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """call_ai的异步版本（参数和返回格式一致），供asyncio并发场景使用"""
+        cache_key = self._llm_cache_key(prompt, model_name, temperature, max_tokens, model_version, system_prompt)
+        if cache_key:
+            cached = await asyncio.to_thread(cache_get, cache_key)
+            if cached is not None:
+                logger.info("AI审查命中缓存：%s", cache_key)
+                return cached
+
+        if model_name:
+            if model_name not in self.available_models:
+                err_msg = f"指定的模型{model_name}不可用（未配置或配置错误），可用模型：{self.available_models}"
+                logger.error(err_msg)
+                return {"status": "failure", "content": err_msg, "model_used": None}
+            target_models = [model_name]
+        else:
+            target_models = self.available_models
+
+        call_args = (prompt, temperature, max_tokens, model_version, system_prompt, request_timeout)
+        tasks = [asyncio.create_task(self._ainvoke_model(name, *call_args)) for name in target_models]
+        ai_result = None
+        try:
+            # 多个模型同时发起，取最先成功的结果
+            for next_done in asyncio.as_completed(tasks):
+                ai_result = await next_done
+                if ai_result:
+                    break
+        finally:
+            # 取消还在进行的请求
+            for task in tasks:
+                task.cancel()
+
+        if ai_result:
+            if cache_key:
+                await asyncio.to_thread(cache_set, cache_key, ai_result, LLM_CACHE_EXPIRE_SECONDS)
+            return ai_result
+
+        return {
+            "status": "failure",
+            "content": f"【调用失败】目标模型{target_models}均调用失败，请检查网络或稍后重试",
+            "model_used": None
+        }
 
 # ========== 保留实例化（供cad_service导入） ==========
 ai_service = AIService()
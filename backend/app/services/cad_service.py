@@ -1,34 +1,59 @@
 import sys
 import os
 import io
+import asyncio
+import tempfile
 import logging
 import hashlib
+import shutil
 logging.getLogger('ezdxf').setLevel(logging.WARNING)
-import time
+import threading
+import heapq
+from collections import deque
 from pathlib import Path
 from typing import Optional, Dict
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
 import ezdxf
+import msgpack
+from cachetools import LRUCache
 
+# matplotlib、ezdxf绘图插件、pdf2image在用到的函数里延迟导入，缩短Worker启动时间和常驻内存
+try:
+    import fitz  # PyMuPDF：进程内渲染PDF，不启动poppler子进程
+except ImportError:
+    fitz = None
+try:
+    import blake3  # SIMD加速的BLAKE3，未安装时用标准库blake2b
+except ImportError:
+    blake3 = None
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
-from pdf2image import convert_from_bytes
-from ezdxf.addons.drawing import RenderContext, Frontend
-from ezdxf.addons.drawing.matplotlib import MatplotlibBackend
-
-from PIL import Image, ImageOps, ImageFilter
+from PIL import Image
 import numpy as np
 import cv2
 
-file_process_cache: Dict[str, dict] = {}
-CACHE_EXPIRE_SECONDS = 300
+# 进程内处理结果缓存：键里带上文件哈希和处理流程版本（模型/OCR配置），
+# 内容不变的文件不会因过期而重复处理，模型或OCR配置变化后旧结果自然不再命中；最多256个，按LRU淘汰
+file_process_cache: LRUCache = LRUCache(maxsize=256)
+_file_process_cache_lock = threading.RLock()
+
+# 本进程写入的临时CAD文件（按写入顺序），超过保留数量时直接删最早的，不用每次遍历目录
+TEMP_CAD_KEEP_LATEST = 10
+_recent_temp_files: deque = deque()
+_recent_temp_files_lock = threading.Lock()
+
+# DWG转换校验时已解析的DXF文档：键为(路径, 修改时间, 大小)，交给同一请求随后的渲染直接使用；
+# ezdxf的Document可变且非线程安全，取用时从缓存中移除，每个文档只交给一个调用方，不在线程间共享；
+# Document对象占内存较大，只保留最近几个
+_dxf_doc_cache: LRUCache = LRUCache(maxsize=4)
+_dxf_doc_cache_lock = threading.Lock()
 
 
 # ========== 补充缺失的核心导入 ==========
 from app.core.config import settings
+from app.utils.image_utils import autocontrast_gray, to_gray_array
 
 # 初始化logger
 logging.basicConfig(level=logging.INFO)
@@ -48,69 +73,131 @@ class CADRenderError(Exception):
     pass
 
 # ========== 补充缺失的核心依赖函数 ==========
+@lru_cache(maxsize=1)
 def _get_project_root() -> Path:
-    """获取项目根目录"""
+    """获取项目根目录（进程内不变，只算一次）"""
     return Path(__file__).parent.parent.parent  # 根据实际目录结构调整
 
-def save_temp_file(file_content: bytes, filename: str) -> str:
-    """保存二进制内容为临时文件，返回文件路径（同一文件只存一次）"""
-    file_hash = hashlib.md5(file_content).hexdigest()[:8] 
+def save_temp_file(file_content: bytes, filename: str, file_hash: Optional[str] = None) -> str:
+    """
+    保存二进制内容为临时文件，返回文件路径（同一文件只存一次）
+    :param file_hash: 可选，调用方已算好的_get_file_hash结果，避免重复哈希
+    """
+    file_hash = (file_hash or _get_file_hash(file_content))[:8]
     temp_dir = _get_project_root() / "temp" / "cad"
     temp_dir.mkdir(parents=True, exist_ok=True)
     temp_path = temp_dir / f"{file_hash}_{filename}"  # 哈希+文件名，确保唯一
     
     if temp_path.exists():
-        logger.info(f"文件已存在，复用临时文件：{temp_path}")
+        logger.info("文件已存在，复用临时文件：%s", temp_path)
+        # 复用也算一次使用，移到队尾，避免正在使用的文件被当成最早写入的删掉
+        _track_temp_file(temp_path)
         return str(temp_path)
     
-    with open(temp_path, "wb") as f:
+    # 先写到本线程独占的临时名再原子替换：并发写同一文件时，读方不会看到写了一半的内容
+    part_path = temp_path.with_name(f"{temp_path.name}.{threading.get_ident()}.part")
+    with open(part_path, "wb") as f:
         f.write(file_content)
-    logger.info(f"临时文件已保存：{temp_path}")
+    os.replace(part_path, temp_path)
+    logger.info("临时文件已保存：%s", temp_path)
+    _track_temp_file(temp_path)
     return str(temp_path)
 
+def _unlink_temp_file(file: Path) -> None:
+    try:
+        file.unlink(missing_ok=True)
+        logger.info("清理临时文件：%s", file)
+    except Exception as e:
+        logger.warning("清理临时文件失败：%s，错误：%s", file, e)
+
+def _track_temp_file(temp_path: Path, keep_latest: int = TEMP_CAD_KEEP_LATEST) -> None:
+    """
+    记录刚写入/复用的临时文件（已在队列中的移到队尾），超出保留数量时删除最久未用的
+    队列的增删和淘汰都在锁内完成，同一文件不会重复入队，也不会被两个线程各删一次
+    """
+    with _recent_temp_files_lock:
+        try:
+            _recent_temp_files.remove(temp_path)
+        except ValueError:
+            pass
+        _recent_temp_files.append(temp_path)
+        evicted = [_recent_temp_files.popleft() for _ in range(len(_recent_temp_files) - keep_latest)]
+    for file in evicted:
+        _unlink_temp_file(file)
+
 # ========== 缓存处理函数 ==========
 def _get_file_hash(file_content: bytes) -> str:
-    """生成文件内容的唯一哈希（MD5保证稳定性）"""
-    return hashlib.md5(file_content).hexdigest()
+    """生成文件内容的唯一哈希（BLAKE3，未安装时blake2b；都比MD5快得多）"""
+    if blake3 is not None:
+        return blake3.blake3(file_content).hexdigest()
+    return hashlib.blake2b(file_content, digest_size=32).hexdigest()
+
+def clean_temp_cad_files(keep_latest: int = TEMP_CAD_KEEP_LATEST, sweep: bool = False):
+    """
+    清理临时CAD文件，保留最新keep_latest个
+    平时只按本进程的写入记录裁剪，不遍历目录也不stat；
+    sweep=True时再按修改时间扫一遍目录，兜底清理进程重启前遗留的文件
+    """
+    with _recent_temp_files_lock:
+        evicted = [_recent_temp_files.popleft() for _ in range(len(_recent_temp_files) - keep_latest)]
+    for file in evicted:
+        _unlink_temp_file(file)
 
-def clean_temp_cad_files(keep_latest: int = 10):
-    """清理临时CAD文件，保留最新10个（避免频繁创建）"""
+    if not sweep:
+        return
     temp_dir = _get_project_root() / "temp" / "cad"
     if not temp_dir.exists():
         return
-    
-    files = sorted(
-        temp_dir.glob("*"),
-        key=lambda f: f.stat().st_mtime,
-        reverse=True
-    )
-    
-    for file in files[keep_latest:]:
-        try:
-            file.unlink()
-            logger.info(f"清理临时文件：{file}")
-        except Exception as e:
-            logger.warning(f"清理临时文件失败：{file}，错误：{str(e)}")
+    files = list(temp_dir.iterdir())
+    if len(files) <= keep_latest:
+        return
+    keep = set(heapq.nlargest(keep_latest, files, key=lambda f: f.stat().st_mtime))
+    for file in files:
+        if file not in keep:
+            _unlink_temp_file(file)
 
-def _check_cache(file_hash: str) -> Optional[dict]:
-    """检查缓存，返回有效结果或None"""
-    if file_hash not in file_process_cache:
-        return None
-    
-    cache_data = file_process_cache[file_hash]
-    if time.time() - cache_data["timestamp"] > CACHE_EXPIRE_SECONDS:
-        del file_process_cache[file_hash]
+def _process_cache_key(kind: str, file_hash: str) -> str:
+    """处理结果缓存键：类型 + 文件哈希 + 影响结果的模型/OCR版本"""
+    return f"{kind}:{file_hash}:{settings.ERNIE_MODEL}:{settings.DASHSCOPE_MODEL}:{settings.OCR_VERSION}"
+
+def rebind_result_filename(result: dict, filename: str) -> dict:
+    """
+    按内容哈希命中缓存的处理结果里，文件名还是首次上传时的：换成本次上传的文件名
+    返回新字典，不修改缓存里的对象；失败结果原样返回
+    """
+    inner = result.get("result")
+    if result.get("status") != "success" or not isinstance(inner, dict):
+        return result
+    inner = dict(inner)
+    if isinstance(inner.get("ai_review"), dict):
+        inner["ai_review"] = {**inner["ai_review"], "filename": filename}
+    if isinstance(inner.get("report"), dict):
+        report = {**inner["report"], "filename": filename}
+        if isinstance(report.get("ai_result"), dict):
+            report["ai_result"] = {**report["ai_result"], "filename": filename}
+        inner["report"] = report
+    return {**result, "result": inner}
+
+def _check_cache(cache_key: str, mark_processing: bool = False) -> Optional[dict]:
+    """
+    检查缓存，返回成功/处理中的条目，没有（或上次失败）时返回None
+    :param mark_processing: 未命中时在同一把锁内标记为处理中，并发请求同一文件只会有一个真正去处理
+    """
+    with _file_process_cache_lock:
+        cache_data = file_process_cache.get(cache_key)
+        if cache_data is not None and cache_data["status"] != "failed":
+            return cache_data
+        if mark_processing:
+            file_process_cache[cache_key] = {"status": "processing", "result": None}
         return None
-    
-    return cache_data
 
-def _update_cache(file_hash: str, status: str, result: dict = None):
+def _update_cache(cache_key: str, status: str, result: dict = None):
     """更新缓存"""
-    file_process_cache[file_hash] = {
-        "status": status,
-        "result": result,
-        "timestamp": time.time()
-    }
+    with _file_process_cache_lock:
+        file_process_cache[cache_key] = {
+            "status": status,
+            "result": result
+        }
 
 # ========== 业务函数 ==========
 def process_image_service(file_content: bytes, filename: str) -> dict:
@@ -142,7 +229,7 @@ def process_image_service(file_content: bytes, filename: str) -> dict:
             "message": "图片文件处理完成"    
         }
     except Exception as e:
-        logger.error(f"图片文件处理失败：{str(e)}", exc_info=True)
+        logger.error("图片文件处理失败：%s", e, exc_info=True)
         return {
             "status": "failed",
             "error": str(e),
@@ -157,8 +244,9 @@ def _validate_dwg_exists(dwg_file_path: str) -> Path:
         raise FileNotFoundError(f"DWG file not found: {dwg_file_path}")
     return dwg_path
 
+@lru_cache(maxsize=1)
 def _get_and_validate_converter_path() -> Path:
-    """获取并验证ODA转换器路径"""
+    """获取并验证ODA转换器路径（验证通过后缓存，不存在时抛异常、不缓存）"""
     converter_path_str = settings.ODA_CONVERTER_PATH
     converter_path = Path(converter_path_str)
     if not converter_path.exists():
@@ -179,29 +267,136 @@ def _determine_output_dxf_path(dwg_path: Path, output_dxf_path: Optional[str]) -
         out_path = out_folder / dxf_filename
     return out_path
 
-def _build_oda_converter_command(converter_path: Path, input_file: str, output_folder: str) -> list:
-    """严格对齐ODA官方命令格式"""
-    input_folder = str(Path(input_file).parent)
-    file_filter = Path(input_file).name
-
-    quoted_converter = f'"{str(converter_path)}"'
-    quoted_input_folder = f'"{input_folder}"'
-    quoted_output_folder = f'"{output_folder}"'
-    quoted_filter = f'"{file_filter}"'
-
-    return [
-        quoted_converter,
-        quoted_input_folder,
-        quoted_output_folder,
-        settings.ODA_TARGET_VERSION,
-        "DXF",
-        settings.ODA_OTHER_PARAM_1,  # 填0
-        settings.ODA_OTHER_PARAM_2,  # 填1
-        quoted_filter
-    ]
-
-def extract_layers_from_dxf(dxf_file_path: str, target_layers: list = None) -> dict:
-    """从 DXF 文件中提取指定图层的所有实体"""
+# ODA固定参数（输出版本、输出格式、递归0、审计1），模块加载时从配置读一次
+_ODA_ARGS = (
+    settings.ODA_TARGET_VERSION,
+    settings.ODA_OUTPUT_FORMAT,
+    settings.ODA_OTHER_PARAM_1,
+    settings.ODA_OTHER_PARAM_2,
+)
+
+def _build_oda_converter_command(converter_path: Path, input_folder: str, output_folder: str, file_filter: str) -> list:
+    """严格对齐ODA官方命令格式（ODA按目录+过滤条件批量转换；参数列表直接传给进程，无需引号转义）"""
+    return [str(converter_path), input_folder, output_folder, *_ODA_ARGS, file_filter]
+
+# 图层数据里逐实体的对象列与float32坐标列
+_LAYER_OBJECT_FIELDS = ("type", "handle", "text")
+_LAYER_COORD_FIELDS = ("x0", "y0", "x1", "y1")
+
+def _file_blake2b(file_path: Path) -> str:
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _dxf_layer_cache_path(file_hash: str, target_layers: list) -> Path:
+    layers_key = hashlib.blake2b("\x00".join(sorted(target_layers)).encode("utf-8"), digest_size=8).hexdigest()
+    name = f"v{settings.DXF_LAYER_CACHE_VERSION}_{file_hash}_{layers_key}.msgpack"
+    return Path(settings.DXF_LAYER_CACHE_DIR) / name
+
+def _load_dxf_layer_cache(cache_path: Path) -> Optional[dict]:
+    """读取磁盘缓存并还原为数组；缓存缺失或损坏时返回None"""
+    try:
+        packed = msgpack.unpackb(cache_path.read_bytes(), raw=False)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("DXF图层缓存损坏，重新解析：%s，错误：%s", cache_path, e)
+        return None
+    extracted_data = {}
+    for layer_name, columns in packed.items():
+        layer = {}
+        for field in _LAYER_OBJECT_FIELDS:
+            values = np.empty(len(columns[field]), dtype=object)
+            values[:] = columns[field]
+            layer[field] = values
+        for field in _LAYER_COORD_FIELDS:
+            layer[field] = np.frombuffer(columns[field], dtype=np.float32)
+        extracted_data[layer_name] = layer
+    return extracted_data
+
+def _save_dxf_layer_cache(cache_path: Path, extracted_data: dict) -> None:
+    """对象列存列表、坐标列存原始float32字节，先写临时文件再原子替换"""
+    packed = {
+        layer_name: {
+            **{field: layer[field].tolist() for field in _LAYER_OBJECT_FIELDS},
+            **{field: layer[field].tobytes() for field in _LAYER_COORD_FIELDS},
+        }
+        for layer_name, layer in extracted_data.items()
+    }
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(msgpack.packb(packed, use_bin_type=True))
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning("写入DXF图层缓存失败：%s，错误：%s", cache_path, e)
+
+def _layer_columns(entities: list) -> dict:
+    """
+    单个图层的结构数组（SoA）：每列按实体顺序排列，避免每个实体一个dict；
+    坐标列不适用的实体为NaN（TEXT: x0/y0为插入点；LINE: x0/y0为起点、x1/y1为终点）
+    """
+    n = len(entities)
+    types = np.empty(n, dtype=object)
+    types[:] = [e.dxftype() for e in entities]
+    handles = np.empty(n, dtype=object)
+    handles[:] = [e.dxf.handle for e in entities]
+    texts = np.empty(n, dtype=object)
+    coords = np.full((n, 4), np.nan, dtype=np.float32)
+
+    text_idx = np.flatnonzero(types == "TEXT")
+    if text_idx.size:
+        text_entities = [entities[i] for i in text_idx]
+        texts[text_idx] = [e.dxf.text for e in text_entities]
+        coords[text_idx, :2] = [(p.x, p.y) for p in (e.dxf.insert for e in text_entities)]
+    line_idx = np.flatnonzero(types == "LINE")
+    if line_idx.size:
+        coords[line_idx] = [
+            (start.x, start.y, end.x, end.y)
+            for start, end in ((entities[i].dxf.start, entities[i].dxf.end) for i in line_idx)
+        ]
+
+    return {
+        "type": types,
+        "handle": handles,
+        "text": texts,
+        "x0": coords[:, 0],
+        "y0": coords[:, 1],
+        "x1": coords[:, 2],
+        "y1": coords[:, 3],
+    }
+
+def _dxf_doc_key(dxf_path: Path) -> tuple:
+    stat = dxf_path.stat()
+    return str(dxf_path.resolve()), stat.st_mtime_ns, stat.st_size
+
+def _remember_dxf_doc(dxf_path: Path, doc) -> None:
+    """把已解析的文档登记到缓存（文件移动后调用，键按最终路径计算）"""
+    key = _dxf_doc_key(dxf_path)
+    with _dxf_doc_cache_lock:
+        _dxf_doc_cache[key] = doc
+
+def _read_dxf_once(dxf_file_path: str):
+    """
+    读取DXF文档：转换校验时已解析过的直接取走（从缓存移除，调用方独占），否则重新解析
+    返回的文档不会再交给其它调用方，调用方可以放心读写
+    """
+    dxf_path = Path(dxf_file_path)
+    key = _dxf_doc_key(dxf_path)
+    with _dxf_doc_cache_lock:
+        doc = _dxf_doc_cache.pop(key, None)
+    if doc is None:
+        doc = ezdxf.readfile(str(dxf_path))
+    return doc
+
+def extract_layers_from_dxf(dxf_file_path: str, target_layers: list = None) -> Dict[str, list]:
+    """
+    从 DXF 文件中提取指定图层的所有实体（每个实体一个dict）
+    实体很多时改用extract_layer_columns_from_dxf：按列存储，内存占用小，并有磁盘缓存
+    :return: {图层名: [{"type", "handle", "layer", TEXT另有"text"/"insert"，LINE另有"start"/"end"}, ...]}
+    """
     if target_layers is None:
         target_layers = []
 
@@ -211,10 +406,10 @@ def extract_layers_from_dxf(dxf_file_path: str, target_layers: list = None) -> d
         raise FileNotFoundError(f"DXF 文件未找到: {dxf_path}")
 
     try:
-        doc = ezdxf.readfile(str(dxf_path))
+        doc = _read_dxf_once(str(dxf_path))
         msp = doc.modelspace()
     except Exception as e:
-        logger.error(f"读取DXF文件错误详情: {str(e)}", exc_info=True)
+        logger.error("读取DXF文件错误详情: %s", e, exc_info=True)
         raise CADConversionError(f"读取 DXF 文件失败: {dxf_path}") from e
 
     extracted_data = {}
@@ -260,68 +455,246 @@ def extract_layers_from_dxf(dxf_file_path: str, target_layers: list = None) -> d
     )
     return extracted_data
 
-def convert_dwg_to_dxf_from_path(dwg_file_path: str, output_dxf_path: Optional[str] = None) -> str:
-    """将DWG文件转换为DXF（通过ODA转换器，增加重试和兼容）"""
-    dwg_path = _validate_dwg_exists(dwg_file_path)
-    converter_path = _get_and_validate_converter_path()
-    out_path = _determine_output_dxf_path(dwg_path, output_dxf_path)
+def extract_layer_columns_from_dxf(dxf_file_path: str, target_layers: list = None,
+                                   file_hash: Optional[str] = None) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    从 DXF 文件中按图层提取实体，按列存储（SoA）：每个图层一组等长数组，不为每个实体建dict
+    同一文件（按内容哈希）重复提取时直接读磁盘缓存，不再重新解析
+    :param file_hash: 可选，调用方已算好的文件内容blake2b哈希
+    :return: {图层名: {"type"/"handle"/"text": 按实体顺序的object数组, "x0"/"y0"/"x1"/"y1": float32坐标数组}}，
+             坐标含义见_layer_columns
+    """
+    if target_layers is None:
+        target_layers = []
 
-    # 重试机制：最多重试1次
-    max_retries = 1
-    retry_count = 0
-    while retry_count < max_retries:
-        input_file = str(dwg_path)
-        output_folder = str(out_path.parent)
-        cmd = _build_oda_converter_command(converter_path, input_file, output_folder)
+    dxf_path = Path(dxf_file_path)
+    if not dxf_path.exists():
+        logger.error("DXF 文件未找到: %s", dxf_path)
+        raise FileNotFoundError(f"DXF 文件未找到: {dxf_path}")
 
-        logger.debug("Executing ODAFileConverter (重试%d): %s", retry_count, " ".join(cmd))
+    cache_path = _dxf_layer_cache_path(file_hash or _file_blake2b(dxf_path), target_layers)
+    cached = _load_dxf_layer_cache(cache_path)
+    if cached is not None:
+        logger.info("DXF图层命中磁盘缓存：%s", cache_path.name)
+        return cached
 
-        try:
-            cmd_str = " ".join(cmd)
-            result = subprocess.run(
-                cmd_str, 
-                capture_output=True, 
-                text=True, 
-                timeout=120,
-                shell=True,
-                creationflags=subprocess.CREATE_NO_WINDOW
-            )
-        except subprocess.TimeoutExpired as e:
-            logger.error(f"ODAFileConverter 超时错误详情: {str(e)}", exc_info=True)
-            retry_count += 1
+    try:
+        doc = _read_dxf_once(str(dxf_path))
+        msp = doc.modelspace()
+    except Exception as e:
+        logger.error("读取DXF文件错误详情: %s", e, exc_info=True)
+        raise CADConversionError(f"读取 DXF 文件失败: {dxf_path}") from e
+
+    # 按图层分组交给ezdxf完成：指定了目标图层时逐层query，否则一次groupby（保持图层首次出现的顺序）
+    if target_layers:
+        layer_groups = {layer_name: msp.query(f'*[layer=="{layer_name}"]') for layer_name in dict.fromkeys(target_layers)}
+    else:
+        layer_groups = msp.groupby(dxfattrib="layer")
+
+    extracted_data = {}
+    for layer_name, entities in layer_groups.items():
+        entities = list(entities)
+        if entities:
+            extracted_data[layer_name] = _layer_columns(entities)
+
+    logger.info(
+        "成功提取 DXF 图层",
+        extra={"dxf_file_path": str(dxf_path), "extracted_layers": list(extracted_data.keys())},
+    )
+    _save_dxf_layer_cache(cache_path, extracted_data)
+    return extracted_data
+
+def _stage_dwg_file(src: Path, dest: Path) -> None:
+    """把DWG放进ODA的输入目录：优先硬链接，跨盘或不支持时再复制"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+def _run_oda_converter(cmd: list, timeout: float) -> int:
+    """
+    运行ODA转换器：不经过shell直接启动进程；stdout直接丢弃（大图纸时输出很多），
+    只用管道收stderr，且只在失败时才解码记录日志
+    :return: 进程返回码
+    """
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        # CREATE_NO_WINDOW只在Windows上存在
+        creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+    )
+    try:
+        _, err = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+    if proc.returncode != 0:
+        logger.error(
+            "DWG conversion failed (code=%s). stderr: %s",
+            proc.returncode,
+            err.decode("utf-8", errors="replace"),
+        )
+    return proc.returncode
+
+def _stage_dwg_batch(dwg_paths: list, input_folder: str) -> list:
+    """
+    把一批DWG放进ODA输入目录：加序号前缀，不同目录下同名的DWG互不覆盖，输出也能按文件名对应回输入
+    :return: 各文件在输入目录里的文件名主干（与dwg_paths一一对应）
+    """
+    staged_stems = []
+    for idx, dwg_path in enumerate(dwg_paths):
+        staged_name = f"{idx}_{dwg_path.name}"
+        _stage_dwg_file(dwg_path, Path(input_folder) / staged_name)
+        staged_stems.append(Path(staged_name).stem)
+    return staged_stems
+
+def _collect_converted_dxf(dwg_paths: list, staged_stems: list, out_paths: list, output_folder: str,
+                           converted: Dict[str, str]) -> None:
+    """校验ODA输出目录里的DXF并移动到目标路径，成功的记入converted"""
+    for dwg_path, stem, out_path in zip(dwg_paths, staged_stems, out_paths):
+        if str(dwg_path) in converted:
             continue
+        staged_dxf = Path(output_folder) / f"{stem}.dxf"
+        if not staged_dxf.exists():
+            continue
+        try:
+            doc = ezdxf.readfile(str(staged_dxf))
         except Exception as e:
-            logger.error(f"执行ODAFileConverter错误详情: {str(e)}", exc_info=True)
-            retry_count += 1
+            logger.error("生成的DXF文件无效：%s", e, exc_info=True)
             continue
+        shutil.move(str(staged_dxf), str(out_path))
+        # 校验时已完整解析过，登记下来供后续渲染直接复用
+        _remember_dxf_doc(out_path, doc)
+        logger.info(
+            "DWG转换为DXF成功",
+            extra={
+                "input_file": str(dwg_path),
+                "output_file": str(out_path)
+            }
+        )
+        converted[str(dwg_path)] = str(out_path.resolve())
+
+def _log_failed_conversions(dwg_paths: list, converted: Dict[str, str]) -> None:
+    if len(converted) < len(dwg_paths):
+        failed = [str(p) for p in dwg_paths if str(p) not in converted]
+        logger.error("以下DWG转换失败：%s", failed)
+
+def convert_many_dwg_to_dxf(dwg_file_paths: list, output_dxf_paths: Optional[list] = None) -> Dict[str, str]:
+    """
+    批量将DWG转换为DXF：所有输入放进同一个临时目录，只启动一次ODA转换器
+    （ODA启动约1-2秒，批量转换时分摊到每个文件）
+    :param dwg_file_paths: DWG文件路径列表
+    :param output_dxf_paths: 可选，与输入一一对应的DXF输出路径（None表示默认输出目录）
+    :return: {输入DWG路径: 输出DXF绝对路径}，转换失败的文件不在结果中
+    """
+    dwg_paths = [_validate_dwg_exists(p) for p in dwg_file_paths]
+    converter_path = _get_and_validate_converter_path()
+    output_dxf_paths = output_dxf_paths or [None] * len(dwg_paths)
+    out_paths = [_determine_output_dxf_path(p, o) for p, o in zip(dwg_paths, output_dxf_paths)]
+
+    converted: Dict[str, str] = {}
+    with tempfile.TemporaryDirectory() as input_folder, tempfile.TemporaryDirectory() as output_folder:
+        staged_stems = _stage_dwg_batch(dwg_paths, input_folder)
+
+        # 重试机制：最多重试1次
+        max_retries = 1
+        retry_count = 0
+        while retry_count < max_retries and len(converted) < len(dwg_paths):
+            cmd = _build_oda_converter_command(converter_path, input_folder, output_folder, "*.DWG")
+
+            logger.debug("Executing ODAFileConverter (重试%d): %s", retry_count, cmd)
 
-        if result.returncode == 0 and out_path.exists():
             try:
-                ezdxf.readfile(str(out_path))
+                _run_oda_converter(cmd, timeout=120 * len(dwg_paths))
+            except subprocess.TimeoutExpired as e:
+                logger.error("ODAFileConverter 超时错误详情: %s", e, exc_info=True)
+                retry_count += 1
+                continue
             except Exception as e:
-                logger.error(f"生成的DXF文件无效：{str(e)}", exc_info=True)
+                logger.error("执行ODAFileConverter错误详情: %s", e, exc_info=True)
                 retry_count += 1
                 continue
-            
-            logger.info(
-                "DWG转换为DXF成功",
-                extra={
-                    "input_file": str(dwg_path),
-                    "output_file": str(out_path)
-                }
-            )
-            return str(out_path.resolve())
+
+            _collect_converted_dxf(dwg_paths, staged_stems, out_paths, output_folder, converted)
+            retry_count += 1
+
+    _log_failed_conversions(dwg_paths, converted)
+    return converted
+
+async def _arun_oda_converter(cmd: list, timeout: float) -> int:
+    """_run_oda_converter的异步版本：等待ODA子进程时不占用事件循环"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+    )
+    try:
+        _, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.communicate()
+        raise
+    if proc.returncode != 0:
+        logger.error(
+            "DWG conversion failed (code=%s). stderr: %s",
+            proc.returncode,
+            err.decode("utf-8", errors="replace"),
+        )
+    return proc.returncode
+
+async def aconvert_many_dwg_to_dxf(dwg_file_paths: list, output_dxf_paths: Optional[list] = None) -> Dict[str, str]:
+    """convert_many_dwg_to_dxf的异步版本：文件拷贝/DXF校验放到线程，ODA子进程异步等待"""
+    dwg_paths = [_validate_dwg_exists(p) for p in dwg_file_paths]
+    converter_path = _get_and_validate_converter_path()
+    output_dxf_paths = output_dxf_paths or [None] * len(dwg_paths)
+    out_paths = [_determine_output_dxf_path(p, o) for p, o in zip(dwg_paths, output_dxf_paths)]
+
+    converted: Dict[str, str] = {}
+    with tempfile.TemporaryDirectory() as input_folder, tempfile.TemporaryDirectory() as output_folder:
+        staged_stems = await asyncio.to_thread(_stage_dwg_batch, dwg_paths, input_folder)
+        cmd = _build_oda_converter_command(converter_path, input_folder, output_folder, "*.DWG")
+        logger.debug("Executing ODAFileConverter: %s", cmd)
+        try:
+            await _arun_oda_converter(cmd, timeout=120 * len(dwg_paths))
+        except asyncio.TimeoutError as e:
+            logger.error("ODAFileConverter 超时错误详情: %s", e, exc_info=True)
+        except Exception as e:
+            logger.error("执行ODAFileConverter错误详情: %s", e, exc_info=True)
         else:
-            logger.error(
-                "DWG conversion failed (code=%s). stdout: %s stderr: %s",
-                result.returncode,
-                result.stdout,
-                result.stderr,
+            await asyncio.to_thread(
+                _collect_converted_dxf, dwg_paths, staged_stems, out_paths, output_folder, converted
             )
-            retry_count += 1
-    
-    # 所有重试失败
-    raise CADConversionError(f"DWG转换失败（已重试{max_retries}次）：{result.stderr or result.stdout}")
+
+    _log_failed_conversions(dwg_paths, converted)
+    return converted
+
+def convert_dwg_to_dxf_from_path(dwg_file_path: str, output_dxf_path: Optional[str] = None,
+                                 return_doc: bool = False):
+    """
+    将DWG文件转换为DXF（单文件走批量转换的N=1路径）
+    :param return_doc: True时返回(DXF路径, 已解析的Document)，调用方无需再解析一遍
+    """
+    converted = convert_many_dwg_to_dxf([dwg_file_path], [output_dxf_path])
+    dxf_path = converted.get(str(Path(dwg_file_path)))
+    if dxf_path is None:
+        raise CADConversionError(f"DWG转换失败：{dwg_file_path}")
+    if return_doc:
+        return dxf_path, _read_dxf_once(dxf_path)
+    return dxf_path
+
+async def aconvert_dwg_to_dxf_from_path(dwg_file_path: str, output_dxf_path: Optional[str] = None,
+                                        return_doc: bool = False):
+    """convert_dwg_to_dxf_from_path的异步版本"""
+    converted = await aconvert_many_dwg_to_dxf([dwg_file_path], [output_dxf_path])
+    dxf_path = converted.get(str(Path(dwg_file_path)))
+    if dxf_path is None:
+        raise CADConversionError(f"DWG转换失败：{dwg_file_path}")
+    if return_doc:
+        return dxf_path, await asyncio.to_thread(_read_dxf_once, dxf_path)
+    return dxf_path
 
 def convert_dwg_to_dxf_from_bytes(file_content: bytes, filename: str) -> dict:
     """将二进制的 DWG 文件内容转换为 DXF"""
@@ -339,8 +712,129 @@ def convert_dwg_to_dxf_from_bytes(file_content: bytes, filename: str) -> dict:
         "dxf_file_path": dxf_file_path
     }
 
-def cad_to_png(cad_file_path: str, output_png_path: str = "temp_cad_render.png") -> str:
-    """将CAD文件（DWG/DXF）转换为PNG图片"""
+def _draw_layout_pymupdf(doc, msp):
+    """ezdxf的PyMuPDF后端绘制模型空间（比Matplotlib逐实体建Line2D快得多），返回(后端, 页面)"""
+    from ezdxf.addons.drawing import RenderContext, Frontend, layout
+    from ezdxf.addons.drawing.pymupdf import PyMuPdfBackend
+
+    backend = PyMuPdfBackend()
+    Frontend(RenderContext(doc), backend).draw_layout(msp, finalize=True)
+    # 页面尺寸沿用CAD_RENDER_FIGSIZE（英寸），图形自动缩放到页面内、不留边距
+    width_in, height_in = settings.CAD_RENDER_FIGSIZE
+    page = layout.Page(width_in * 25.4, height_in * 25.4, layout.Units.mm, margins=layout.Margins.all(0))
+    return backend, page
+
+def _render_layout_pymupdf(doc, msp, dpi: int) -> bytes:
+    """PyMuPDF后端直接光栅化为PNG二进制"""
+    backend, page = _draw_layout_pymupdf(doc, msp)
+    return backend.get_pixmap_bytes(page, fmt="png", dpi=dpi)
+
+def _render_layout_pymupdf_array(doc, msp, dpi: int, gray: bool = False) -> np.ndarray:
+    """
+    PyMuPDF后端光栅化为像素数组（不经过PNG编码）
+    :param gray: True时MuPDF直接按灰度光栅化（单通道，像素量只有RGB的1/3，省掉之后的灰度转换）
+    """
+    backend, page = _draw_layout_pymupdf(doc, msp)
+    with fitz.open(stream=backend.get_pdf_bytes(page), filetype="pdf") as pdf:
+        pix = pdf[0].get_pixmap(dpi=dpi, alpha=False, colorspace=fitz.csGRAY if gray else fitz.csRGB)
+        pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        return pixels[:, :, 0] if gray else pixels
+
+def _make_batched_line_backend(ax):
+    """
+    MatplotlibBackend默认每条线段一个Line2D，实体多时绘制极慢；
+    这里把线段按(颜色, 线宽)分组攒起来，finalize时每组只建一个LineCollection
+    """
+    from matplotlib.collections import LineCollection
+    from ezdxf.addons.drawing.matplotlib import MatplotlibBackend
+
+    class BatchedLineBackend(MatplotlibBackend):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._segments: Dict[tuple, list] = {}
+
+        def _line_group(self, properties) -> list:
+            key = (properties.color, self._get_lineweight(properties))
+            return self._segments.setdefault(key, [])
+
+        def draw_line(self, start, end, properties):
+            # 起止点重合时按点绘制，交给父类处理
+            if start.isclose(end):
+                return super().draw_line(start, end, properties)
+            self._line_group(properties).append((start.x, start.y, end.x, end.y))
+
+        def draw_solid_lines(self, lines, properties):
+            self._line_group(properties).extend((s.x, s.y, e.x, e.y) for s, e in lines)
+
+        def finalize(self):
+            for (color, linewidth), segments in self._segments.items():
+                coords = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+                collection = LineCollection(coords, colors=color, linewidths=linewidth, capstyle="butt")
+                # 只影响PDF/SVG等矢量输出，PNG渲染不受影响
+                collection.set_rasterized(settings.CAD_VECTOR_OUTPUT)
+                self.ax.add_collection(collection)
+            self._segments.clear()
+            super().finalize()
+
+    return BatchedLineBackend(ax)
+
+# 每个线程复用一套Figure/画布/坐标轴，省去每次渲染新建Figure的初始化开销
+_FIG_POOL = threading.local()
+
+def _get_thread_figure(dpi: int):
+    """取当前线程的Figure（首次使用时创建），按本次参数调整尺寸和DPI"""
+    import matplotlib
+    matplotlib.use('Agg')
+    # 直接用Figure+Agg画布，不经过pyplot的全局状态机（pyplot非线程安全，初始化也慢）
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    if getattr(_FIG_POOL, "fig", None) is None:
+        fig = Figure(figsize=settings.CAD_RENDER_FIGSIZE, dpi=dpi)
+        _FIG_POOL.canvas = FigureCanvasAgg(fig)
+        # 坐标轴铺满画布，不再需要savefig(bbox_inches="tight")额外算一遍包围盒
+        _FIG_POOL.ax = fig.add_axes((0, 0, 1, 1))
+        _FIG_POOL.fig = fig
+    fig = _FIG_POOL.fig
+    if tuple(fig.get_size_inches()) != tuple(settings.CAD_RENDER_FIGSIZE):
+        fig.set_size_inches(settings.CAD_RENDER_FIGSIZE)
+    if fig.get_dpi() != dpi:
+        fig.set_dpi(dpi)
+    return fig, _FIG_POOL.canvas, _FIG_POOL.ax
+
+def _render_layout_matplotlib(doc, msp, dpi: int) -> np.ndarray:
+    """未安装PyMuPDF时的兜底渲染，返回RGBA像素数组（Figure按线程复用，不使用pyplot全局状态）"""
+    from ezdxf import bbox
+    from ezdxf.addons.drawing import RenderContext, Frontend
+
+    fig, canvas, ax = _get_thread_figure(dpi)
+    try:
+        Frontend(RenderContext(doc), _make_batched_line_backend(ax)).draw_layout(msp, finalize=True)
+        extents = bbox.extents(msp, fast=True)
+        if extents.has_data:
+            ax.set_xlim(extents.extmin.x, extents.extmax.x)
+            ax.set_ylim(extents.extmin.y, extents.extmax.y)
+        # 包围盒已知，直接定死范围和等比例，绘制时不再做自适应缩放；datalim方式保证坐标轴仍铺满画布
+        ax.set_aspect("equal", adjustable="datalim")
+        ax.axis("off")
+
+        # 只渲染一遍，直接取Agg画布的RGBA缓冲区（拷贝一份，画布下次还要复用）
+        canvas.draw()
+        return np.array(canvas.buffer_rgba())
+    finally:
+        # 清掉本次的图元，释放内存，Figure留给下次渲染
+        ax.cla()
+
+def cad_to_png(cad_file_path: str, output_png_path: str = "temp_cad_render.png", dpi: Optional[int] = None,
+               return_array: bool = False, gray: bool = False):
+    """
+    将CAD文件（DWG/DXF）转换为PNG图片（默认PyMuPDF后端，未安装时回退Matplotlib）
+    :param dpi: 渲染DPI，默认settings.CAD_RENDER_DPI
+    :param return_array: True时不写PNG文件，直接返回RGB/RGBA像素数组（供后续处理只编码一次）
+    :param gray: 配合return_array，PyMuPDF后端直接输出单通道灰度数组（Matplotlib回退时仍为RGB）
+    :return: PNG文件绝对路径，或像素数组
+    """
+    dpi = dpi or settings.CAD_RENDER_DPI
     from ezdxf import DXFError
 
     cad_path = Path(cad_file_path)
@@ -351,141 +845,210 @@ def cad_to_png(cad_file_path: str, output_png_path: str = "temp_cad_render.png")
     try:
         if cad_path.suffix.lower() == ".dwg":
             logger.info("Input is DWG; converting to DXF first: %s", cad_file_path)
-            dxf_path = convert_dwg_to_dxf_from_path(str(cad_path))
+            dxf_path, doc = convert_dwg_to_dxf_from_path(str(cad_path), return_doc=True)
             cad_path = Path(dxf_path)
-
-        doc = ezdxf.readfile(str(cad_path))
+        else:
+            doc = _read_dxf_once(str(cad_path))
     except FileNotFoundError:
         raise
     except DXFError as e:
-        logger.error(f"无效的DXF/CAD文件错误详情: {str(e)}", exc_info=True)
+        logger.error("无效的DXF/CAD文件错误详情: %s", e, exc_info=True)
         raise CADRenderError(f"Invalid DXF/CAD file: {cad_path}") from e
     except Exception as e:
-        logger.error(f"读取CAD文件错误详情: {str(e)}", exc_info=True)
+        logger.error("读取CAD文件错误详情: %s", e, exc_info=True)
         raise CADRenderError(f"Failed to read CAD file: {cad_path}") from e
 
+    return _render_cad_document(doc, output_png_path, dpi, return_array, gray)
+
+def _read_dxf_bytes(file_content: bytes):
+    """
+    直接从内存读取DXF：R2007+及纯ASCII的DXF按UTF-8解码后正常读取，
+    旧版本按代码页编码的DXF交给recover模块自动识别编码
+    :param file_content: bytes或任意支持缓冲区协议的对象（如任务传入的只读mmap）
+    """
+    try:
+        # str(buffer, encoding)对任意缓冲区对象都能解码，mmap没有decode方法
+        text = str(file_content, "utf-8")
+    except UnicodeDecodeError:
+        from ezdxf import recover
+        doc, _ = recover.read(io.BytesIO(file_content))
+        return doc
+    return ezdxf.read(io.StringIO(text))
+
+def cad_to_png_from_bytes(file_content: bytes, suffix: str, output_png_path: str = "temp_cad_render.png",
+                          dpi: Optional[int] = None, return_array: bool = False, file_hash: Optional[str] = None):
+    """
+    cad_to_png的内存版本：DXF直接从字节解析，不写临时文件；DWG仍需落盘交给ODA转换
+    :param suffix: 文件扩展名（.dxf/.dwg）
+    :param file_hash: 可选，调用方已算好的_get_file_hash结果，DWG落盘时不再重复哈希
+    """
+    dpi = dpi or settings.CAD_RENDER_DPI
+    if suffix.lower() == ".dwg":
+        temp_path = save_temp_file(file_content, f"cad{suffix.lower()}", file_hash)
+        return cad_to_png(temp_path, output_png_path, dpi, return_array)
+
+    from ezdxf import DXFError
+    try:
+        doc = _read_dxf_bytes(file_content)
+    except DXFError as e:
+        logger.error("无效的DXF/CAD文件错误详情: %s", e, exc_info=True)
+        raise CADRenderError("Invalid DXF/CAD file") from e
+    except Exception as e:
+        logger.error("读取CAD文件错误详情: %s", e, exc_info=True)
+        raise CADRenderError("Failed to read CAD file") from e
+
+    return _render_cad_document(doc, output_png_path, dpi, return_array)
+
+def _render_cad_document(doc, output_png_path: str, dpi: int, return_array: bool, gray: bool = False):
+    """渲染已解析的CAD文档：写PNG文件返回路径，或直接返回像素数组"""
     try:
         msp = doc.modelspace()
-        fig, ax = plt.subplots(figsize=settings.CAD_RENDER_FIGSIZE)
-        ctx = RenderContext(doc)
-        out = MatplotlibBackend(ax)
-        frontend = Frontend(ctx, out)
-        frontend.draw_layout(msp, finalize=True)
-        ax.axis("off")
+        if return_array:
+            if fitz is not None:
+                return _render_layout_pymupdf_array(doc, msp, dpi, gray)
+            return _render_layout_matplotlib(doc, msp, dpi)
 
         out_path = Path(output_png_path)
         if not out_path.is_absolute():
             out_path = _get_project_root() / out_path
             out_path.parent.mkdir(parents=True, exist_ok=True)
 
-        plt.savefig(
-            str(out_path),
-            dpi=300,
-            bbox_inches="tight",
-            pad_inches=0
-        )
-        plt.close(fig)
+        if fitz is not None:
+            out_path.write_bytes(_render_layout_pymupdf(doc, msp, dpi))
+        else:
+            Image.fromarray(_render_layout_matplotlib(doc, msp, dpi)).save(str(out_path), "PNG", optimize=False)
         logger.info("CAD rendered to PNG: %s", out_path)
         return str(out_path.resolve())
 
     except Exception as e:
-        logger.error(f"渲染错误详情: {str(e)}", exc_info=True)
+        logger.error("渲染错误详情: %s", e, exc_info=True)
         raise CADRenderError("Failed to render CAD to PNG") from e
 
+def _preprocess_for_ocr(pixels: np.ndarray) -> np.ndarray:
+    """
+    OCR预处理：灰度化→自动对比度→3x3中值去噪
+    全程只分配两块单通道缓冲区，对比度查表原地完成，不再每一步生成新数组
+    """
+    gray = to_gray_array(pixels)
+    if gray is pixels:
+        gray = pixels.copy()
+    gray = autocontrast_gray(gray, cutoff=2)
+    return cv2.medianBlur(gray, 3)
+
 def render_cad_to_image(file_content: bytes, file_type: str) -> bytes:
     """将DWG/DXF二进制内容渲染为图片二进制（适配OCR服务入参）"""
-    file_hash = hashlib.md5(file_content).hexdigest()
+    file_hash = _get_file_hash(file_content)
+    cache_key = _process_cache_key("render", file_hash)
     
-    # 1. 检查缓存
-    cache_data = _check_cache(file_hash)
+    # 1. 检查缓存，未命中时同时标记为处理中
+    cache_data = _check_cache(cache_key, mark_processing=True)
     if cache_data:
         if cache_data["status"] == "success":
-            logger.info(f"复用缓存结果：{file_hash}")
+            logger.info("复用缓存结果：%s", file_hash)
             return cache_data["result"]
         elif cache_data["status"] == "processing":
             raise CADRenderError(f"文件{file_hash}正在处理中，请稍后重试")
     
-    # 2. 标记为处理中
-    _update_cache(file_hash, "processing")
-    
     try:
         temp_filename = f"temp_{file_type}_" + file_hash[:8] + f".{file_type}"
-        temp_cad_path = save_temp_file(file_content, temp_filename)
-        png_path = cad_to_png(temp_cad_path, f"{temp_filename}.png")
-        if not Path(png_path).exists():
-            raise CADRenderError(f"CAD渲染图片失败，PNG路径不存在：{png_path}")
-        
-        with open(png_path, "rb") as f:
-            img = Image.open(f)
-            # 1. 放大2倍（解决文字太小）
-            img = img.resize((img.width*2, img.height*2), Image.Resampling.LANCZOS)
-            # 2. 灰度化+增强对比度（和OCR预处理对齐）
-            img = img.convert("L")
-            img = ImageOps.autocontrast(img, cutoff=2)
-            # 3. 去噪
-            img = img.filter(ImageFilter.MedianFilter(size=3))
-        
-            # 转成字节
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG', dpi=(300, 300))
-            png_bytes = img_byte_arr.getvalue()
-
-        try:
-            os.remove(png_path)
-            logger.info(f"清理临时PNG文件：{png_path}")
-        except Exception as e:
-            logger.warning(f"清理临时PNG文件失败：{png_path}，错误：{str(e)}")
+        temp_cad_path = save_temp_file(file_content, temp_filename, file_hash)
+        # 渲染结果直接以像素数组返回，不落PNG文件再读回解码；OCR只需要灰度，光栅化时就只出单通道
+        pixels = cad_to_png(temp_cad_path, dpi=settings.CAD_OCR_RENDER_DPI, return_array=True, gray=True)
 
+        # 后处理全部用OpenCV在uint8数组上完成，最后只编码一次PNG
+        # 1. 灰度化+增强对比度+去噪（分辨率由渲染DPI决定，不再插值放大）
+        img = _preprocess_for_ocr(pixels)
+        # 2. 转成字节
+        ok, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        if not ok:
+            raise CADRenderError("CAD渲染图片PNG编码失败")
+        png_bytes = buf.tobytes()
 
-        
         # 3. 更新缓存为成功
-        _update_cache(file_hash, "success", png_bytes)
+        _update_cache(cache_key, "success", png_bytes)
         return png_bytes
     
     except Exception as e:
-        logger.error(f"CAD渲染为图片失败：{str(e)}", exc_info=True)
-        _update_cache(file_hash, "failed")
+        logger.error("CAD渲染为图片失败：%s", e, exc_info=True)
+        _update_cache(cache_key, "failed")
         raise CADRenderError(f"CAD渲染为图片失败：{str(e)}") from e
 
-def process_dxf_service(file_content: bytes, filename: str) -> dict:
-    """处理DXF文件：渲染为图片+OCR+AI审查+报告生成"""
+def _render_pdf_page(file_path: str, page: int, dpi: int, image_format: str = "PNG") -> bytes:
+    """渲染PDF单页为图片二进制（每页单独一个poppler子进程）"""
+    from pdf2image import convert_from_path
+    images = convert_from_path(
+        file_path,
+        dpi=dpi,
+        first_page=page,
+        last_page=page,
+        poppler_path=getattr(settings, "POPPLER_PATH", None)
+    )
+    if not images:
+        raise ValueError(f"PDF第{page}页渲染失败")
+
+    img_byte_arr = io.BytesIO()
+    if image_format.upper() == "JPEG":
+        # 只给OCR用的中间图：有损JPEG足够识别，关闭optimize省掉第二遍编码
+        images[0].convert("RGB").save(img_byte_arr, format="JPEG", quality=settings.OCR_JPEG_QUALITY, optimize=False)
+    else:
+        images[0].save(img_byte_arr, format='PNG', dpi=(dpi, dpi))
+    return img_byte_arr.getvalue()
+
+def render_pdf_to_png(file_path: str, dpi: int = 300, image_format: str = "PNG") -> list:
+    """
+    将PDF所有页面并发渲染为图片二进制列表（按页序返回，默认PNG）
+    渲染在poppler子进程里完成、不占GIL，用线程池并发等待即可；
+    Celery prefork的Worker是守护进程，不能再开进程池
+    """
+    from pdf2image import pdfinfo_from_path
+    page_count = pdfinfo_from_path(file_path, poppler_path=getattr(settings, "POPPLER_PATH", None))["Pages"]
+    if not page_count:
+        raise ValueError("PDF文件无有效页面")
+
+    max_workers = min(page_count, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = list(executor.map(lambda page: _render_pdf_page(file_path, page, dpi, image_format), range(1, page_count + 1)))
+    logger.info("PDF并发渲染完成：共%s页，线程数%s，格式%s", page_count, max_workers, image_format)
+    return pages
+
+async def _arender_cad_bytes(file_content: bytes, suffix: str, file_hash: Optional[str] = None) -> np.ndarray:
+    """异步渲染CAD二进制为像素数组：DWG转换时异步等待ODA，解析/渲染放到线程执行"""
+    if suffix.lower() != ".dwg":
+        return await asyncio.to_thread(cad_to_png_from_bytes, file_content, suffix, return_array=True)
+    temp_path = await asyncio.to_thread(save_temp_file, file_content, f"cad{suffix.lower()}", file_hash)
+    _, doc = await aconvert_dwg_to_dxf_from_path(temp_path, return_doc=True)
+    return await asyncio.to_thread(_render_cad_document, doc, "", settings.CAD_RENDER_DPI, True)
+
+async def aprocess_dxf_service(file_content: bytes, filename: str) -> dict:
+    """处理DXF文件：渲染为图片+OCR+AI审查+报告生成（阻塞步骤都不占用事件循环）"""
     file_hash = _get_file_hash(file_content)
-    # 1. 检查缓存
-    cache_data = _check_cache(file_hash)
+    cache_key = _process_cache_key("dxf", file_hash)
+    # 1. 检查缓存，未命中时同时标记为处理中
+    cache_data = _check_cache(cache_key, mark_processing=True)
     if cache_data:
         if cache_data["status"] == "success":
-            logger.info(f"复用缓存结果：{file_hash}")
-            return cache_data["result"]
+            logger.info("复用缓存结果：%s", file_hash)
+            return rebind_result_filename(cache_data["result"], filename)
         elif cache_data["status"] == "processing":
             raise CADRenderError(f"文件{file_hash}正在处理中，请稍后重试")
     
-    # 2. 标记为处理中
-    _update_cache(file_hash, "processing")
-    
     # 延迟导入
     from app.services.ocr_service import perform_ocr_service
     from app.services.common_service import generate_report_service
     
     try:
-        temp_dxf_path = save_temp_file(file_content, filename)
-        png_file_path = cad_to_png(str(temp_dxf_path), f"temp_{filename}.png")
-        if not png_file_path or not Path(png_file_path).exists():
-            result = {"status": "failed", "message": "DXF文件渲染图片失败"}
-            _update_cache(file_hash, "failed", result)
-            return result
-        
-        with open(png_file_path, "rb") as f:
-            png_content = f.read()
+        # DXF直接从内存解析并渲染为像素数组交给OCR，不落临时DXF/PNG文件
+        page_image = await _arender_cad_bytes(file_content, Path(filename).suffix or ".dxf", file_hash)
 
-        ocr_result = perform_ocr_service(png_content, "dxf")
+        ocr_result = await asyncio.to_thread(perform_ocr_service, page_image, "dxf")
         if ocr_result["status"] != "success":
-            _update_cache(file_hash, "failed", ocr_result)
+            _update_cache(cache_key, "failed", ocr_result)
             return ocr_result
 
         # 修复2：调用实例的ai_review_service方法
-        ai_result = ai_service_instance.ai_review_service([ocr_result["structured_data"]], filename)
+        ai_result = await ai_service_instance.aai_review_service([ocr_result["structured_data"]], filename)
         if ai_result["status"] != "success":
-            _update_cache(file_hash, "failed", ai_result)
+            _update_cache(cache_key, "failed", ai_result)
             return ai_result
 
         report = generate_report_service(ai_result, filename)
@@ -495,43 +1058,156 @@ def process_dxf_service(file_content: bytes, filename: str) -> dict:
             "message": "DXF文件处理完成"
         }
         
-        _update_cache(file_hash, "success", result)
+        _update_cache(cache_key, "success", result)
         return result
     
     except Exception as e:
-        logger.error(f"DXF文件处理异常：{str(e)}", exc_info=True)
+        logger.error("DXF文件处理异常：%s", e, exc_info=True)
         result = {"status": "failed", "error": str(e), "message": "DXF文件处理失败"}
-        _update_cache(file_hash, "failed", result)
+        _update_cache(cache_key, "failed", result)
         return result
 
-def process_pdf_service(file_content: bytes, filename: str) -> dict:
-    """处理PDF文件：提取所有页面图片+批量OCR+汇总AI审查+报告生成"""
+async def _run_closing_ai_client(coro):
+    """
+    同步入口里asyncio.run的顶层协程：流程结束（含异常）时关闭本循环的httpx客户端，
+    每次asyncio.run都是新循环，不关闭的话连接池要等GC才释放
+    """
+    try:
+        return await coro
+    finally:
+        await ai_service_instance.aclose_async_client()
+
+def process_dxf_service(file_content: bytes, filename: str) -> dict:
+    """同步入口（Celery任务/测试调用），内部跑异步流程"""
+    return asyncio.run(_run_closing_ai_client(aprocess_dxf_service(file_content, filename)))
+
+async def aprocess_dxf_batch(files: list) -> list:
+    """
+    并发处理多个DXF/DWG文件，ODA转换、渲染、OCR、AI审查在各文件间互相重叠
+    :param files: [(file_content, filename), ...]
+    :return: 与files顺序一致的处理结果
+    """
+    return list(await asyncio.gather(*(aprocess_dxf_service(content, name) for content, name in files)))
+
+# 逐页渲染时的目标宽度（与原pdf2image的size=(2000, None)一致）
+PDF_PAGE_RENDER_WIDTH = 2000
+
+def _render_pdf_page_fitz(doc, page_index: int) -> np.ndarray:
+    """用PyMuPDF在进程内渲染单页，返回RGB像素数组（不编码成PNG，OCR直接使用）"""
+    page = doc[page_index]
+    zoom = PDF_PAGE_RENDER_WIDTH / page.rect.width
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+def _render_pdf_page_image(pdf_path: str, page: int):
+    """渲染PDF单页为PIL图片（参数与整本转换时一致）"""
+    from pdf2image import convert_from_path
+    images = convert_from_path(
+        pdf_path,
+        dpi=300,
+        fmt="png",
+        size=(2000, None),
+        first_page=page,
+        last_page=page,
+        poppler_path=getattr(settings, "POPPLER_PATH", None)  # 支持配置poppler路径
+    )
+    if not images:
+        raise ValueError(f"PDF第{page}页渲染失败")
+    return images[0]
+
+async def _pipeline_pdf_ocr(file_content: bytes, on_page_done=None) -> list:
+    """
+    渲染与OCR流水线：逐页渲染放入队列，多个OCR协程边渲染边识别，
+    总耗时约为max(渲染, OCR)而不是两者相加；默认PyMuPDF渲染，未安装或配置关闭时用pdf2image
+    :param on_page_done: 可选回调(已完成页数, 总页数)，用于上报进度
+    :return: 按页序排列的perform_ocr_service结果列表
+    """
+    # 延迟导入
+    from app.services.ocr_service import perform_ocr_service, pdf_page_native_text
+
+    with ExitStack() as stack:
+        if fitz is not None and settings.PDF_RENDER_ENGINE == "pymupdf":
+            # PyMuPDF直接从内存打开；文档对象非线程安全，只在生产者里顺序渲染
+            # fitz的stream只认bytes/bytearray/BytesIO，任务传入的只读mmap要先转成bytes
+            doc = stack.enter_context(fitz.open(stream=bytes(file_content), filetype="pdf"))
+            page_count = doc.page_count
+            # 自带文本层的页面直接取文本（返回str，空白页为空串），只有扫描页才渲染
+            def render_page(page):
+                native_text = pdf_page_native_text(doc[page - 1])
+                return native_text if native_text is not None else _render_pdf_page_fitz(doc, page - 1)
+            render_workers = 1
+        else:
+            # pdf2image兜底：PDF只落盘一次，后续每页渲染直接读这个文件
+            from pdf2image import pdfinfo_from_path
+            tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            pdf_path = os.path.join(tmp_dir, "source.pdf")
+            await asyncio.to_thread(Path(pdf_path).write_bytes, file_content)
+            poppler_path = getattr(settings, "POPPLER_PATH", None)
+            page_count = (await asyncio.to_thread(pdfinfo_from_path, pdf_path, poppler_path=poppler_path))["Pages"]
+            render_page = lambda page: _render_pdf_page_image(pdf_path, page)
+            # 每页一个poppler子进程，不占GIL，可以多页同时渲染
+            render_workers = os.cpu_count() or 1
+        if not page_count:
+            return []
+
+        worker_count = min(settings.PDF_OCR_CONCURRENCY, page_count)
+        render_workers = min(render_workers, page_count)
+        queue = asyncio.Queue(maxsize=worker_count)
+        ocr_results = [None] * page_count
+        done_count = 0
+        pages = iter(range(1, page_count + 1))  # 多个渲染协程共用，按页序领取
+
+        async def producer():
+            for page in pages:
+                # 渲染结果（像素数组/PIL图片）直接交给OCR，不再PNG编码后又解码
+                page_image = await asyncio.to_thread(render_page, page)
+                await queue.put((page - 1, page_image))
+
+        async def feed():
+            await asyncio.gather(*(producer() for _ in range(render_workers)))
+            for _ in range(worker_count):
+                await queue.put(None)
+
+        async def ocr_worker():
+            nonlocal done_count
+            while (item := await queue.get()) is not None:
+                idx, page_image = item
+                if isinstance(page_image, str):
+                    ocr_results[idx] = {
+                        "status": "success",
+                        "structured_data": {"text": page_image, "file_type": "pdf", "page_count": 1}
+                    }
+                else:
+                    ocr_results[idx] = await asyncio.to_thread(perform_ocr_service, page_image, "pdf")
+                done_count += 1
+                if on_page_done:
+                    on_page_done(done_count, page_count)
+
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(ocr_worker()) for _ in range(worker_count)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # 任一环节出错，停止其余协程，避免OCR协程一直等队列
+            for task in tasks:
+                task.cancel()
+            raise
+    return ocr_results
+
+async def aprocess_pdf_service(file_content: bytes, filename: str, on_page_done=None) -> dict:
+    """处理PDF文件：逐页渲染与OCR流水线并行+汇总AI审查+报告生成"""
     # 延迟导入
-    from app.services.ocr_service import perform_ocr_service
     from app.services.common_service import generate_report_service
     
     try:
-        # 1. PDF转图片（优化：增加参数避免中文乱码）
-        images = convert_from_bytes(
-            file_content,
-            dpi=300,
-            fmt="png",
-            size=(2000, None),
-            poppler_path=getattr(settings, "POPPLER_PATH", None)  # 支持配置poppler路径
-        )
-        if not images:
+        # 1+2. PDF逐页渲染，同时并发OCR（结果按页序返回）
+        ocr_results = await _pipeline_pdf_ocr(file_content, on_page_done)
+        if not ocr_results:
             return {"status": "failed", "message": "PDF文件无有效页面可提取"}
-        
+
         all_ocr_structured = []
-        # 2. 多页PDF循环OCR
-        for idx, img in enumerate(images):
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG', dpi=(300, 300))
-            img_bytes = img_byte_arr.getvalue()
-            
-            ocr_res = perform_ocr_service(img_bytes, "pdf")
+        for idx, ocr_res in enumerate(ocr_results):
             if ocr_res["status"] != "success":
-                logger.warning(f"PDF第{idx+1}页OCR失败：{ocr_res.get('error', '未知错误')}")
+                logger.warning("PDF第%s页OCR失败：%s", idx+1, ocr_res.get('error', '未知错误'))
                 continue
             all_ocr_structured.append(ocr_res["structured_data"])
         
@@ -539,7 +1215,7 @@ def process_pdf_service(file_content: bytes, filename: str) -> dict:
             return {"status": "failed", "message": "PDF所有页面OCR识别失败"}
 
         # 修复3：调用实例的ai_review_service方法
-        ai_result = ai_service_instance.ai_review_service(all_ocr_structured, filename)
+        ai_result = await ai_service_instance.aai_review_service(all_ocr_structured, filename)
         if ai_result["status"] != "success":
             return ai_result
 
@@ -557,26 +1233,79 @@ def process_pdf_service(file_content: bytes, filename: str) -> dict:
             "message": f"PDF文件处理完成，共识别有效页面{len(all_ocr_structured)}页"
         }
     except ImportError as e:
-        logger.error(f"PDF处理依赖缺失：{str(e)}，需安装pdf2image和poppler", exc_info=True)
+        logger.error("PDF处理依赖缺失：%s，需安装pdf2image和poppler", e, exc_info=True)
         return {"status": "failed", "error": str(e), "message": "PDF处理依赖未安装，请安装pdf2image和poppler"}
     except Exception as e:
-        logger.error(f"PDF文件处理异常：{str(e)}", exc_info=True)
+        logger.error("PDF文件处理异常：%s", e, exc_info=True)
         return {"status": "failed", "error": str(e), "message": "PDF文件处理失败"}
 
+def process_pdf_service(file_content: bytes, filename: str, on_page_done=None) -> dict:
+    """同步入口（Celery任务/测试调用），内部跑异步并发流程"""
+    return asyncio.run(_run_closing_ai_client(aprocess_pdf_service(file_content, filename, on_page_done)))
+
+def process_batch_service(files: list) -> list:
+    """
+    多文件（图片/PDF）批量处理：逐个OCR后一次性批量AI审查（走DashScope批处理接口），再分别生成报告
+    :param files: [(file_content, filename), ...]
+    :return: 与files顺序一致的处理结果（格式同单文件的process_*_service）
+    """
+    # 延迟导入
+    from app.services.ocr_service import perform_ocr_service
+    from app.services.common_service import generate_report_service
+
+    results = [None] * len(files)
+    review_items, review_indexes = [], []
+    for idx, (file_content, filename) in enumerate(files):
+        try:
+            if Path(filename).suffix.lower() == ".pdf":
+                ocr_results = asyncio.run(_pipeline_pdf_ocr(file_content))
+                ocr_data = [res["structured_data"] for res in ocr_results if res["status"] == "success"]
+                if not ocr_data:
+                    results[idx] = {"status": "failed", "message": "PDF所有页面OCR识别失败"}
+                    continue
+            else:
+                ocr_result = perform_ocr_service(file_content, "image")
+                if ocr_result["status"] != "success":
+                    results[idx] = ocr_result
+                    continue
+                ocr_data = ocr_result["structured_data"]
+        except Exception as e:
+            logger.error("批量处理中文件%s识别失败：%s", filename, e, exc_info=True)
+            results[idx] = {"status": "failed", "error": str(e), "message": "文件处理失败"}
+            continue
+        review_items.append((ocr_data, filename))
+        review_indexes.append(idx)
+
+    for idx, ai_result in zip(review_indexes, ai_service_instance.batch_review(review_items)):
+        if ai_result["status"] != "success":
+            results[idx] = ai_result
+            continue
+        filename = files[idx][1]
+        results[idx] = {
+            "status": "success",
+            "result": {
+                "ai_review": ai_result,
+                "report": generate_report_service(ai_result, filename)
+            },
+            "message": "文件处理完成"
+        }
+    return results
+
 # ========== 通用临时文件保存函数（供全项目复用） ==========
-def universal_save_temp_file(file_content: bytes, filename: str, sub_dir: str = "cad") -> str:
-    """统一全项目的临时文件保存逻辑"""
-    file_hash = hashlib.md5(file_content).hexdigest()[:8] 
+def universal_save_temp_file(file_content: bytes, filename: str, sub_dir: str = "cad",
+                             file_hash: Optional[str] = None) -> str:
+    """统一全项目的临时文件保存逻辑（file_hash可由调用方传入，避免重复哈希）"""
+    file_hash = (file_hash or _get_file_hash(file_content))[:8]
     temp_dir = _get_project_root() / "temp" / sub_dir
     temp_dir.mkdir(parents=True, exist_ok=True)
     temp_path = temp_dir / f"{file_hash}_{filename}"
     
     if temp_path.exists():
-        logger.info(f"复用临时文件：{temp_path}")
+        logger.info("复用临时文件：%s", temp_path)
         return str(temp_path)
     
     with open(temp_path, "wb") as f:
         f.write(file_content)
-    logger.info(f"临时文件已保存：{temp_path}")
+    logger.info("临时文件已保存：%s", temp_path)
     return str(temp_path)
 
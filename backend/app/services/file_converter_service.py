@@ -3,9 +3,13 @@ import io
 from pathlib import Path
 from PIL import Image
 from app.services.cad_service import render_cad_to_image, CADRenderError
-from pdf2image import convert_from_bytes
 from app.core.config import settings
 
+try:
+    import fitz  # PyMuPDF：进程内渲染PDF，不启动poppler子进程
+except ImportError:
+    fitz = None
+
 logger = logging.getLogger(__name__)
 
 class FileConverterService:
@@ -28,10 +32,16 @@ class FileConverterService:
         
         # PDF文件
         elif file_suffix == "pdf":
+            if fitz is not None:
+                return self._render_pdf_first_page(file_content, dpi=300)
+            # 未安装PyMuPDF时回退pdf2image（延迟导入），也只渲染首页
+            from pdf2image import convert_from_bytes
             images = convert_from_bytes(
                 file_content,
                 dpi=300,
                 fmt="png",
+                first_page=1,
+                last_page=1,
                 poppler_path=getattr(settings, "POPPLER_PATH", None)
             )
             if not images:
@@ -40,12 +50,25 @@ class FileConverterService:
             images[0].save(img_byte_arr, format='PNG', dpi=(300, 300))
             return img_byte_arr.getvalue()
         
-        # 图片文件（JPG/PNG）
+        # 已经是PNG：原样返回，不再解码后重新压缩
+        elif file_suffix == "png":
+            return bytes(file_content)
+
+        # 其他图片（JPG）：转PNG只是给下游OCR用，低压缩级别编码更快
         else:
             img = Image.open(io.BytesIO(file_content))
             img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
+            img.save(img_byte_arr, format='PNG', compress_level=1)
             return img_byte_arr.getvalue()
 
+    @staticmethod
+    def _render_pdf_first_page(file_content: bytes, dpi: int) -> bytes:
+        """PyMuPDF进程内渲染PDF首页，直接输出PNG字节（不经过PIL）"""
+        with fitz.open(stream=file_content, filetype="pdf") as doc:
+            if doc.page_count == 0:
+                raise Exception("PDF无有效页面")
+            pix = doc[0].get_pixmap(dpi=dpi, alpha=False)
+            return pix.tobytes("png")
+
 # 创建实例，供路由/服务调用
 file_converter_service = FileConverterService()
\ No newline at end of file
@@ -1,31 +1,86 @@
 import os
+import mmap
+import time
+import asyncio
+import threading
+import atexit
+import orjson
 import requests
-import base64
-import tempfile
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+try:
+    import pybase64 as base64  # SIMD加速的base64编码，未安装时用标准库
+except ImportError:
+    import base64
 import traceback
 import hashlib
 import cv2
 import numpy as np
-from io import BytesIO
-from PIL import Image, ImageOps, ImageFilter
 import fitz  # PyMuPDF
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
 
 # 项目配置和依赖导入
 from app.core.config import settings
-from app.tasks.ocr_tasks import perform_ocr
+from app.database.redis import cache_get, cache_set
+from app.utils.image_utils import autocontrast_gray, to_gray_array
 
 # ========== 日志配置 ==========
 logger = logging.getLogger(__name__)
 
+# ========== 共享HTTP会话 ==========
+# 连接池复用到百度接口的TLS连接，多页并发OCR时不再每次请求都重新握手；
+# 限流和网关错误在连接层自动退避重试
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=max(settings.PDF_OCR_CONCURRENCY, 10),
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,  # POST也重试（默认只重试幂等方法）
+        raise_on_status=False  # 重试用尽后返回最后的响应，仍由raise_for_status报HTTP错误
+    )
+))
+atexit.register(_SESSION.close)
+
 # ========== 百度OCR授权函数 ==========
+# access_token有效期约30天，进程内缓存，提前5分钟刷新
+_TOKEN_CACHE = {"token": None, "expires_at": 0.0}
+_TOKEN_LOCK = threading.Lock()
+TOKEN_REFRESH_MARGIN = 300
+# 百度接口返回的token无效/过期错误码
+TOKEN_ERROR_CODES = (110, 111)
+# QPS超限错误码
+QPS_LIMIT_ERROR_CODE = 18
+
+def invalidate_baidu_access_token() -> None:
+    """作废缓存的access_token（OCR接口返回110/111时调用）"""
+    with _TOKEN_LOCK:
+        _TOKEN_CACHE["token"] = None
+        _TOKEN_CACHE["expires_at"] = 0.0
+
 def get_baidu_access_token():
-    """获取百度 API 的 access_token"""
+    """获取百度 API 的 access_token（未过期时直接返回缓存值，不再每次请求授权接口）"""
+    with _TOKEN_LOCK:
+        if _TOKEN_CACHE["token"] and time.time() < _TOKEN_CACHE["expires_at"]:
+            return _TOKEN_CACHE["token"]
+        # 持锁刷新，并发请求只会有一个去换token
+        access_token, expires_in = _fetch_baidu_access_token()
+        if access_token:
+            _TOKEN_CACHE["token"] = access_token
+            _TOKEN_CACHE["expires_at"] = time.time() + expires_in - TOKEN_REFRESH_MARGIN
+        return access_token
+
+def _fetch_baidu_access_token():
+    """请求百度授权接口，返回(access_token, 有效期秒数)，失败时token为None"""
     OCR_API_KEY = settings.OCR_API_KEY
     OCR_SECRET_KEY = settings.OCR_SECRET_KEY
     if not OCR_API_KEY or not OCR_SECRET_KEY:
         logger.error("百度OCR的API_KEY或SECRET_KEY未配置")
-        return None
+        return None, 0.0
     token_url = "https://aip.baidubce.com/oauth/2.0/token"
     token_params = {
         "grant_type": "client_credentials",
@@ -33,92 +88,117 @@ def get_baidu_access_token():
         "client_secret": OCR_SECRET_KEY
     }
     try:
-        token_response = requests.post(token_url, params=token_params, timeout=10)
+        token_response = _SESSION.post(token_url, params=token_params, timeout=10)
         token_response.raise_for_status()
-        token_data = token_response.json()
+        token_data = orjson.loads(token_response.content)
         access_token = token_data.get("access_token")
-        logger.info(f"百度OCR Access Token: {access_token}")
-        return access_token
+        expires_in = float(token_data.get("expires_in", 0))
+        logger.info("百度OCR Access Token已刷新，有效期%.0f秒", expires_in)
+        return access_token, expires_in
     except Exception as e:
-        logger.error(f"获取百度access_token失败：{str(e)}", exc_info=True)
-        return None
+        logger.error("获取百度access_token失败：%s", e, exc_info=True)
+        return None, 0.0
 
 # ========== 图片预处理函数 ==========
-def _preprocess_image(img: Image.Image) -> Image.Image:
-    """优化版图片预处理（增加尺寸限制）"""
+# 判断“干净图片”的阈值：中间灰度像素占比上限、拉普拉斯方差下限（低于视为模糊）
+CLEAN_MID_GRAY_RANGE = (48, 208)
+CLEAN_MID_GRAY_RATIO = 0.05
+CLEAN_BLUR_THRESHOLD = 100.0
+
+def _needs_preprocessing(gray: np.ndarray) -> bool:
+    """
+    判断图片是否需要完整的增强预处理：
+    几乎只有黑白两种灰度（高对比度）且边缘锐利的图片直接识别即可，增强反而浪费CPU
+    """
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    low, high = CLEAN_MID_GRAY_RANGE
+    if hist[low:high].sum() / gray.size > CLEAN_MID_GRAY_RATIO:
+        return True
+    return cv2.Laplacian(gray, cv2.CV_16S).var() < CLEAN_BLUR_THRESHOLD
+
+def _preprocess_array(gray: np.ndarray) -> np.ndarray:
+    """
+    优化版图片预处理（增加尺寸限制），全程在同一条uint8灰度数组上用OpenCV完成，
+    不在PIL和numpy之间来回拷贝；已经清晰的黑白图只限制尺寸并全局二值化
+    """
     try:
-        # 1. 灰度化
-        img = img.convert("L")
-        
-        # 2. 放大图片
-        width, height = img.size
-        img = img.resize((width*2, height*2), Image.Resampling.LANCZOS)
-        
-        # 新增：限制图片最大尺寸（百度OCR限制≤4096×4096）
+        needs_enhance = not settings.OCR_ADAPTIVE_PREPROCESS or _needs_preprocessing(gray)
+
+        # 1. 放大2倍（干净图片不放大），同时限制最大尺寸（百度OCR限制≤4096×4096）：先算好最终尺寸，只重采样一次
         max_size = 4096
-        if img.width > max_size or img.height > max_size:
-            # 按比例缩放至最大尺寸内
-            scale = min(max_size / img.width, max_size / img.height)
-            new_width = int(img.width * scale)
-            new_height = int(img.height * scale)
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            logger.debug(f"图片尺寸超限，缩放到：{new_width}x{new_height}")
-        
-        # 3. 增强对比度
-        img = ImageOps.autocontrast(img, cutoff=2)
-        
-        # 4. 去噪
-        img = img.filter(ImageFilter.MedianFilter(size=3))
-        
-        # 5. 自适应二值化
-        img_np = np.array(img)
-        img_np = cv2.adaptiveThreshold(
-            img_np, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
+        height, width = gray.shape[:2]
+        scale = min(2.0 if needs_enhance else 1.0, max_size / width, max_size / height)
+        new_width, new_height = int(width * scale), int(height * scale)
+        if (new_width, new_height) != (width, height):
+            interpolation = cv2.INTER_LANCZOS4 if scale > 1 else cv2.INTER_AREA
+            img = cv2.resize(gray, (new_width, new_height), interpolation=interpolation)
+        else:
+            # 后面的对比度查表是原地修改，不能改到调用方的数组
+            img = gray.copy()
+        if scale < 1.0:
+            logger.debug("图片尺寸超限，缩放到：%sx%s", new_width, new_height)
+
+        if not needs_enhance:
+            # 输出仍需是二值图（后面按1位深度编码PNG），Otsu全局阈值一遍即可
+            _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            logger.debug("图片已足够清晰，跳过增强预处理，尺寸：%sx%s", img.shape[1], img.shape[0])
+            return img
+
+        # 2. 增强对比度
+        img = autocontrast_gray(img, cutoff=2)
+
+        # 3. 去噪
+        img = cv2.medianBlur(img, 3)
+
+        # 4. 自适应二值化
+        img = cv2.adaptiveThreshold(
+            img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
         )
-        img = Image.fromarray(img_np).convert("L")
-        
-        logger.debug("图片预处理成功，尺寸：%sx%s", img.size[0], img.size[1])
+
+        logger.debug("图片预处理成功，尺寸：%sx%s", img.shape[1], img.shape[0])
         return img
     except Exception as e:
-        logger.error(f"图片预处理失败：{str(e)}", exc_info=True)
-        return img
+        logger.error("图片预处理失败：%s", e, exc_info=True)
+        return gray
 
 # ========== 百度OCR核心函数（兼容路径/字节两种调用） ==========
-def baidu_ocr(image_path=None, image_bytes=None):
+def baidu_ocr(image_path=None, image_bytes=None, image=None):
     """
     调用百度高精度OCR
-    :param image_path: 图片路径（二选一）
-    :param image_bytes: 图片字节（二选一）
+    :param image_path: 图片路径（三选一）
+    :param image_bytes: 图片字节（三选一）
+    :param image: 已解码的PIL图片或RGB像素数组（三选一，省去编码再解码）
     """
     # 1. 获取access_token
     access_token = get_baidu_access_token()
     if not access_token:
         return "获取百度 OCR 授权失败，请检查 API Key 和网络连接。"
     
-    # 2. 处理图片（路径/字节二选一）
+    # 2. 处理图片：直接解码成灰度数组，预处理后只编码一次PNG
     try:
         if image_path:
-            with Image.open(image_path) as img:
-                processed_img = _preprocess_image(img)
-                img_byte_arr = BytesIO()
-                processed_img.save(img_byte_arr, format='PNG', dpi=(300, 300))
-                img_bytes = img_byte_arr.getvalue()
+            # np.fromfile+imdecode兼容Windows下的中文路径
+            gray = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
         elif image_bytes:
-            img = Image.open(BytesIO(image_bytes))
-            processed_img = _preprocess_image(img)
-            img_byte_arr = BytesIO()
-            processed_img.save(img_byte_arr, format='PNG', dpi=(300, 300))
-            img_bytes = img_byte_arr.getvalue()
+            gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        elif image is not None:
+            gray = to_gray_array(image)
         else:
             return "未提供图片路径或字节数据"
+        if gray is None:
+            raise ValueError("无法解码图片数据")
+        # 预处理结果是二值图，按1位深度编码PNG：编码更快，base64后的请求体也小得多
+        ok, img_bytes = cv2.imencode(".png", _preprocess_array(gray), [cv2.IMWRITE_PNG_BILEVEL, 1])
+        if not ok:
+            raise ValueError("预处理后的图片PNG编码失败")
     except Exception as e:
         error_msg = f"图片加载/预处理失败: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return error_msg
     
     # 3. 调用百度OCR接口
-    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-    ocr_url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/accurate?access_token={access_token}"
+    # 百度接口只接受表单里的base64字段；bytes直接交给requests做urlencode，不再额外解码成str
+    img_base64 = base64.b64encode(img_bytes)
     headers = {'content-type': 'application/x-www-form-urlencoded'}
     data = {
         "image": img_base64,
@@ -127,57 +207,106 @@ def baidu_ocr(image_path=None, image_bytes=None):
         "language_type": "CHN_ENG"
     }
     
+    # 4. 解析结果（缓存的token失效时刷新后重试一次）
     try:
-        ocr_response = requests.post(ocr_url, data=data, headers=headers, timeout=30)
-        ocr_response.raise_for_status()
+        result = _post_baidu_ocr(access_token, data, headers)
+        if result.get("error_code") in TOKEN_ERROR_CODES:
+            logger.warning("百度OCR access_token失效（错误码：%s），刷新后重试", result['error_code'])
+            invalidate_baidu_access_token()
+            access_token = get_baidu_access_token()
+            if not access_token:
+                return "获取百度 OCR 授权失败，请检查 API Key 和网络连接。"
+            result = _post_baidu_ocr(access_token, data, headers)
+        # 并发识别多页时可能触发QPS限流，指数退避后重试
+        for attempt in range(settings.OCR_QPS_RETRIES):
+            if result.get("error_code") != QPS_LIMIT_ERROR_CODE:
+                break
+            time.sleep(0.5 * 2 ** attempt)
+            result = _post_baidu_ocr(access_token, data, headers)
     except Exception as e:
         error_msg = f"OCR 识别请求失败: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return error_msg
-    
-    # 4. 解析结果
+
     try:
-        result = ocr_response.json()
         if "error_code" in result:
             error_msg = f"百度OCR接口错误: {result['error_msg']}（错误码：{result['error_code']}）"
             logger.error(error_msg)
             return error_msg
         if "words_result" in result and result["words_result"]:
-            ocr_text = "\n".join([item.get("words", "").strip() for item in result["words_result"]])
-            logger.info(f"OCR识别成功，提取文本长度：{len(ocr_text)}")
+            ocr_text = "\n".join(item.get("words", "").strip() for item in result["words_result"])
+            logger.info("OCR识别成功，提取文本长度：%s", len(ocr_text))
             return ocr_text
         else:
-            logger.warning(f"OCR 结果为空: {str(result)}")
+            logger.warning("OCR 结果为空: %s", result)
             return ""
     except Exception as e:
         error_msg = f"OCR 结果解析失败: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return error_msg
 
+def _post_baidu_ocr(access_token: str, data: dict, headers: dict) -> dict:
+    """请求百度高精度OCR接口，返回解析后的JSON（orjson直接解析响应字节，密集图纸的words_result很长）"""
+    ocr_url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/accurate?access_token={access_token}"
+    ocr_response = _SESSION.post(ocr_url, data=data, headers=headers, timeout=30)
+    ocr_response.raise_for_status()
+    return orjson.loads(ocr_response.content)
+
 # ========== OCR服务封装函数 ==========
-def perform_ocr_service(img_bytes: bytes, file_type: str) -> dict:
-    """OCR识别服务（纯字节流，无临时文件）"""
+# 进程内OCR结果缓存，挡在Redis前面：重复图片（图框/标准页/重复上传）连Redis往返和反序列化都省掉
+_ocr_local_cache: LRUCache = LRUCache(maxsize=256)
+_ocr_local_cache_lock = threading.Lock()
+
+def _is_bytes_like(img) -> bool:
+    """编码后的图片字节：bytes类对象，或Celery任务传入的上传文件只读mmap（numpy数组虽支持缓冲区协议，但属于已解码像素）"""
+    return isinstance(img, (bytes, bytearray, memoryview, mmap.mmap))
+
+def ocr_cache_key(img, file_type: str) -> str:
+    """OCR结果缓存键：按图片内容做blake2b哈希（比sha256快，128位足够区分内容），带上OCR_VERSION使流程升级后旧结果失效"""
+    if _is_bytes_like(img):
+        return f"ocr:{settings.OCR_VERSION}:{file_type}:{hashlib.blake2b(img, digest_size=16).hexdigest()}"
+    pixels = np.ascontiguousarray(img)
+    return f"ocr:{settings.OCR_VERSION}:{file_type}:raw:{pixels.shape}:{hashlib.blake2b(pixels.data, digest_size=16).hexdigest()}"
+
+def perform_ocr_service(img_bytes, file_type: str, cache_key: str = None) -> dict:
+    """
+    OCR识别服务（无临时文件），同内容重复上传直接命中进程内/Redis缓存
+    :param img_bytes: 图片字节，或已解码的PIL图片/RGB像素数组（PDF逐页渲染结果直接传入，不必先编码）
+    :param cache_key: 可选，调用方已算好的ocr_cache_key，避免重复哈希
+    """
+    cache_key = cache_key or ocr_cache_key(img_bytes, file_type)
+    ocr_kwargs = {"image_bytes": img_bytes} if _is_bytes_like(img_bytes) else {"image": img_bytes}
+    with _ocr_local_cache_lock:
+        cached = _ocr_local_cache.get(cache_key)
+    if cached is None:
+        cached = cache_get(cache_key)
+        if cached is not None:
+            with _ocr_local_cache_lock:
+                _ocr_local_cache[cache_key] = cached
+    if cached is not None:
+        logger.info("OCR结果命中缓存：%s", cache_key)
+        return cached
     try:
-        # 直接调用baidu_ocr（传字节）
-        ocr_result = baidu_ocr(image_bytes=img_bytes)
+        # 直接调用baidu_ocr（传字节或图片对象）
+        ocr_result = baidu_ocr(**ocr_kwargs)
         
         # 校验结果
         if not ocr_result:
-            logger.warning(f"OCR识别结果为空（文件类型：{file_type}）")
+            logger.warning("OCR识别结果为空（文件类型：%s）", file_type)
             return {
                 "status": "success",
                 "structured_data": {"text": "", "file_type": file_type, "page_count": 1}
             }
         if "失败" in ocr_result or "错误" in ocr_result:
-            logger.error(f"OCR识别失败，结果：{ocr_result}")
+            logger.error("OCR识别失败，结果：%s", ocr_result)
             return {
                 "status": "failed",
                 "error": ocr_result,
                 "message": f"OCR识别失败：{ocr_result}"
             }
         
-        # 返回结果
-        return {
+        # 只缓存成功结果，失败的下次仍重新识别
+        result = {
             "status": "success",
             "structured_data": {
                 "text": ocr_result,
@@ -185,6 +314,10 @@ def perform_ocr_service(img_bytes: bytes, file_type: str) -> dict:
                 "page_count": 1
             }
         }
+        cache_set(cache_key, result)
+        with _ocr_local_cache_lock:
+            _ocr_local_cache[cache_key] = result
+        return result
     
     except Exception as e:
         error_msg = f"perform_ocr_service异常：{str(e)}"
@@ -195,110 +328,157 @@ def perform_ocr_service(img_bytes: bytes, file_type: str) -> dict:
             "message": error_msg
         }
 
+# ========== OCR请求合并（API进程内的微批处理） ==========
+class OCRMicroBatcher:
+    """
+    把短窗口内到达的图片OCR请求合并成一批：同内容的图片只识别一次，
+    其余在线程池中并发执行，识别期间不阻塞事件循环
+    """
+
+    def __init__(self, window_ms: int = settings.OCR_BATCH_WINDOW_MS, max_batch: int = settings.OCR_BATCH_SIZE):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = None
+        self._consumer = None
+        self._running = set()  # 持有后台批次任务的引用，防止被GC回收
+
+    async def submit(self, img_bytes: bytes, file_type: str) -> dict:
+        """提交一张图片，返回与perform_ocr_service相同格式的结果"""
+        # 队列和消费者绑定到当前事件循环，首次调用时再创建
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._consumer = asyncio.create_task(self._consume())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((img_bytes, file_type, future))
+        return await future
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 批次在后台执行，消费者立即开始攒下一批
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: list):
+        # 按缓存键（内容哈希+文件类型）去重，同一批里重复上传的图片共用一次识别；键直接传下去，不再重复哈希
+        groups = {}
+        for img_bytes, file_type, future in batch:
+            key = ocr_cache_key(img_bytes, file_type)
+            groups.setdefault(key, (img_bytes, file_type, []))[2].append(future)
+
+        results = await asyncio.gather(
+            *(asyncio.to_thread(perform_ocr_service, img_bytes, file_type, key)
+              for key, (img_bytes, file_type, _) in groups.items()),
+            return_exceptions=True
+        )
+        logger.info("OCR批次完成：请求%s个，实际识别%s个", len(batch), len(groups))
+        for (_, _, futures), result in zip(groups.values(), results):
+            for future in futures:
+                if future.done():  # 客户端已断开
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+ocr_batcher = OCRMicroBatcher()
+
 # ========== 文件文本提取函数（最终版） ==========
+def _render_pdf_page_array(page, dpi: int = None) -> np.ndarray:
+    """
+    PDF单页直接渲染为灰度像素数组（直接引用pixmap的采样缓冲区，不再构造PIL图片）：
+    MuPDF灰度光栅化只写1个通道，OCR线程也省掉一次RGB转灰度；默认按PDF_OCR_DPI渲染
+    """
+    pix = page.get_pixmap(dpi=dpi or settings.PDF_OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+def pdf_page_native_text(page):
+    """
+    读取PDF页面自带的文本层（电子版PDF）：字符数够多时返回文本，可以跳过渲染和OCR；
+    完全没有绘制内容的空白页返回空字符串（不值得一次OCR请求）；
+    扫描件或文字太少时返回None。
+    文字少但有内容的页面仍然OCR：CAD导出的PDF里文字常是矢量笔画，文本层取不到
+    """
+    min_chars = settings.PDF_NATIVE_TEXT_MIN_CHARS
+    if min_chars <= 0:
+        return None
+    text = page.get_text().strip()
+    if len(text) >= min_chars:
+        return text
+    if not text and not page.read_contents().strip():
+        return ""
+    return None
+
+def _ocr_pdf_pages(doc) -> list:
+    """
+    PDF逐页渲染与OCR流水线：渲染在当前线程按页进行（PyMuPDF文档对象非线程安全），
+    各页OCR在线程池并发；在途页数不超过并发数，渲染好的页面不会全部堆在内存里
+    :return: 按页序排列的识别文本
+    """
+    workers = max(1, min(settings.PDF_OCR_CONCURRENCY, doc.page_count))
+    in_flight = threading.BoundedSemaphore(workers)
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page in doc:
+            native_text = pdf_page_native_text(page)
+            if native_text is not None:
+                futures.append(native_text)
+                continue
+            # 达到上限时等前面某页识别完再渲染下一页，渲染和在途OCR请求互相重叠
+            in_flight.acquire()
+            future = executor.submit(baidu_ocr, image=_render_pdf_page_array(page))
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+    return [future if isinstance(future, str) else future.result() for future in futures]
+
 def extract_text_from_file(uploaded_file):
-    """统一处理不同格式的上传文件，提取文本内容"""
-    file_ext = uploaded_file.name.split('.')[-1].lower()
-    # 初始化临时目录
-    os.makedirs(settings.OCR_TEMP_DIR, exist_ok=True)
-    logger.info(f"OCR临时目录：{settings.OCR_TEMP_DIR}")
-    logger.info(f"临时目录是否存在：{os.path.exists(settings.OCR_TEMP_DIR)}")
+    """统一处理不同格式的上传文件，提取文本内容（全程在内存中处理，不落临时文件）"""
+    file_ext = os.path.splitext(uploaded_file.name)[1][1:].lower()
     
     supported_image_exts = {"png", "jpg", "jpeg", "webp", "bmp", "tiff"}
     supported_cad_exts = {"dwg", "dxf"}
     extracted_text = ""
-    tmp_path = None
-    temp_files_to_clean = []
 
     try:
-        # 1. 保存上传文件到临时路径
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as tmp:
-            tmp.write(uploaded_file.getbuffer())
-            tmp_path = tmp.name
-            temp_files_to_clean.append(tmp_path)
+        file_content = uploaded_file.getbuffer()
 
-        # 2. 处理PDF文件（核心修复：直接传字节，跳过本地临时文件）
+        # 1. 处理PDF文件：PyMuPDF逐页渲染为像素数组直接交给OCR，不经过PIL/PNG编码和临时文件
         if file_ext == "pdf":
-            from pdf2image import convert_from_bytes
-            # 读取PDF字节
-            with open(tmp_path, "rb") as f:
-                pdf_bytes = f.read()
-            logger.info(f"Poppler路径：{settings.POPPLER_PATH}")
-            logger.info(f"PDF文件大小：{len(pdf_bytes)} 字节")
-            
-            # PDF转图片
-            images = convert_from_bytes(
-                pdf_bytes,
-                dpi=300,
-                poppler_path=settings.POPPLER_PATH
+            with fitz.open(stream=bytes(file_content), filetype="pdf") as doc:
+                logger.info("PDF共%s页", doc.page_count)
+                page_texts = _ocr_pdf_pages(doc)
+            extracted_text = "".join(
+                f"=== 第 {page_num + 1} 页 ===\n{page_text}\n\n" for page_num, page_text in enumerate(page_texts)
             )
-            logger.info(f"PDF转图片成功，共{len(images)}页")
-            
-            # 逐页OCR（直接传图片字节）
-            for page_num, img in enumerate(images):
-                # 图片转字节
-                img_byte_arr = BytesIO()
-                img.save(img_byte_arr, format='PNG', dpi=(300, 300))
-                img_bytes = img_byte_arr.getvalue()
-                # 调用OCR（传字节，不保存本地）
-                page_text = baidu_ocr(image_bytes=img_bytes)
-                # 拼接结果
-                extracted_text += f"=== 第 {page_num + 1} 页 ===\n{page_text}\n\n"
-
-        # 3. 处理普通图片文件
+
+        # 2. 处理普通图片文件：字节直接交给OCR，预处理只在baidu_ocr里做一次
         elif file_ext in supported_image_exts:
-            img = Image.open(tmp_path)
-            proc = _preprocess_image(img)
-            # 保存预处理后的图片
-            img_tmp_path = os.path.join(
-                settings.OCR_TEMP_DIR, 
-                f"img_{hashlib.md5(proc.tobytes()).hexdigest()[:8]}.png"
-            )
-            proc.save(img_tmp_path, format="PNG")
-            temp_files_to_clean.append(img_tmp_path)
-            # 调用OCR
-            extracted_text = baidu_ocr(image_path=img_tmp_path)
+            extracted_text = baidu_ocr(image_bytes=file_content)
 
-        # 4. 处理CAD文件
+        # 3. 处理CAD文件：渲染出的PNG字节直接交给OCR
         elif file_ext in supported_cad_exts:
             from app.services.cad_service import render_cad_to_image
-            # 读取CAD文件
-            with open(tmp_path, "rb") as f:
-                file_content = f.read()
-            # CAD转图片字节
             img_bytes = render_cad_to_image(file_content, file_ext)
-            # 重置字节流指针
-            img_stream = BytesIO(img_bytes)
-            img_stream.seek(0)
-            img = Image.open(img_stream)
-            # 预处理
-            proc = _preprocess_image(img)
-            img_tmp_path = os.path.join(
-                settings.OCR_TEMP_DIR, 
-                f"cad_{hashlib.md5(proc.tobytes()).hexdigest()[:8]}.png"
-            )
-            proc.save(img_tmp_path, format="PNG")
-            temp_files_to_clean.append(img_tmp_path)
-            # 调用OCR
-            extracted_text = baidu_ocr(image_path=img_tmp_path)
+            extracted_text = baidu_ocr(image_bytes=img_bytes)
 
-        # 5. 不支持的格式
+        # 4. 不支持的格式
         else:
             raise ValueError(f"不支持的文件格式：{file_ext}")
 
     except Exception as e:
         tb = traceback.format_exc()
         extracted_text = f"[提取失败] 错误：{e}\n详细信息：\n{tb}"
-        logger.error(f"文件文本提取失败（格式：{file_ext}）：{str(e)}", exc_info=True)
-
-    finally:
-        # 统一清理临时文件
-        for file_path in temp_files_to_clean:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    logger.debug(f"清理临时文件：{file_path}")
-                except Exception as e:
-                    logger.warning(f"清理临时文件失败：{file_path}，错误：{str(e)}")
+        logger.error("文件文本提取失败（格式：%s）：%s", file_ext, e, exc_info=True)
 
     return extracted_text
\ No newline at end of file
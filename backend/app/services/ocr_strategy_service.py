@@ -1,6 +1,20 @@
+import os
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Tesseract内部的OpenMP多线程对单页收益很小，改为每页单线程、多页并发（须在加载libtesseract之前设置）
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import pytesseract
 from PIL import Image
+try:
+    # tesserocr直接链接libtesseract，模型只加载一次；未安装时回退pytesseract（每次调用起一个子进程）
+    from tesserocr import PyTessBaseAPI
+except ImportError:
+    PyTessBaseAPI = None
 from aip import AipOcr
 from app.core.config import settings
 import io
@@ -8,6 +22,36 @@ from fastapi import UploadFile
 
 logger = logging.getLogger(__name__)
 
+# 百度OCR可直接识别的图片格式（PIL的format名）
+BAIDU_NATIVE_FORMATS = {"PNG", "JPEG", "BMP"}
+# 同时运行的Tesseract（子进程或tesserocr句柄）数不超过CPU核数，线程池里排队的请求不会把CPU挤爆
+_TESSERACT_SLOTS = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+# 按psm常驻的空闲tesserocr句柄（懒加载：Celery prefork子进程里各自创建，不跨fork共享）
+_idle_tess_apis = {}
+_tess_apis_lock = threading.Lock()
+
+@contextmanager
+def _borrow_tess_api(psm: int):
+    """
+    借出一个常驻的Tesseract句柄，用完归还；chi_sim模型只在句柄创建时加载一次
+    Tesseract实例本身不是线程安全的，每个句柄同一时刻只给一个线程用；
+    调用方持有_TESSERACT_SLOTS，句柄总数因此不超过CPU核数
+    """
+    with _tess_apis_lock:
+        idle = _idle_tess_apis.setdefault(psm, [])
+        api = idle.pop() if idle else None
+    if api is None:
+        # psm/oem直接传整数：tesserocr的PSM/OEM只是整数常量的命名空间，不能当枚举调用
+        api = PyTessBaseAPI(lang='chi_sim', psm=psm, oem=settings.TESSERACT_OEM)
+        if settings.TESSERACT_PRESERVE_SPACES:
+            api.SetVariable("preserve_interword_spaces", "1")
+    try:
+        yield api
+    finally:
+        with _tess_apis_lock:
+            idle.append(api)
+
 class OCRStrategyService:
     def __init__(self):
         # 初始化百度OCR客户端（读config配置）
@@ -25,6 +69,17 @@ class OCRStrategyService:
             for k in self.tesseract_config:
                 self.tesseract_config[k] += ' -c preserve_interword_spaces=1'
 
+    def warmup(self) -> None:
+        """
+        预先创建PDF/图片两种psm的常驻Tesseract句柄（chi_sim模型加载一次约需数百毫秒），
+        供Worker子进程启动时调用；未安装tesserocr时走子进程，无需预热
+        """
+        if PyTessBaseAPI is None:
+            return
+        for psm in {settings.TESSERACT_PDF_PSM, settings.TESSERACT_IMAGE_PSM}:
+            with _borrow_tess_api(psm):
+                pass
+
     async def process_file(self, file: UploadFile) -> dict:
         """
         异步处理上传文件（适配FastAPI的UploadFile）
@@ -32,19 +87,38 @@ class OCRStrategyService:
         :return: 标准化的OCR结果字典（适配OCRResult模型）
         """
         try:
-            # 1. 读取上传文件并转换为PIL Image
             file_content = await file.read()
-            image = Image.open(io.BytesIO(file_content))
+        except Exception as e:
+            logger.error(f"读取上传文件失败：{str(e)}", exc_info=True)
+            return {
+                "status": "failure",
+                "error_message": str(e),
+                "metadata": {"file_name": file.filename}
+            }
+        # 百度SDK和Tesseract都是阻塞调用，放到线程池执行，不占用事件循环（并发上传互不阻塞）
+        return await asyncio.to_thread(self.process_bytes, file_content, file.filename, file.content_type)
+
+    def process_bytes(self, content: bytes, filename: str, content_type: str = None) -> dict:
+        """
+        直接处理文件二进制（不用再包装成UploadFile，Celery任务也可复用）
+        :param content: 文件二进制内容
+        :param filename: 文件名（用于判断文件类型）
+        :param content_type: MIME类型，可为空
+        :return: 标准化的OCR结果字典（适配OCRResult模型）
+        """
+        try:
+            # 1. 转换为PIL Image
+            image = Image.open(io.BytesIO(content))
             
             # 2. 判断文件类型（PDF/图片）
-            file_suffix = file.filename.split(".")[-1].lower() if "." in file.filename else ""
-            if file_suffix == "pdf" or file.content_type == "application/pdf":
+            file_suffix = os.path.splitext(filename)[1][1:].lower()
+            if file_suffix == "pdf" or content_type == "application/pdf":
                 file_type = "pdf"
             else:
                 file_type = "image"
             
             # 3. 调用OCR识别（默认混合策略）
-            ocr_result = self.recognize(image, file_type=file_type, strategy="hybrid")
+            ocr_result = self.recognize(image, file_type=file_type, strategy="hybrid", original_bytes=content)
             
             # 4. 封装为标准化返回格式（适配OCRResult模型）
             if ocr_result["status"] == "success":
@@ -54,8 +128,8 @@ class OCRStrategyService:
                     "confidence": ocr_result["confidence"],
                     "metadata": {
                         "engine": ocr_result["engine"],
-                        "file_name": file.filename,
-                        "content_type": file.content_type
+                        "file_name": filename,
+                        "content_type": content_type
                     }
                 }
             else:
@@ -64,7 +138,7 @@ class OCRStrategyService:
                     "error_message": ocr_result["error"],
                     "metadata": {
                         "engine": ocr_result["engine"],
-                        "file_name": file.filename
+                        "file_name": filename
                     }
                 }
         except Exception as e:
@@ -72,25 +146,37 @@ class OCRStrategyService:
             return {
                 "status": "failure",
                 "error_message": str(e),
-                "metadata": {"file_name": file.filename}
+                "metadata": {"file_name": filename}
             }
 
-    def recognize(self, image: Image.Image, file_type: str = "image", strategy: str = "hybrid") -> dict:
+    def recognize(self, image: Image.Image, file_type: str = "image", strategy: str = "hybrid",
+                  original_bytes: bytes = None) -> dict:
         # 3种策略可选：hybrid(优先百度，失败降级TESS)、baidu(只用百度)、tesseract(只用TESS)
+        # original_bytes：image解码前的原始文件字节，百度OCR可直接复用，省去重新编码
         if strategy == "baidu":
-            return self._baidu_ocr(image)
+            return self._baidu_ocr(image, original_bytes)
         elif strategy == "tesseract":
             return self._tesseract_ocr(image, file_type)
         elif strategy == "hybrid":
-            baidu_res = self._baidu_ocr(image)
+            baidu_res = self._baidu_ocr(image, original_bytes)
             return baidu_res if baidu_res["status"] == "success" else self._tesseract_ocr(image, file_type)
         else:
             raise ValueError(f"不支持的OCR策略：{strategy}")
 
-    def _baidu_ocr(self, image: Image.Image) -> dict:
+    def recognize_batch(self, images: list, file_type: str = "image", strategy: str = "hybrid") -> list:
+        """
+        一次提交同一文档的多页图片，按输入顺序返回每页的识别结果字典（格式同recognize）
+        各页在线程池里并发识别：百度请求是网络IO，Tesseract每页单线程，多页可同时占满多个核
+        """
+        if len(images) <= 1:
+            return [self.recognize(img, file_type=file_type, strategy=strategy) for img in images]
+        max_workers = min(settings.OCR_PAGE_CONCURRENCY, len(images))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda img: self.recognize(img, file_type=file_type, strategy=strategy), images))
+
+    def _baidu_ocr(self, image: Image.Image, original_bytes: bytes = None) -> dict:
         # 百度OCR需转二进制，内部封装，外部不用管
         try:
-            img_byte = io.BytesIO()
             # 定义百度OCR支持的最大尺寸
             MAX_WIDTH = 4096
             MAX_HEIGHT = 4096
@@ -98,6 +184,7 @@ class OCRStrategyService:
             # 获取原始图片尺寸
             width, height = image.size
 
+            payload = None
             # 检查并调整图片尺寸
             if width > MAX_WIDTH or height > MAX_HEIGHT:
                 # 计算缩放比例
@@ -106,9 +193,15 @@ class OCRStrategyService:
                 new_size = (int(width * ratio), int(height * ratio))
                 # 调整图片大小
                 image = image.resize(new_size, Image.Resampling.LANCZOS)
-                
-            image.save(img_byte, format='PNG')
-            res = self.baidu_client.basicGeneral(img_byte.getvalue())
+            elif original_bytes is not None and image.format in BAIDU_NATIVE_FORMATS:
+                # 尺寸合规且原文件就是百度支持的格式：直接发送原始字节，不再PNG重新编码
+                payload = bytes(original_bytes)
+
+            if payload is None:
+                img_byte = io.BytesIO()
+                image.save(img_byte, format='PNG')
+                payload = img_byte.getvalue()
+            res = self.baidu_client.basicGeneral(payload)
             if res.get("error_code"):
                 raise Exception(res["error_msg"])
             return {
@@ -123,8 +216,18 @@ class OCRStrategyService:
     def _tesseract_ocr(self, image: Image.Image, file_type: str) -> dict:
         # Tesseract配置复用config，和ocr_tasks逻辑一致
         try:
+            if PyTessBaseAPI is not None:
+                psm = settings.TESSERACT_PDF_PSM if file_type == "pdf" else settings.TESSERACT_IMAGE_PSM
+                with _TESSERACT_SLOTS, _borrow_tess_api(psm) as api:
+                    api.SetImage(image)
+                    text = api.GetUTF8Text()
+                return {
+                    "status": "success", "engine": "tesseract",
+                    "text": text, "confidence": 0.90
+                }
             cfg = self.tesseract_config.get(file_type, self.tesseract_config["image"])
-            text = pytesseract.image_to_string(image, config=cfg, lang='chi_sim')
+            with _TESSERACT_SLOTS:
+                text = pytesseract.image_to_string(image, config=cfg, lang='chi_sim')
             return {
                 "status": "success", "engine": "tesseract",
                 "text": text, "confidence": 0.90
@@ -1,24 +1,104 @@
 # app/services/pdf_service.py
+from reportlab import rl_config
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import inch
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfgen import canvas
+import io
 import os
+import threading
 from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+# 关闭ReportLab的逐属性类型检查（每个绘图调用都要走一遍，报告内容都是自己生成的）
+rl_config.shapeChecking = 0
 
-# 注册中文字体，解决PDF中文乱码问题
-pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
 FONT_CN = 'STSong-Light'
+_font_lock = threading.Lock()
 
-def generate_review_pdf(review_result: dict, filename: str = None) -> str:
-    """
-    生成AI审查结果PDF报告
-    :param review_result: ai_review_service返回的审查结果字典
-    :param filename: 原图纸文件名
-    :return: PDF文件的本地路径
-    """
+def _init_pdf() -> None:
+    """注册中文字体，解决PDF中文乱码问题（已注册过则跳过，多线程同时调用也只注册一次）"""
+    with _font_lock:
+        if FONT_CN not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(UnicodeCIDFont(FONT_CN))
+
+# 模块导入时注册一次；Celery prefork子进程fork自已导入任务模块的主进程，直接继承注册结果
+_init_pdf()
+
+# 报告版式固定（标题+两个小节+正文），直接在canvas上逐行绘制，不走Platypus的排版/分页引擎
+PAGE_WIDTH, PAGE_HEIGHT = letter
+MARGIN_X = 0.5 * inch
+MARGIN_TOP = 0.75 * inch
+MARGIN_BOTTOM = 0.75 * inch
+TEXT_WIDTH = PAGE_WIDTH - 2 * MARGIN_X
+# (字号, 行高)
+TITLE_FONT = (16, 20)
+HEADING_FONT = (12, 16)
+HEADING_SPACE_AFTER = 8
+BODY_FONT = (10, 14)
+
+def _wrap_line(text: str, font_size: float) -> list:
+    """按实际字宽折行（中文没有空格可断，逐字累计宽度）"""
+    if pdfmetrics.stringWidth(text, FONT_CN, font_size) <= TEXT_WIDTH:
+        return [text]
+    lines = []
+    start = 0
+    width = 0.0
+    for i, ch in enumerate(text):
+        ch_width = pdfmetrics.stringWidth(ch, FONT_CN, font_size)
+        if width + ch_width > TEXT_WIDTH and i > start:
+            lines.append(text[start:i])
+            start = i
+            width = 0.0
+        width += ch_width
+    lines.append(text[start:])
+    return lines
+
+class _ReportCanvas:
+    """在canvas上自上而下写报告，写到页底自动换页"""
+
+    def __init__(self, target):
+        self.canvas = canvas.Canvas(target, pagesize=letter)
+        self.y = PAGE_HEIGHT - MARGIN_TOP
+
+    def _ensure_space(self, height: float):
+        if self.y - height < MARGIN_BOTTOM:
+            self.canvas.showPage()
+            self.y = PAGE_HEIGHT - MARGIN_TOP
+
+    def title(self, text: str):
+        size, leading = TITLE_FONT
+        self._ensure_space(leading)
+        self.y -= leading
+        self.canvas.setFont(FONT_CN, size)
+        self.canvas.drawCentredString(PAGE_WIDTH / 2, self.y, text)
+
+    def heading(self, text: str):
+        size, leading = HEADING_FONT
+        self._ensure_space(leading)
+        self.y -= leading
+        self.canvas.setFont(FONT_CN, size)
+        self.canvas.drawString(MARGIN_X, self.y, text)
+        self.y -= HEADING_SPACE_AFTER
+
+    def body(self, text: str):
+        size, leading = BODY_FONT
+        for line in _wrap_line(text, size):
+            self._ensure_space(leading)
+            self.y -= leading
+            # 换页后字体状态会重置，每行都按当前字体写
+            self.canvas.setFont(FONT_CN, size)
+            self.canvas.drawString(MARGIN_X, self.y, line)
+
+    def space(self, height: float):
+        self.y -= height
+
+    def save(self):
+        self.canvas.save()
+
+def _review_pdf_path(filename: Optional[str]) -> str:
+    """生成本地输出路径：output/review_<原文件名>_<时间戳>.pdf"""
     # 创建输出目录，不存在则自动创建
     output_dir = "output"
     os.makedirs(output_dir, exist_ok=True)
@@ -27,59 +107,96 @@ def generate_review_pdf(review_result: dict, filename: str = None) -> str:
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     base_name = os.path.splitext(filename)[0] if filename else "unnamed_drawing"
     pdf_filename = f"review_{base_name}_{timestamp}.pdf"
-    pdf_path = os.path.join(output_dir, pdf_filename)
-
-    # 初始化PDF文档和样式
-    doc = SimpleDocTemplate(pdf_path, pagesize=letter,
-                            rightMargin=0.5*inch, leftMargin=0.5*inch,
-                            topMargin=0.75*inch, bottomMargin=0.75*inch)
-    styles = getSampleStyleSheet()
-    # 自定义中文样式，适配字体和行距
-    cn_title_style = styles["Title"]
-    cn_title_style.fontName = FONT_CN
-    cn_title_style.fontSize = 16
-    cn_title_style.alignment = 1  # 居中
-
-    cn_heading_style = styles["Heading2"]
-    cn_heading_style.fontName = FONT_CN
-    cn_heading_style.fontSize = 12
-    cn_heading_style.spaceAfter = 8
-
-    cn_body_style = styles["BodyText"]
-    cn_body_style.fontName = FONT_CN
-    cn_body_style.fontSize = 10
-    cn_body_style.leading = 14  # 行距
-
-    story = []  # PDF内容容器
+    return os.path.join(output_dir, pdf_filename)
+
+def _iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """把任意切分的文本片段（如大模型流式输出）重新切成完整的行"""
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split('\n')
+        yield from lines
+    if pending:
+        yield pending
+
+def _write_review_pdf(target, filename: Optional[str], lines: Iterable[str]) -> None:
+    """按固定版式写报告；审查结果逐行取自lines，边取边绘制"""
+    report = _ReportCanvas(target)
 
     # 1. 添加报告标题
-    story.append(Paragraph("图纸AI审查报告", cn_title_style))
-    story.append(Spacer(1, 0.3*inch))
+    report.title("图纸AI审查报告")
+    report.space(0.3*inch)
 
     # 2. 添加基础信息
-    story.append(Paragraph("一、基础信息", cn_heading_style))
-    story.append(Paragraph(f"审查时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", cn_body_style))
-    story.append(Paragraph(f"原图纸文件：{filename or '未知文件'}", cn_body_style))
-    story.append(Spacer(1, 0.2*inch))
-
-    # 3. 添加核心审查结果
-    story.append(Paragraph("二、AI审查结果", cn_heading_style))
-    if "structured_data" in review_result and review_result["structured_data"]:
-        # 按行分割内容，保持原格式
-        content_lines = review_result["structured_data"].split('\n')
-        for line in content_lines:
-            line = line.strip() if line.strip() else " "  # 处理空行，避免PDF排版异常
-            story.append(Paragraph(line, cn_body_style))
-    else:
-        story.append(Paragraph("暂无有效审查结果", cn_body_style))
-
-    # 4. 构建PDF文档
+    report.heading("一、基础信息")
+    report.body(f"审查时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report.body(f"原图纸文件：{filename or '未知文件'}")
+    report.space(0.2*inch)
+
+    # 3. 添加核心审查结果（保持原格式，空行照样占一行）
+    report.heading("二、AI审查结果")
+    has_content = False
+    for line in lines:
+        report.body(line.strip())
+        has_content = True
+    if not has_content:
+        report.body("暂无有效审查结果")
+
+    # 4. 写出PDF文档
+    report.save()
+
+def generate_review_pdf(review_result: dict, filename: str = None, stream=None) -> Optional[str]:
+    """
+    生成AI审查结果PDF报告
+    :param review_result: ai_review_service返回的审查结果字典
+    :param filename: 原图纸文件名
+    :param stream: 可选的可写二进制文件对象（BytesIO/HTTP响应等），传入时PDF直接写进去，不落本地文件
+    :return: PDF文件的本地路径（传入stream时返回None）
+    """
+    pdf_path = _review_pdf_path(filename) if stream is None else None
+    content = review_result.get("structured_data")
     try:
-        doc.build(story)
+        _write_review_pdf(stream if stream is not None else pdf_path, filename, content.split('\n') if content else [])
         return pdf_path
     except Exception as e:
         raise Exception(f"PDF生成失败：{str(e)}")
 
+def generate_review_pdf_streaming(chunks: Iterable[str], filename: str = None, stream=None) -> Optional[str]:
+    """
+    边接收大模型流式输出边生成PDF报告：每收到完整一行就画到canvas上，
+    模型生成和PDF绘制重叠进行，总耗时约等于模型生成耗时
+    :param chunks: 审查结果文本片段的迭代器（如AIService.stream_ai）
+    :return: 同generate_review_pdf
+    :raises: chunks迭代时抛出的异常原样抛出；写PDF本身失败时抛出"PDF生成失败"，两种情况都不留下半截文件
+    """
+    pdf_path = _review_pdf_path(filename) if stream is None else None
+    source_errors = []
+
+    def guarded_chunks():
+        try:
+            yield from chunks
+        except Exception as e:
+            source_errors.append(e)
+            raise
+
+    try:
+        _write_review_pdf(stream if stream is not None else pdf_path, filename, _iter_lines(guarded_chunks()))
+        return pdf_path
+    except Exception as e:
+        # 中途失败的报告不完整，不留在output目录里
+        if pdf_path is not None and os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        if source_errors and e is source_errors[0]:
+            # 上游（大模型流式调用）的异常原样抛出，调用方按原异常类型处理/重试
+            raise
+        raise Exception(f"PDF生成失败：{str(e)}")
+
+def generate_review_pdf_bytes(review_result: dict, filename: str = None) -> bytes:
+    """生成AI审查结果PDF报告并直接返回PDF二进制（写内存缓冲区，不经过本地临时文件）"""
+    buffer = io.BytesIO()
+    generate_review_pdf(review_result, filename, stream=buffer)
+    return buffer.getvalue()
+
 # 测试代码（可选，直接运行该文件可验证功能）
 if __name__ == "__main__":
     test_result = {
@@ -87,4 +204,4 @@ if __name__ == "__main__":
         "structured_data": "总体结论：通过\n图纸编号：DQ-2026-008（符合规范）\n图纸比例：1:50（符合要求）\n设备型号：CM1-250（标注清晰）\n电线规格：BV-4mm²（选型合理）"
     }
     path = generate_review_pdf(test_result, "低压电气图纸.pdf")
-    print(f"PDF生成成功，路径：{path}")
\ No newline at end of file
+    print(f"PDF生成成功，路径：{path}")
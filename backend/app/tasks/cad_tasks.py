@@ -1,15 +1,19 @@
 import os
 import logging
+from contextlib import ExitStack
 # CAD 相关的异步任务,导入自己的celery_app实例
 from app.core.celery_config import celery_app
+from app.core.config import settings
 # 导入服务层核心函数（按需导入，避免冗余）
 from app.services.cad_service import (
-    convert_dwg_to_dxf_from_bytes,
     process_image_service,
     process_dxf_service,
     process_pdf_service,
-    render_cad_to_image  # 新增：导入渲染函数
+    process_batch_service,
+    render_cad_to_image,  # 新增：导入渲染函数
+    render_pdf_to_png
 )
+from app.utils.file_utils import open_mapped_file, remove_temp_file
 
 # 初始化logger（解决logger未定义问题）
 logging.basicConfig(level=logging.INFO)
@@ -17,10 +21,11 @@ logger = logging.getLogger(__name__)
 
 # ========== 原有任务函数（不变） ==========
 @celery_app.task(bind=True)
-def process_image_file(self, file_content: bytes, filename: str) -> dict:
-    """处理图片文件的 Celery 任务"""
+def process_image_file(self, file_path: str, filename: str) -> dict:
+    """处理图片文件的 Celery 任务（file_path为API流式落盘的上传文件）"""
     try:
-        result = process_image_service(file_content, filename)
+        with open_mapped_file(file_path) as file_content:
+            result = process_image_service(file_content, filename)
         return result
     except Exception as e:
         logger.error(f"图片文件任务处理失败：{str(e)}")
@@ -29,20 +34,18 @@ def process_image_file(self, file_content: bytes, filename: str) -> dict:
             "error": str(e),
             "message": "图片文件处理任务执行失败"
         }
+    finally:
+        remove_temp_file(file_path)
 
 @celery_app.task(bind=True)
-def process_dwg_file(self, file_content: bytes, filename: str) -> dict:
-    """处理 DWG 文件: 先转成 DXF，再调用DXF服务层处理"""
+def process_dwg_file(self, file_path: str, filename: str) -> dict:
+    """
+    处理 DWG 文件：直接交给DXF服务层（按.dwg后缀走ODA转换，转换后的文档已解析好直接渲染），
+    不再把转换出的DXF从磁盘读回来再按DXF重新解析一遍
+    """
     try:
-        dxf_result = convert_dwg_to_dxf_from_bytes(file_content, filename)
-        if dxf_result["status"] != "success":
-            return dxf_result
-
-        dxf_file_path = dxf_result["dxf_file"]
-        with open(dxf_file_path, 'rb') as f:
-            dxf_content = f.read()
-
-        return process_dxf_service(dxf_content, filename)
+        with open_mapped_file(file_path) as file_content:
+            return process_dxf_service(file_content, filename)
 
     except Exception as e:
         logger.error(f"DWG文件任务处理失败：{str(e)}")
@@ -51,12 +54,15 @@ def process_dwg_file(self, file_content: bytes, filename: str) -> dict:
             "error": str(e),
             "message": "DWG 文件处理任务执行失败"
         }
+    finally:
+        remove_temp_file(file_path)
 
 @celery_app.task(bind=True)
-def process_dxf_file(self, file_content: bytes, filename: str) -> dict:
+def process_dxf_file(self, file_path: str, filename: str) -> dict:
     """处理 DXF 文件：调用服务层逻辑"""
     try:
-        result = process_dxf_service(file_content, filename)
+        with open_mapped_file(file_path) as file_content:
+            result = process_dxf_service(file_content, filename)
         return result
     except Exception as e:
         logger.error(f"DXF文件任务处理失败：{str(e)}")
@@ -65,12 +71,18 @@ def process_dxf_file(self, file_content: bytes, filename: str) -> dict:
             "error": str(e),
             "message": "DXF 文件处理任务执行失败"
         }
+    finally:
+        remove_temp_file(file_path)
 
 @celery_app.task(bind=True)
-def process_pdf_file(self, file_content: bytes, filename: str) -> dict:
-    """处理 PDF 文件：调用服务层逻辑"""
+def process_pdf_file(self, file_path: str, filename: str) -> dict:
+    """处理 PDF 文件：调用服务层逻辑，逐页上报OCR进度（任务状态PROGRESS）"""
+    def report_progress(done: int, total: int):
+        self.update_state(state="PROGRESS", meta={"ocr_pages_done": done, "page_count": total})
+
     try:
-        result = process_pdf_service(file_content, filename)
+        with open_mapped_file(file_path) as file_content:
+            result = process_pdf_service(file_content, filename, on_page_done=report_progress)
         return result
     except Exception as e:
         logger.error(f"PDF文件任务处理失败：{str(e)}")
@@ -79,13 +91,57 @@ def process_pdf_file(self, file_content: bytes, filename: str) -> dict:
             "error": str(e),
             "message": "PDF 文件处理任务执行失败"
         }
+    finally:
+        remove_temp_file(file_path)
+
+@celery_app.task(bind=True)
+def process_batch_files(self, file_paths: list, filenames: list) -> list:
+    """
+    多文件（图片/PDF）批量处理：逐个OCR后走DashScope批处理接口一次性审查
+    批处理要轮询到完成（最长AI_BATCH_MAX_WAIT秒），只在Worker里执行，不占API的事件循环
+    """
+    try:
+        with ExitStack() as stack:
+            contents = [stack.enter_context(open_mapped_file(file_path)) for file_path in file_paths]
+            return process_batch_service(list(zip(contents, filenames)))
+    except Exception as e:
+        logger.error("批量文件任务处理失败：%s", e)
+        return [{
+            "status": "failed",
+            "error": str(e),
+            "message": "批量文件处理任务执行失败"
+        }] * len(file_paths)
+    finally:
+        for file_path in file_paths:
+            remove_temp_file(file_path)
 
 # ========== 新增：CAD转图片异步任务（核心） ==========
 @celery_app.task(bind=True, time_limit=3600)
-def async_render_cad_to_image(self, file_content: bytes, file_type: str):
+def async_render_cad_to_image(self, file_path: str, file_type: str):
     """异步渲染CAD为图片（供OCR接口调用）"""
     try:
-        return render_cad_to_image(file_content, file_type)
+        with open_mapped_file(file_path) as file_content:
+            return render_cad_to_image(file_content, file_type)
     except Exception as e:
         logger.error(f"异步渲染CAD图片失败：{str(e)}")
-        raise e  # 抛出异常，让Celery标记任务失败
\ No newline at end of file
+        raise e  # 抛出异常，让Celery标记任务失败
+    finally:
+        remove_temp_file(file_path)
+
+@celery_app.task(bind=True)
+def render_task(self, file_path: str, file_type: str) -> list:
+    """
+    任务链第一段：把上传的CAD/PDF文件渲染为逐页PNG二进制列表
+    CPU密集，放在Worker执行；上传文件在这里清理
+    """
+    try:
+        if file_type == "pdf":
+            # 渲染结果只给下一段OCR用：按OCR配置的DPI和格式输出
+            return render_pdf_to_png(file_path, dpi=settings.PDF_OCR_DPI, image_format=settings.OCR_IMAGE_FORMAT)
+        with open_mapped_file(file_path) as file_content:
+            return [render_cad_to_image(file_content, file_type)]
+    except Exception as e:
+        logger.error(f"渲染{file_type}文件失败：{str(e)}")
+        raise e  # 抛出异常，让Celery标记任务失败，后续链路不再执行
+    finally:
+        remove_temp_file(file_path)
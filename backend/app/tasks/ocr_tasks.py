@@ -1,15 +1,32 @@
 import io
 import re
 import os
+import tempfile
+import hashlib
 import logging
+import threading
 
+import cv2
+import numpy as np
 import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image, ImageEnhance, ImageFilter
+from celery import chord
+from celery.signals import worker_process_init
+from PIL import Image, ImageEnhance
+from cachetools import LRUCache
+try:
+    import ahocorasick  # pyahocorasick：多关键字一次扫描匹配
+except ImportError:  # 未安装时退回正则多选匹配
+    ahocorasick = None
+try:
+    import fitz  # PyMuPDF：进程内渲染PDF并读取文本层，未安装时回退pdf2image
+except ImportError:
+    fitz = None
 
 from app.core.config import settings
 from app.core.celery_config import celery_app
-from app.services.ocr_strategy_service import OCRStrategyService  # 已导入策略层
+from app.database.redis import cache_get, cache_set
+from app.services.ocr_strategy_service import ocr_strategy_service  # 已导入策略层
+from app.utils.image_utils import to_gray_array
 
 # -删除 timeout_decorator 和 functools.wraps 的导入
 
@@ -19,34 +36,93 @@ logger = logging.getLogger(__name__)
 pytesseract.pytesseract.tesseract_cmd = settings.TESSERACT_CMD_PATH
 
 
-def preprocess_image(img: Image.Image) -> Image.Image:
-    """
-    针对电气图纸的特点，优化图像预处理流程：
-    - 转灰度
-    - 二值化
-    - 去噪（中值滤波）
-    - 尝试自动方向检测并旋转保证文字水平
-    """
-    # 转为灰度
-    img = img.convert("L")
+@worker_process_init.connect
+def _warmup_ocr_engine(**kwargs):
+    """Worker子进程启动时预建常驻Tesseract句柄，第一个OCR任务不用再等模型加载"""
+    try:
+        ocr_strategy_service.warmup()
+    except Exception as e:
+        # 预热失败不影响Worker启动，任务执行时照常懒加载
+        logger.warning("预加载Tesseract句柄失败：%s", e)
 
-    # 二值化（简单阈值）
-    img = img.point(lambda x: 0 if x < 128 else 255, "1")
+# 电气图纸关键信息所在行的关键词（模块加载时建好匹配器，每行只扫描一遍，与关键词个数无关）
+KEY_ELEMENT_KEYWORDS = ("编号", "参数", "型号", "规格", "电压", "电流")
 
-    # 去除噪声
-    img = img.filter(ImageFilter.MedianFilter(size=3))
 
-    # 尝试检测并矫正方向
+def _build_key_element_matcher():
+    """返回 line -> bool 的关键词判断函数：优先Aho-Corasick自动机，未安装时用编译好的正则"""
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for keyword in KEY_ELEMENT_KEYWORDS:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        return lambda line: next(automaton.iter(line), None) is not None
+    pattern = re.compile("|".join(map(re.escape, KEY_ELEMENT_KEYWORDS)))
+    return lambda line: pattern.search(line) is not None
+
+
+_has_key_element = _build_key_element_matcher()
+
+# 方向检测结果缓存：同一张扫描件重复提交时不再跑一遍Tesseract版面分析
+_osd_angle_cache: LRUCache = LRUCache(maxsize=128)
+_osd_angle_cache_lock = threading.Lock()
+
+
+def _detect_angle(img: Image.Image) -> int:
+    """
+    用Tesseract OSD检测文字方向，返回需要顺时针旋转的角度（检测失败返回0）
+    以稀疏采样像素的哈希为键缓存结果
+    """
+    arr = np.asarray(img)
+    key = hashlib.blake2b(arr[::64, ::64].tobytes() + repr(arr.shape).encode(), digest_size=16).digest()
+    with _osd_angle_cache_lock:
+        angle = _osd_angle_cache.get(key)
+    if angle is not None:
+        return angle
+
+    angle = 0
     try:
         osd = pytesseract.image_to_osd(img)
         m = re.search(r"(?<=Rotate: )\d+", osd)
         if m:
             angle = int(m.group(0))
-            if angle != 0:
-                img = img.rotate(-angle, expand=True)
     except Exception:
         # 方向检测失败时跳过，不影响后续 OCR
         pass
+    with _osd_angle_cache_lock:
+        _osd_angle_cache[key] = angle
+    return angle
+
+
+def _binarize_image(img: Image.Image) -> Image.Image:
+    """转灰度→二值化→中值去噪"""
+    # 转为灰度（PDF渲染页本身就是灰度，不再多拷贝一次），之后的二值化和去噪都在numpy缓冲区上用OpenCV完成
+    arr = to_gray_array(img)
+
+    # 二值化（简单阈值）
+    _, arr = cv2.threshold(arr, 127, 255, cv2.THRESH_BINARY)
+
+    # 去除噪声
+    arr = cv2.medianBlur(arr, 3)
+    return Image.fromarray(arr)
+
+
+def preprocess_image(img: Image.Image, angle: int = None) -> Image.Image:
+    """
+    针对电气图纸的特点，优化图像预处理流程：
+    - 转灰度
+    - 二值化
+    - 去噪（中值滤波）
+    - 尝试自动方向检测并旋转保证文字水平
+    :param angle: 已知的旋转角度（同一文档各页共用首页的检测结果），为None时对本页做方向检测
+    """
+    img = _binarize_image(img)
+
+    # 尝试检测并矫正方向
+    if angle is None:
+        angle = _detect_angle(img)
+    if angle != 0:
+        img = img.rotate(-angle, expand=True)
 
     return img
 
@@ -66,15 +142,33 @@ def postprocess_ocr_result(raw_text: str) -> dict:
     }
 
     # 根据电气图纸特点提取关键信息（简单规则示例）
-    keywords = ["编号", "参数", "型号", "规格", "电压", "电流"]
-    for line in lines:
-        if any(keyword in line for keyword in keywords):
-            structured_data["key_elements"].append(line)
+    structured_data["key_elements"] = [line for line in lines if _has_key_element(line)]
 
     return structured_data
 
 # -删除 convert_with_timeout 函数（不再需要）
 
+def _load_pdf_pages(file_content: bytes) -> list:
+    """
+    PyMuPDF逐页读取PDF：有文本层的页面返回文本(str)，扫描页按PDF_OCR_DPI渲染为灰度PIL图片
+    """
+    from app.services.ocr_service import pdf_page_native_text
+
+    pages = []
+    try:
+        with fitz.open(stream=file_content, filetype="pdf") as doc:
+            for page in doc:
+                native_text = pdf_page_native_text(page)
+                if native_text is not None:
+                    pages.append(native_text)
+                    continue
+                pix = page.get_pixmap(dpi=settings.PDF_OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+                pages.append(Image.frombytes("L", (pix.width, pix.height), pix.samples))
+    except Exception as e:
+        raise ValueError(f"PDF 转换失败：{str(e)}")
+    logger.info("PDF共%s页，其中%s页直接使用文本层", len(pages), sum(isinstance(p, str) for p in pages))
+    return pages
+
 # -给 Celery 任务添加原生超时参数
 @celery_app.task(bind=True, time_limit=60, soft_time_limit=55)
 def perform_ocr(self, file_content: bytes, file_type: str = "image") -> dict:
@@ -88,11 +182,32 @@ def perform_ocr(self, file_content: bytes, file_type: str = "image") -> dict:
         images = []
 
         # 根据文件类型处理
-        if file_type == "pdf":
+        if file_type == "pdf" and fitz is not None:
+            # 带文本层的页面直接取文本，只有扫描页才渲染送OCR
+            images = _load_pdf_pages(file_content)
+            if not images:
+                raise ValueError("PDF 文件转换后无有效图片")
+
+        elif file_type == "pdf":
             logger.info("开始将 PDF 转换为图片进行 OCR 识别")
             try:
-                # -直接调用 convert_from_bytes，不再用超时装饰器函数
-                images = convert_from_bytes(file_content, dpi=300, fmt='png',output_folder=None,first_page=None,last_page=None,grayscale=True)
+                # -直接调用 convert_from_bytes，不再用超时装饰器函数（pdf2image只在PDF分支用到，延迟导入）
+                from pdf2image import convert_from_bytes
+                # 一次pdftocairo调用多线程渲染所有页，中间文件写到临时目录（不走管道），灰度JPEG解码更快
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    images = convert_from_bytes(
+                        file_content,
+                        dpi=settings.PDF_OCR_DPI,
+                        fmt="jpeg",
+                        output_folder=tmp_dir,
+                        grayscale=True,
+                        use_pdftocairo=True,
+                        thread_count=min(8, os.cpu_count() or 1),
+                        poppler_path=getattr(settings, "POPPLER_PATH", None)
+                    )
+                    # 临时目录删除前把图片数据读进内存
+                    for img in images:
+                        img.load()
             except Exception as e:
                 # -捕获转换异常（包含超时/其他错误）
                 raise ValueError(f"PDF 转换失败：{str(e)}（可能是文件过大/转换耗时过长）")
@@ -101,15 +216,20 @@ def perform_ocr(self, file_content: bytes, file_type: str = "image") -> dict:
                 raise ValueError("PDF 文件转换后无有效图片")
 
         elif file_type in ("image", "dxf"):
-            logger.info(f"开始处理 {file_type} 类型图片的 OCR 识别")
-            img_buffer = io.BytesIO(file_content)
+            logger.info("开始处理 %s 类型图片的 OCR 识别", file_type)
             try:
-                # 打开并校验图片
-                with Image.open(img_buffer) as img:
-                    img.verify()  # 校验文件头
-                img_buffer.seek(0)
-                # 重新打开用于识别
-                images = [Image.open(img_buffer).convert("RGB")]
+                # 只解码一次：load()读不出来就是无效图片，不再先verify再重新打开；
+                # 预处理第一步就转灰度，这里不再先转RGB
+                img = Image.open(io.BytesIO(file_content))
+                max_side = settings.OCR_MAX_IMAGE_SIDE
+                if max(img.size) > max_side:
+                    # JPEG可在解码时按2的幂直接缩小（draft），再精确缩到上限尺寸
+                    img.draft(None, (max_side, max_side))
+                    img.load()
+                    logger.info("图片尺寸%s超过上限%s，等比缩小后再识别", img.size, max_side)
+                    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+                img.load()
+                images = [img]
             except Exception as e:
                 raise ValueError(f"无效的图片格式，无法识别: {e}")
 
@@ -119,27 +239,39 @@ def perform_ocr(self, file_content: bytes, file_type: str = "image") -> dict:
         # 初始化存储识别结果的列表
         full_text_parts = []
 
-        # 遍历每张图片执行 OCR（核心：调用策略层）
-        for idx, img in enumerate(images):
-            logger.info(f"开始处理第{idx+1}张图片的OCR识别")
-            # 图片预处理（保留原有逻辑）
-            img = preprocess_image(img)
-            
-            # 调用双OCR策略层（核心修改）
-            ocr_strategy = OCRStrategyService()
-            ocr_res = ocr_strategy.recognize(img, file_type=file_type, strategy="hybrid")
-            
+        # 先把需要OCR的页全部预处理好（PDF自带文本层的页直接是文本，不参与OCR）
+        ocr_indexes = [idx for idx, img in enumerate(images) if not isinstance(img, str)]
+        # 原图二值化后立即关闭并从列表里摘掉，内存里同一时刻只多留一张原图，而不是整份文档的原图都留到最后
+        batch = []
+        for idx in ocr_indexes:
+            batch.append(_binarize_image(images[idx]))
+            images[idx].close()
+            images[idx] = None
+        # 同一文档各页扫描方向基本一致，只对首页做方向检测，其余页复用角度
+        angle = _detect_angle(batch[0]) if batch else 0
+        if angle != 0:
+            for i, page in enumerate(batch):
+                batch[i] = page.rotate(-angle, expand=True)
+                page.close()
+
+        # 整批提交给双OCR策略层（复用模块级实例，百度客户端和Tesseract句柄不再逐图创建）
+        page_texts = {}
+        for idx, ocr_res in zip(ocr_indexes, ocr_strategy_service.recognize_batch(batch, file_type=file_type, strategy="hybrid")):
             # 处理识别结果
             if ocr_res["status"] == "success":
-                full_text_parts.append(ocr_res["text"])
-                logger.info(f"第{idx+1}张图片识别成功，使用引擎：{ocr_res['engine']}")
+                page_texts[idx] = ocr_res["text"]
+                logger.info("第%s张图片识别成功，使用引擎：%s", idx+1, ocr_res['engine'])
             else:
-                logger.error(f"第{idx+1}张图片双引擎识别均失败：{ocr_res['error']}")
+                logger.error("第%s张图片双引擎识别均失败：%s", idx+1, ocr_res['error'])
                 raise ValueError(f"OCR识别失败：{ocr_res['error']}")
-            
-            # 释放内存
-            del img
-            logger.info(f"第{idx+1}张图片OCR识别完成")
+        # 释放内存
+        for page in batch:
+            page.close()
+        del batch
+
+        # 按页序拼回文本层页和OCR页（OCR页在列表里已置为None）
+        for idx, img in enumerate(images):
+            full_text_parts.append(img if isinstance(img, str) else page_texts[idx])
 
         # 合并所有页面的识别结果
         full_text = "\n".join(full_text_parts)
@@ -156,10 +288,63 @@ def perform_ocr(self, file_content: bytes, file_type: str = "image") -> dict:
 
     except ValueError as e:
         # 捕获业务相关错误（如格式/参数错误）
-        logger.error(f"OCR 识别业务错误：{e}")
+        logger.error("OCR 识别业务错误：%s", e)
         return {"status": "failed", "error": str(e), "message": "OCR 识别参数 / 格式错误"}
 
     except Exception as e:
         # 捕获其他未知错误
         logger.exception("OCR 识别系统错误")
-        return {"status": "failed", "error": str(e), "message": "OCR 识别失败"}
\ No newline at end of file
+        return {"status": "failed", "error": str(e), "message": "OCR 识别失败"}
+
+
+def _ocr_page(png_bytes: bytes, idx: int, file_type: str) -> str:
+    """识别单页PNG并返回文本，同一页内容重复上传时直接取缓存文本"""
+    cache_key = f"ocr:page:{settings.OCR_VERSION}:{hashlib.sha256(png_bytes).hexdigest()}"
+    cached_text = cache_get(cache_key)
+    if cached_text is not None:
+        return cached_text
+    # 直接走字节入口，不再包装成UploadFile
+    ocr_res = ocr_strategy_service.process_bytes(png_bytes, f"page_{idx+1}.{file_type}")
+    if ocr_res["status"] != "success":
+        raise ValueError(f"第{idx+1}页OCR识别失败：{ocr_res['error_message']}")
+    cache_set(cache_key, ocr_res["content"])
+    return ocr_res["content"]
+
+
+def _join_page_texts(page_texts: list) -> str:
+    """按页序拼接各页文本"""
+    content = "\n".join(page_texts)
+    # 放宽文本长度限制（CAD/PDF转PNG后OCR文本可能短），但不能为空
+    if not content.strip():
+        raise ValueError("OCR识别结果为空")
+    logger.info("OCR任务完成：共%s页，提取文本长度 %s", len(page_texts), len(content))
+    return content
+
+
+@celery_app.task(bind=True)
+def ocr_page_task(self, png_bytes: bytes, idx: int, file_type: str = "image") -> str:
+    """多页文档拆分后的单页OCR任务（group中各页分发到不同OCR Worker并行执行）"""
+    return _ocr_page(png_bytes, idx, file_type)
+
+
+@celery_app.task(bind=True)
+def join_ocr_pages_task(self, page_texts: list) -> str:
+    """chord回调：group结果已按页序排列，拼接后交给任务链的下一段"""
+    return _join_page_texts(page_texts)
+
+
+@celery_app.task(bind=True)
+def ocr_task(self, png_pages: list, file_type: str = "image") -> str:
+    """
+    任务链第二段：对渲染好的逐页PNG执行OCR，返回按页序拼接的文本
+    多页时把自己替换成 group(逐页OCR) | 拼接 的chord，各页并行识别，结果照常流向下一段
+    :param png_pages: 上一段渲染任务返回的PNG二进制列表
+    :param file_type: 'image' | 'pdf'，决定Tesseract降级时的配置
+    :return: OCR文本（作为下一段AI审查任务的ocr_content）
+    """
+    if len(png_pages) > 1:
+        raise self.replace(chord(
+            (ocr_page_task.s(png_bytes, idx, file_type) for idx, png_bytes in enumerate(png_pages)),
+            join_ocr_pages_task.s()
+        ))
+    return _join_page_texts([_ocr_page(png_bytes, idx, file_type) for idx, png_bytes in enumerate(png_pages)])
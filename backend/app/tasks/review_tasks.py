@@ -1,7 +1,9 @@
 # app/tasks/review_tasks.py
+from celery.signals import worker_process_init
 from app.core.celery_config import celery_app
+from app.core.config import settings
 from app.services.ai_service import AIService  # 你的AI服务
-from app.services.pdf_service import generate_review_pdf  # 你的PDF服务
+from app.services.pdf_service import generate_review_pdf, generate_review_pdf_streaming  # 你的PDF服务
 from app.utils.data_processor import process_ocr_for_ai  # 你的OCR处理工具
 
 from app.utils.prompt_utils import load_prompts_from_text_file, get_prompt_by_drawing_name  # 你的提示词工具
@@ -11,13 +13,23 @@ logger = logging.getLogger(__name__)
 ai_service = AIService()  # 初始化AI服务
 
 
+@worker_process_init.connect
+def _warmup_prompts(**kwargs):
+    """Worker子进程启动时预先解析一次提示词文件，第一个审查任务不用再付读文件+解析的开销"""
+    try:
+        load_prompts_from_text_file(settings.COMPANY_RULES_PATH)
+    except Exception as e:
+        # 预热失败不影响Worker启动，任务执行时照常走兜底提示词
+        logger.warning("预加载提示词失败：%s", e)
+
+
 # 定义异步任务：AI审查+PDF生成
 @celery_app.task(bind=True, retry_backoff=3, retry_kwargs={"max_retries": 2})
 def async_ai_review(self, ocr_content, drawing_name, model_name, generate_pdf):
     try:
-        # 1. 加载提示词（和你原逻辑一致）
+        # 1. 加载提示词（文件未修改时直接复用Worker内的解析缓存）
         try:
-            prompt_dict = load_prompts_from_text_file()
+            prompt_dict = load_prompts_from_text_file(settings.COMPANY_RULES_PATH)
             base_prompt = get_prompt_by_drawing_name(drawing_name or "通用图纸", prompt_dict)
         except Exception:
             # 兜底提示词（用你原来的）
@@ -28,16 +40,30 @@ def async_ai_review(self, ocr_content, drawing_name, model_name, generate_pdf):
         ocr_result = type('OCRResult', (object,), {"content": ocr_content,"status":"success"})()
         final_prompt = process_ocr_for_ai(ocr_result, base_prompt)
         
-        # 3. 调用AI服务（指定模型）
-        ai_response = ai_service.call_ai(final_prompt, model_name=model_name)
-        if ai_response["status"] == "failure":
-            raise Exception(ai_response["content"])
-        
-        # 4. 生成PDF（如果需要）
-        pdf_path = None
-        if generate_pdf:
-            pdf_review_result = {"structured_data": ai_response["content"]}
-            pdf_path = generate_review_pdf(pdf_review_result, filename=drawing_name)
+        # 3+4. 需要PDF且指定了模型时流式调用：模型边生成，PDF边逐行绘制，两段耗时重叠
+        #      结果缓存已命中时不必流式，直接用缓存结果生成PDF
+        cached_response = ai_service.get_cached_ai_result(final_prompt, model_name=model_name)
+        if generate_pdf and model_name and cached_response is None:
+            chunks = []
+
+            def collect_chunks():
+                for chunk in ai_service.stream_ai(final_prompt, model_name=model_name):
+                    chunks.append(chunk)
+                    yield chunk
+
+            pdf_path = generate_review_pdf_streaming(collect_chunks(), filename=drawing_name)
+            ai_response = {"content": "".join(chunks), "model_used": model_name}
+        else:
+            # 3. 调用AI服务（指定模型）
+            ai_response = cached_response or ai_service.call_ai(final_prompt, model_name=model_name)
+            if ai_response["status"] == "failure":
+                raise Exception(ai_response["content"])
+
+            # 4. 生成PDF（如果需要）
+            pdf_path = None
+            if generate_pdf:
+                pdf_review_result = {"structured_data": ai_response["content"]}
+                pdf_path = generate_review_pdf(pdf_review_result, filename=drawing_name)
         
         # 返回任务结果（和原接口格式对齐）
         return {
@@ -46,7 +72,7 @@ def async_ai_review(self, ocr_content, drawing_name, model_name, generate_pdf):
             "pdf_path": pdf_path
         }
     except Exception as e:
-        logger.error(f"异步任务失败：{str(e)}", exc_info=True)
+        logger.error("异步任务失败：%s", e, exc_info=True)
         # 只重试2次，超过后抛出异常（让任务标记为FAILURE）
         if self.request.retries < self.max_retries:
             self.retry(exc=e)
@@ -1,7 +1,24 @@
 import re
 from typing import Dict, Any, Optional
+
+import numpy as np
+
 from .data_models import OCRResult
 
+# 正则在模块加载时编译一次，每次OCR结果清洗/提取直接复用
+_WHITESPACE_RE = re.compile(r'\s+')
+# 去除可能的乱码或特殊字符（保留中文、英文、数字和常用符号）
+_NOISE_RE = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9\s\.\,\:\;\(\)\[\]\-\_\+\=\@\#\$\%\^\&\*\!]')
+# 长文本（多页PDF的OCR结果）改用numpy按码点一次性过滤，短文本正则更快
+_VECTORIZED_CLEAN_MIN_CHARS = 4096
+# 与_WHITESPACE_RE/_NOISE_RE等价的码点表：Unicode空白字符都在U+3000以内
+_WHITESPACE_CODEPOINTS = np.array([cp for cp in range(0x3001) if _WHITESPACE_RE.match(chr(cp))], dtype=np.uint32)
+_ALLOWED_PUNCT_CODEPOINTS = np.array([ord(c) for c in ".,:;()[]-_+=@#$%^&*!"], dtype=np.uint32)
+# 提取图纸编号（示例正则，可根据实际格式调整）
+_DRAWING_NUMBER_RE = re.compile(r'([A-Z]{2}-\d{4}-\d{3}-V\d+\.\d+)')
+# 提取图纸比例（示例正则）
+_SCALE_RE = re.compile(r'比例\s*[:：]\s*(\d+\s*:\s*\d+)')
+
 def process_ocr_for_ai(ocr_result: OCRResult, base_prompt: str) -> str:
     """
     处理OCR结果，为AI审查准备最终的提示词
@@ -23,14 +40,36 @@ def process_ocr_for_ai(ocr_result: OCRResult, base_prompt: str) -> str:
     
     return final_prompt
 
+def _clean_ocr_text_vectorized(text: str) -> str:
+    """
+    clean_ocr_text的numpy版本（结果完全一致）：UTF-32码点数组上一遍算出保留掩码，只拼一次字符串
+    """
+    cps = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    is_ws = np.isin(cps, _WHITESPACE_CODEPOINTS)
+    # 连续空白只保留第一个（按原文相邻关系判断，与先压缩空白再去乱码的顺序一致）
+    run_start = is_ws.copy()
+    run_start[1:] &= ~is_ws[:-1]
+    allowed = (
+        ((cps >= 0x4E00) & (cps <= 0x9FA5))
+        | ((cps >= 0x30) & (cps <= 0x39))
+        | ((cps >= 0x41) & (cps <= 0x5A))
+        | ((cps >= 0x61) & (cps <= 0x7A))
+        | np.isin(cps, _ALLOWED_PUNCT_CODEPOINTS)
+    )
+    keep = run_start | (allowed & ~is_ws)
+    cleaned = np.where(is_ws, np.uint32(0x20), cps)[keep]
+    return cleaned.tobytes().decode("utf-32-le").strip()
+
 def clean_ocr_text(text: str) -> str:
     """清洗OCR识别出的文本，去除噪音"""
-    # 去除多余的换行和空格
-    text = re.sub(r'\n+', '\n', text)
-    text = re.sub(r'\s+', ' ', text)
+    if len(text) >= _VECTORIZED_CLEAN_MIN_CHARS:
+        return _clean_ocr_text_vectorized(text)
+
+    # 去除多余的换行和空格（连续空白含换行统一压成一个空格，原先单独压缩换行的一遍结果相同，省掉）
+    text = _WHITESPACE_RE.sub(' ', text)
     
     # 去除可能的乱码或特殊字符（保留中文、英文、数字和常用符号）
-    text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9\s\.\,\:\;\(\)\[\]\-\_\+\=\@\#\$\%\^\&\*\!]', '', text)
+    text = _NOISE_RE.sub('', text)
     
     return text.strip()
 
@@ -38,15 +77,13 @@ def extract_key_info(text: str) -> Dict[str, Any]:
     """从文本中提取关键信息，如图纸编号、比例等"""
     info = {}
     
-    # 提取图纸编号（示例正则，可根据实际格式调整）
-    drawing_number_pattern = r'([A-Z]{2}-\d{4}-\d{3}-V\d+\.\d+)'
-    match = re.search(drawing_number_pattern, text)
+    # 提取图纸编号
+    match = _DRAWING_NUMBER_RE.search(text)
     if match:
         info["drawing_number"] = match.group(1)
     
-    # 提取图纸比例（示例正则）
-    scale_pattern = r'比例\s*[:：]\s*(\d+\s*:\s*\d+)'
-    match = re.search(scale_pattern, text)
+    # 提取图纸比例
+    match = _SCALE_RE.search(text)
     if match:
         info["scale"] = match.group(1)
     
@@ -1,10 +1,26 @@
 import os
+import sys
+import mmap
+import uuid
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
+import anyio
+from fastapi import UploadFile
+
+from app.core.config import settings
 # 核心修改：导入cad_service中经过验证的通用保存函数
 from app.services.cad_service import universal_save_temp_file
 
+logger = logging.getLogger(__name__)
+
+# 上传文件流式落盘时每次读取的块大小（1MB）
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+@lru_cache(maxsize=1)
 def _get_project_root() -> Path:
     """Resolve project root. Can be overridden with PROJECT_ROOT env var."""
     env_root = os.getenv("PROJECT_ROOT")
@@ -24,6 +40,73 @@ def save_temp_file(content: bytes, filename: str, temp_dir: Optional[str] = None
     if temp_dir:
         # 从旧的temp_dir参数中提取子目录名称
         sub_dir = Path(temp_dir).name or sub_dir
-    
+
     # 调用统一的保存函数
-    return universal_save_temp_file(content, filename, sub_dir=sub_dir)
\ No newline at end of file
+    return universal_save_temp_file(content, filename, sub_dir=sub_dir)
+
+async def save_upload_file(file: UploadFile, hasher=None) -> str:
+    """
+    将上传文件按块流式写入临时目录，避免整个文件一次性读入事件循环进程的内存
+    :param file: FastAPI上传的文件对象
+    :param hasher: 可选的hashlib对象，落盘时顺带按块计算内容哈希（用于结果缓存）
+    :return: 临时文件绝对路径（交给Celery任务按路径读取）
+    """
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    # uuid前缀保证并发上传同名文件时互不覆盖
+    temp_path = os.path.join(settings.UPLOAD_TEMP_DIR, f"{uuid.uuid4().hex}_{Path(file.filename).name}")
+
+    # Starlette的上传文件超过阈值会溢写到磁盘临时文件，这时直接内核态拷贝，不经过Python bytes
+    if settings.UPLOAD_ZERO_COPY and sys.platform.startswith("linux") and getattr(file.file, "_rolled", False):
+        await anyio.to_thread.run_sync(_sendfile_upload, file.file, temp_path, hasher)
+        logger.info("上传文件已零拷贝保存：%s", temp_path)
+        return temp_path
+
+    async with await anyio.open_file(temp_path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+
+    logger.info("上传文件已流式保存：%s", temp_path)
+    return temp_path
+
+def _sendfile_upload(src_file, dest_path: str, hasher=None) -> None:
+    """用sendfile把已落盘的上传临时文件拷到目标路径，哈希走mmap映射计算"""
+    src_file.flush()
+    src_fd = src_file.fileno()
+    size = os.fstat(src_fd).st_size
+    offset = 0
+    with open(dest_path, "wb") as out:
+        while offset < size:
+            sent = os.sendfile(out.fileno(), src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    if hasher is not None:
+        with open_mapped_file(dest_path) as mm:
+            hasher.update(mm)
+
+@contextmanager
+def open_mapped_file(file_path: str):
+    """
+    以只读mmap方式打开文件，不再整体拷贝一次
+    映射支持缓冲区协议（哈希、写文件、np.frombuffer、str(mm, 编码)都可直接用），但它不是bytes：
+    没有decode等bytes方法，isinstance(mm, bytes)也不成立；只认bytes的接口（如fitz的stream）需先bytes(mm)。
+    映射在with块结束时关闭，不要在块外保留映射或基于它的memoryview/数组
+    """
+    with open(file_path, "rb") as f:
+        # 空文件无法mmap，直接给空字节
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def remove_temp_file(file_path: str) -> None:
+    """删除临时文件，失败只记录日志不抛异常"""
+    try:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+            logger.info("清理临时文件：%s", file_path)
+    except Exception as e:
+        logger.warning("清理临时文件失败：%s，错误：%s", file_path, e)
@@ -0,0 +1,28 @@
+import numpy as np
+import cv2
+
+def autocontrast_gray(img: np.ndarray, cutoff: float = 2) -> np.ndarray:
+    """
+    灰度图自动对比度（等价于ImageOps.autocontrast(cutoff)）：
+    直方图两端各去掉cutoff%的像素后线性拉伸到0-255，用查找表原地映射
+    :param img: 可写的uint8单通道数组（会被原地修改）
+    """
+    hist = cv2.calcHist([img], [0], None, [256], [0, 256]).ravel()
+    cut = img.size * cutoff / 100
+    cumsum = np.cumsum(hist)
+    lo = int(np.searchsorted(cumsum, cut, side="right"))
+    hi = int(np.searchsorted(cumsum, img.size - cut, side="left"))
+    if hi <= lo:
+        return img
+    lut = np.clip((np.arange(256) - lo) * (255.0 / (hi - lo)), 0, 255).astype(np.uint8)
+    return cv2.LUT(img, lut, dst=img)
+
+def to_gray_array(image) -> np.ndarray:
+    """PIL图片或RGB/RGBA/灰度像素数组统一转成uint8灰度数组（本身已是灰度时不拷贝，结果可能只读）"""
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY if image.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+    if image.mode == "L":
+        return np.asarray(image)
+    return np.asarray(image.convert("L"))
@@ -1,24 +1,121 @@
+import os
+import mmap
+from functools import lru_cache
 
+try:
+    import ahocorasick  # pyahocorasick：多关键字一次扫描匹配
+except ImportError:  # 未安装时退回纯Python字典树
+    ahocorasick = None
 
-def load_prompts_from_text_file(file_path: str = "Company Rules") -> dict:
+
+# 默认规则文件：随代码发布的app/company_rules.txt（按本文件位置定位，不依赖启动目录）
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "company_rules.txt")
+
+# 规则文件里图纸类型/Prompt之间的分隔符（"="是ASCII，不会落在UTF-8多字节字符中间）
+_SEGMENT_SEP = b"==="
+
+
+class _PromptDict(dict):
+    """带关键字匹配自动机的Prompt字典（loader缓存的结果，随字典一起复用）"""
+    matcher = None
+
+
+class _PromptTrie:
     """
-    从名为Company Rules的文本文件中加载图纸类型与对应Prompt的字典
-    :param file_path: 文本文件路径，默认同目录下的Company Rules
-    :return: 键：图纸类型，值：对应Prompt
+    pyahocorasick未安装时的字典树匹配器，接口与Automaton.iter一致：
+    从名称每个位置出发沿树走一遍，找出所有出现的图纸类型（与键的个数无关）
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def add_word(self, word: str, value) -> None:
+        node = self._root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[None] = value  # None键存放以该节点结尾的词的值
+
+    def iter(self, text: str):
+        root = self._root
+        for start in range(len(text)):
+            node = root
+            for end in range(start, len(text)):
+                node = node.get(text[end])
+                if node is None:
+                    break
+                if None in node:
+                    yield end, node[None]
+
+
+def _match_priority(order: int, drawing_type: str) -> tuple:
+    """匹配优先级（越小越优先）：图纸类型越长越具体越优先，一样长时按规则文件中的顺序"""
+    return -len(drawing_type), order, drawing_type
+
+
+def _build_prompt_matcher(prompt_dict: dict):
     """
-    prompt_dict = {}
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
-        # 按分隔符拆分，获取所有「图纸类型===Prompt」片段
-        segments = content.split("===")
-        # 第一个元素为空（若文件开头无内容），从第二个元素开始处理
-        for i in range(1, len(segments), 2):
-            if i + 1 < len(segments):
-                drawing_type = segments[i].strip()  # 图纸类型
-                prompt = segments[i + 1].strip()    # 对应Prompt
+    把所有图纸类型（忽略大小写）建成Aho-Corasick自动机（或字典树），值为匹配优先级；
+    倒序加入，忽略大小写后重复的图纸类型保留文件中靠前的那个
+    """
+    if not prompt_dict:
+        return None
+    matcher = _PromptTrie() if ahocorasick is None else ahocorasick.Automaton()
+    for order, drawing_type in reversed(list(enumerate(prompt_dict))):
+        if drawing_type:
+            matcher.add_word(drawing_type.casefold(), _match_priority(order, drawing_type))
+    if ahocorasick is not None:
+        matcher.make_automaton()
+    return matcher
+
+
+def _iter_segments(mm):
+    """
+    在mmap的字节上用find逐行定位，产出每行「图纸类型===Prompt」的(图纸类型, Prompt)字节切片：
+    只切出要保留的片段，不拷贝整份文本也不建行列表；没有分隔符的行（空行、说明文字）跳过
+    """
+    sep_len = len(_SEGMENT_SEP)
+    size = len(mm)
+    line_start = 0
+    while line_start < size:
+        line_end = mm.find(b"\n", line_start)
+        if line_end == -1:
+            line_end = size
+        sep = mm.find(_SEGMENT_SEP, line_start, line_end)
+        if sep != -1:
+            yield mm[line_start:sep], mm[sep + sep_len:line_end]
+        line_start = line_end + 1
+
+
+@lru_cache(maxsize=8)
+def _load_prompts_cached(file_path: str, mtime_ns: int) -> dict:
+    """按(路径, 修改时间)缓存解析结果，规则文件改动后自动重新加载"""
+    prompt_dict = _PromptDict()
+    with open(file_path, "rb") as f:
+        # 空文件无法mmap
+        if os.fstat(f.fileno()).st_size == 0:
+            return prompt_dict
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for raw_type, raw_prompt in _iter_segments(mm):
+                drawing_type = raw_type.decode("utf-8").strip()  # 图纸类型
+                prompt = raw_prompt.decode("utf-8").strip()      # 对应Prompt
                 prompt_dict[drawing_type] = prompt
+    prompt_dict.matcher = _build_prompt_matcher(prompt_dict)
     return prompt_dict
 
+
+def load_prompts_from_text_file(file_path: str = DEFAULT_RULES_PATH) -> dict:
+    """
+    从公司规则文本文件中加载图纸类型与对应Prompt的字典
+    文件未修改时直接返回缓存（只多一次os.stat），调用方不要修改返回的字典
+    :param file_path: 文本文件路径，默认app/company_rules.txt
+    :return: 键：图纸类型，值：对应Prompt
+    """
+    return _load_prompts_cached(file_path, os.stat(file_path).st_mtime_ns)
+
+def clear_prompt_cache() -> None:
+    """清空已解析的Prompt缓存（测试替换规则文件、或需要强制重新加载时调用）"""
+    _load_prompts_cached.cache_clear()
+
 def get_prompt_by_drawing_name(drawing_name: str, prompt_dict: dict) -> str:
     """
     根据图纸名称从字典中匹配对应Prompt
@@ -33,9 +130,21 @@ def get_prompt_by_drawing_name(drawing_name: str, prompt_dict: dict) -> str:
 3. **改进建议**：针对识别出的问题给出具体改进建议；若无问题，说明设计优势。
 要求：结果结构化，分“提取结果”“问题识别”“改进建议”三部分返回。"""
     
-    for drawing_type, prompt in prompt_dict.items():
-        if drawing_type in drawing_name:
-            return prompt
+    # 名称只做一次casefold，图纸类型在建自动机时已casefold过
+    drawing_name_cf = drawing_name.casefold()
+    matcher = getattr(prompt_dict, "matcher", None)
+    if matcher is not None:
+        # 一次扫描找出名称里出现的所有图纸类型，取最具体（最长）的那个，避免短的通用类型盖过专用规则
+        hits = [value for _, value in matcher.iter(drawing_name_cf)]
+        return prompt_dict[min(hits)[2]] if hits else default_prompt
+
+    # 调用方自己传入的普通字典：按同样的优先级逐个匹配
+    ranked = sorted(
+        (_match_priority(order, drawing_type) for order, drawing_type in enumerate(prompt_dict) if drawing_type)
+    )
+    for _, _, drawing_type in ranked:
+        if drawing_type.casefold() in drawing_name_cf:
+            return prompt_dict[drawing_type]
     return default_prompt
 
 # 示例使用
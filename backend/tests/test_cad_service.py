@@ -5,11 +5,18 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import io
+import asyncio
+from collections import deque
 import pytest
+import ezdxf
+import fitz  # PyMuPDF
+import numpy as np
 from pdf2image import convert_from_bytes
-from app.services.cad_service import process_pdf_service  # 现在能正确导入了
+from app.services.cad_service import process_pdf_service, rebind_result_filename, _read_dxf_bytes, _pipeline_pdf_ocr  # 现在能正确导入了
 from app.services.ocr_service import baidu_ocr
 from app.core.config import settings
+from app.services import ocr_service, cad_service
+from app.utils.file_utils import open_mapped_file
 
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="ezdxf")
@@ -21,55 +28,220 @@ TEST_PDF_PATH = os.path.join(os.path.dirname(__file__), "test.pdf")
 POPPLER_PATH = settings.POPPLER_PATH  # 建议把poppler路径配置到settings里
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_pdf_bytes():
-    """夹具：读取测试PDF的二进制内容"""
+    """夹具：读取测试PDF的二进制内容（整个测试会话只读一次）"""
     with open(TEST_PDF_PATH, "rb") as f:
         return f.read()
 
 
-def test_pdf_to_image(test_pdf_bytes):
+@pytest.fixture(scope="session")
+def pdf_images(test_pdf_bytes):
+    """夹具：PDF转成的页面图片，整个测试会话只转换一次；150DPI足够验证转换和OCR，内存只有300DPI的1/4"""
+    return convert_from_bytes(
+        test_pdf_bytes,
+        dpi=150,
+        fmt="png",
+        poppler_path=POPPLER_PATH
+    )
+
+
+def test_pdf_to_image(pdf_images):
     """单元测试：PDF转图片功能"""
     try:
-        images = convert_from_bytes(
-            test_pdf_bytes,
-            dpi=300,
-            fmt="png",
-            poppler_path=POPPLER_PATH
-        )
-        assert len(images) > 0, "PDF转图片失败，未生成任何图片"
+        assert len(pdf_images) > 0, "PDF转图片失败，未生成任何图片"
         # 验证图片是否有效
         img_byte_arr = io.BytesIO()
-        images[0].save(img_byte_arr, format='PNG')
+        pdf_images[0].save(img_byte_arr, format='PNG')
         assert len(img_byte_arr.getvalue()) > 0, "生成的图片为空"
     except Exception as e:
         pytest.fail(f"PDF转图片测试失败：{str(e)}")
 
 
-def test_ocr_on_pdf_image(test_pdf_bytes):
+def test_ocr_on_pdf_image(pdf_images):
     """单元测试：PDF转图片后OCR识别"""
-    # 先转图片
-    images = convert_from_bytes(
-        test_pdf_bytes,
-        dpi=300,
-        poppler_path=POPPLER_PATH
-    )
-    # 取第一页转字节流，保存为临时文件
-    temp_img_path = os.path.join(os.path.dirname(__file__), "temp_test.png")
-    images[0].save(temp_img_path, format='PNG')
-    
+    # 取第一页转成PNG字节直接交给OCR，不写临时文件（并行跑测试时也不会互相覆盖）
+    img_byte_arr = io.BytesIO()
+    pdf_images[0].save(img_byte_arr, format='PNG')
+
     # 调用OCR
-    ocr_result = baidu_ocr(temp_img_path)
+    ocr_result = baidu_ocr(image_bytes=img_byte_arr.getvalue())
     # 验证OCR结果
     assert isinstance(ocr_result, str), "OCR返回结果不是字符串"
     assert len(ocr_result.strip()) > 0, "OCR识别结果为空"
-    
-    # 清理临时文件
-    os.remove(temp_img_path)
 
 
 def test_process_pdf_service_integration(test_pdf_bytes):
     """集成测试：调用项目中的process_pdf_service"""
     result = process_pdf_service(test_pdf_bytes, filename="test.pdf")
     assert result["status"] == "success", f"PDF处理失败：{result.get('message')}"
-    assert "ocr" in result["result"], "处理结果中缺少OCR数据"
\ No newline at end of file
+    assert "ocr" in result["result"], "处理结果中缺少OCR数据"
+
+
+# ========== 回归测试：Celery任务把上传文件以只读mmap交给服务层 ==========
+def test_pdf_pipeline_on_mapped_file(tmp_path, monkeypatch):
+    """回归测试：只读mmap可以直接交给PDF渲染+OCR流水线（fitz的stream不接受mmap）"""
+    pdf_path = tmp_path / "mapped.pdf"
+    with fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), "Electrical drawing mapped page")
+        doc.save(str(pdf_path))
+
+    # 不访问百度接口：需要OCR的页面直接返回固定结果，只验证打开/渲染这条路径
+    monkeypatch.setattr(
+        ocr_service, "perform_ocr_service",
+        lambda img, file_type, *args, **kwargs: {
+            "status": "success",
+            "structured_data": {"text": "stub", "file_type": file_type, "page_count": 1}
+        }
+    )
+    with open_mapped_file(str(pdf_path)) as file_content:
+        ocr_results = asyncio.run(_pipeline_pdf_ocr(file_content))
+    assert len(ocr_results) == 1
+    assert ocr_results[0]["status"] == "success"
+
+
+def test_perform_ocr_service_on_mapped_image(tmp_path, monkeypatch):
+    """回归测试：只读mmap按图片字节交给OCR，而不是被当成已解码的图片对象"""
+    # 随机内容保证不命中任何OCR结果缓存
+    content = b"\x89PNG\r\n\x1a\n" + os.urandom(64)
+    img_path = tmp_path / "page.png"
+    img_path.write_bytes(content)
+
+    # 不访问百度接口和Redis，只验证服务层把映射按哪种入参交给baidu_ocr
+    calls = []
+    def fake_baidu_ocr(**kwargs):
+        calls.append({key: bytes(value) if key == "image_bytes" else value for key, value in kwargs.items()})
+        return "配电箱"
+    monkeypatch.setattr(ocr_service, "baidu_ocr", fake_baidu_ocr)
+    monkeypatch.setattr(ocr_service, "cache_get", lambda key: None)
+    monkeypatch.setattr(ocr_service, "cache_set", lambda key, value, expire=None: None)
+
+    with open_mapped_file(str(img_path)) as file_content:
+        result = ocr_service.perform_ocr_service(file_content, "image")
+    assert result["status"] == "success", result
+    assert result["structured_data"]["text"] == "配电箱"
+    assert calls == [{"image_bytes": content}]
+
+
+def test_read_dxf_from_mapped_file(tmp_path):
+    """回归测试：只读mmap可以直接解析为DXF文档（mmap没有decode方法）"""
+    dxf_path = tmp_path / "line.dxf"
+    doc = ezdxf.new()
+    doc.modelspace().add_line((0, 0), (10, 10))
+    doc.saveas(dxf_path)
+
+    with open_mapped_file(str(dxf_path)) as file_content:
+        parsed = _read_dxf_bytes(file_content)
+    assert len(parsed.modelspace().query("LINE")) == 1
+
+
+def test_process_batch_service_submits_one_dashscope_batch(monkeypatch):
+    """批量处理：未命中缓存的图纸达到AI_BATCH_MIN_SIZE时一次性提交批处理，结果按原顺序返回"""
+    monkeypatch.setattr(
+        ocr_service, "perform_ocr_service",
+        lambda img, file_type, *args, **kwargs: {
+            "status": "success",
+            "structured_data": {"text": bytes(img).decode(), "file_type": file_type}
+        }
+    )
+    monkeypatch.setattr(settings, "AI_BATCH_MIN_SIZE", 2)
+    ai_service = cad_service.ai_service_instance
+    monkeypatch.setattr(ai_service, "available_models", ["qianwen"])
+    monkeypatch.setattr("app.services.ai_service.cache_get", lambda key: None)
+    monkeypatch.setattr("app.services.ai_service.cache_set", lambda key, value, expire=None: None)
+
+    submitted = []
+    def fake_batch(prompts):
+        submitted.append(sorted(prompts))
+        return {custom_id: {"status": "success", "content": f"结论{custom_id}", "model_used": "qianwen"}
+                for custom_id in prompts}
+    monkeypatch.setattr(ai_service, "_run_dashscope_batch", fake_batch)
+
+    results = cad_service.process_batch_service([(b"drawing-a", "a.png"), (b"drawing-b", "b.jpg")])
+    assert submitted == [["0", "1"]]
+    assert [r["status"] for r in results] == ["success", "success"]
+    assert [r["result"]["ai_review"]["review_result"] for r in results] == ["结论0", "结论1"]
+    assert [r["result"]["report"]["filename"] for r in results] == ["a.png", "b.jpg"]
+
+
+def test_rebind_result_filename_on_cache_hit():
+    """同内容换个文件名再上传：复用的结果里文件名换成新的，缓存里的原结果不被修改"""
+    ai_review = {"status": "success", "review_result": "通过", "filename": "old.dxf"}
+    cached = {
+        "status": "success",
+        "result": {"ocr": {}, "ai_review": ai_review,
+                   "report": {"status": "success", "ai_result": ai_review, "filename": "old.dxf"}},
+        "message": "DXF文件处理完成"
+    }
+    rebound = rebind_result_filename(cached, "new.dxf")
+    assert rebound["result"]["ai_review"]["filename"] == "new.dxf"
+    assert rebound["result"]["report"]["filename"] == "new.dxf"
+    assert rebound["result"]["report"]["ai_result"]["filename"] == "new.dxf"
+    assert cached["result"]["ai_review"]["filename"] == "old.dxf"
+
+    failed = {"status": "failed", "message": "DXF文件处理失败"}
+    assert rebind_result_filename(failed, "new.dxf") is failed
+
+
+def test_parsed_dxf_doc_is_handed_to_one_caller(tmp_path):
+    """转换校验时登记的文档只交给一个调用方（ezdxf文档非线程安全，不跨调用共享）"""
+    dxf_path = tmp_path / "converted.dxf"
+    doc = ezdxf.new()
+    doc.saveas(dxf_path)
+    cad_service._remember_dxf_doc(dxf_path, doc)
+
+    assert cad_service._read_dxf_once(str(dxf_path)) is doc
+    assert cad_service._read_dxf_once(str(dxf_path)) is not doc
+
+
+def test_reused_temp_file_is_not_evicted_first(tmp_path, monkeypatch):
+    """复用的临时文件移到队尾：淘汰的是最久未用的，不是正在复用的"""
+    monkeypatch.setattr(cad_service, "_recent_temp_files", deque())
+    first, second, third = (tmp_path / f"{name}.dxf" for name in ("first", "second", "third"))
+    for path in (first, second, third):
+        path.write_bytes(b"0")
+
+    cad_service._track_temp_file(first, keep_latest=2)
+    cad_service._track_temp_file(second, keep_latest=2)
+    cad_service._track_temp_file(first, keep_latest=2)
+    cad_service._track_temp_file(third, keep_latest=2)
+
+    assert list(cad_service._recent_temp_files) == [first, third]
+    assert first.exists() and third.exists()
+    assert not second.exists()
+
+
+@pytest.fixture
+def layered_dxf(tmp_path):
+    dxf_path = tmp_path / "layers.dxf"
+    doc = ezdxf.new()
+    msp = doc.modelspace()
+    msp.add_line((0, 0), (10, 5), dxfattribs={"layer": "电缆"})
+    msp.add_text("QF1", dxfattribs={"layer": "标注", "insert": (2, 3)})
+    doc.saveas(dxf_path)
+    return dxf_path
+
+
+def test_extract_layers_from_dxf_keeps_per_entity_records(layered_dxf):
+    layers = cad_service.extract_layers_from_dxf(str(layered_dxf))
+    assert layers["电缆"] == [{"type": "LINE", "handle": layers["电缆"][0]["handle"], "layer": "电缆",
+                              "start": (0.0, 0.0), "end": (10.0, 5.0)}]
+    assert layers["标注"][0]["text"] == "QF1"
+    assert layers["标注"][0]["insert"] == (2.0, 3.0)
+
+
+def test_extract_layer_columns_from_dxf_shape(layered_dxf, tmp_path, monkeypatch):
+    """按列提取：每个图层一组等长数组，坐标为float32；第二次调用读磁盘缓存，结果一致"""
+    monkeypatch.setattr(type(settings), "DXF_LAYER_CACHE_DIR", str(tmp_path / "layer_cache"))
+    for _ in range(2):
+        layers = cad_service.extract_layer_columns_from_dxf(str(layered_dxf))
+        assert set(layers) == {"电缆", "标注"}
+        line = layers["电缆"]
+        assert set(line) == {"type", "handle", "text", "x0", "y0", "x1", "y1"}
+        assert list(line["type"]) == ["LINE"]
+        assert line["x1"].dtype == np.float32
+        assert (line["x0"][0], line["y0"][0], line["x1"][0], line["y1"][0]) == (0, 0, 10, 5)
+        text = layers["标注"]
+        assert list(text["text"]) == ["QF1"]
+        assert (text["x0"][0], text["y0"][0]) == (2, 3)
+        assert np.isnan(text["x1"][0])
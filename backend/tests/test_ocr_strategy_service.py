@@ -0,0 +1,28 @@
+# backend/tests/test_ocr_strategy_service.py
+import sys
+import os
+# 解决模块导入问题：将项目根目录加入Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+
+# 没装tesserocr时走pytesseract子进程，不涉及常驻句柄
+pytest.importorskip("tesserocr")
+
+from PIL import Image
+from app.core.config import settings
+from app.services import ocr_strategy_service
+from app.services.ocr_strategy_service import _borrow_tess_api
+
+
+def test_borrow_tess_api_builds_and_reuses_handle():
+    """真实创建tesserocr句柄：按配置的psm/oem初始化，用完归还后下次复用同一个句柄"""
+    psm = settings.TESSERACT_IMAGE_PSM
+    with _borrow_tess_api(psm) as api:
+        assert api.GetPageSegMode() == psm
+        api.SetImage(Image.new("L", (64, 32), 255))
+        assert isinstance(api.GetUTF8Text(), str)
+    assert ocr_strategy_service._idle_tess_apis[psm] == [api]
+
+    with _borrow_tess_api(psm) as reused:
+        assert reused is api
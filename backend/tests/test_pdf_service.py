@@ -0,0 +1,28 @@
+# backend/tests/test_pdf_service.py
+import sys
+import os
+# 解决模块导入问题：将项目根目录加入Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+from app.services.pdf_service import generate_review_pdf_streaming
+
+
+def test_streaming_pdf_propagates_source_error_and_removes_file(tmp_path, monkeypatch):
+    """流式生成PDF时上游中断：原异常直接抛出（不包成"PDF生成失败"），output里不留半截报告"""
+    monkeypatch.chdir(tmp_path)
+
+    def broken_stream():
+        yield "总体结论：通过\n"
+        raise ConnectionError("stream interrupted")
+
+    with pytest.raises(ConnectionError, match="stream interrupted"):
+        generate_review_pdf_streaming(broken_stream(), filename="drawing.pdf")
+    assert not any((tmp_path / "output").iterdir())
+
+
+def test_streaming_pdf_writes_report(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pdf_path = generate_review_pdf_streaming(iter(["总体结论：", "通过\n图纸编号：DQ-1"]), filename="drawing.pdf")
+    with open(pdf_path, "rb") as f:
+        assert f.read(5) == b"%PDF-"
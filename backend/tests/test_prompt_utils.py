@@ -0,0 +1,24 @@
+# backend/tests/test_prompt_utils.py
+import sys
+import os
+# 解决模块导入问题：将项目根目录加入Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils.prompt_utils import load_prompts_from_text_file, get_prompt_by_drawing_name
+
+
+def test_load_bundled_company_rules():
+    """默认路径就是随代码发布的app/company_rules.txt，每行一个「图纸类型===Prompt」"""
+    prompt_dict = load_prompts_from_text_file()
+    assert "电气主接线图" in prompt_dict
+    assert "220千伏主变间隔断面图" in prompt_dict
+    assert all("===" not in drawing_type and "\n" not in drawing_type for drawing_type in prompt_dict)
+
+    prompt = get_prompt_by_drawing_name("XX项目220千伏主变间隔断面图.dwg", prompt_dict)
+    assert "220千伏主变间隔断面图" in prompt
+
+
+def test_load_rules_skips_lines_without_separator(tmp_path):
+    rules_path = tmp_path / "rules.txt"
+    rules_path.write_text("说明：每行一条规则\n保护配置图===审查保护配置\n\n", encoding="utf-8")
+    assert load_prompts_from_text_file(str(rules_path)) == {"保护配置图": "审查保护配置"}